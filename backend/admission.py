@@ -0,0 +1,293 @@
+"""Call admission control per trunk.
+
+Every origination takes a lease on its trunk, and on the global limit when
+``ADMISSION_MAX_CALLS`` is set, before it is placed, so a trunk never carries
+more than its ``TrunkSettings.max_calls``. Each limit is a counter plus a FIFO
+of waiters in this process: acquire and release are O(1), a released slot is
+handed straight to the longest waiter so nobody is starved, and waiters give
+up with ``AdmissionTimeout`` after a timeout.
+
+With a database the slot is also leased from a counter document in
+``admission_leases`` with a conditional ``$inc``, so the limits hold across
+uvicorn workers. Each worker records its share of every counter and a
+heartbeat in ``admission_workers``; the shares of a worker whose heartbeat
+stops are handed back by the others.
+
+Trunks without settings (or without a ``trunk`` name) are not limited.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, List, Optional, Set
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+ACQUIRE_TIMEOUT = 30.0
+HEARTBEAT_INTERVAL = 5.0
+WORKER_TTL = 30.0
+LEASE_POLL_MIN = 0.02
+LEASE_POLL_MAX = 0.5
+GLOBAL_KEY = "global"
+
+
+class AdmissionTimeout(Exception):
+    """Raised when no slot frees up before the timeout."""
+
+
+def trunk_key(trunk: str) -> str:
+    return f"trunk:{trunk}"
+
+
+@dataclass
+class _Gate:
+    limit: int
+    in_use: int = 0
+    waiters: Deque[asyncio.Future] = field(default_factory=deque)
+    acquired: int = 0
+    rejected: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+
+
+class GateMetrics(BaseModel):
+    key: str
+    limit: int
+    in_use: int
+    waiting: int
+    acquired: int
+    rejected: int
+    avg_wait_ms: float
+    max_wait_ms: float
+
+
+@dataclass
+class Lease:
+    keys: List[str]
+    distributed: bool
+    released: bool = False
+
+
+class AdmissionController:
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self._gates: Dict[str, _Gate] = {}
+        self._db = None
+        self._lease_docs: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def set_limit(self, key: str, limit: int):
+        gate = self._gates.get(key)
+        if gate is None:
+            self._gates[key] = _Gate(limit)
+            return
+        gate.limit = limit
+        # A raised limit admits waiters straight away
+        while gate.in_use < gate.limit and self._hand_over(gate):
+            gate.in_use += 1
+
+    def keys_for(self, trunk: str) -> List[str]:
+        keys = [GLOBAL_KEY, trunk_key(trunk)]
+        return [key for key in keys if key in self._gates]
+
+    def headroom(self, trunk: str) -> Optional[int]:
+        """Free slots on ``trunk``'s tightest limit here; None if unlimited."""
+        gates = [self._gates[key] for key in self.keys_for(trunk)]
+        if not gates:
+            return None
+        return max(min(gate.limit - gate.in_use for gate in gates), 0)
+
+    async def acquire(self, trunk: str, timeout: float = ACQUIRE_TIMEOUT) -> Lease:
+        """Take a slot on every limit ``trunk`` is subject to."""
+        deadline = time.monotonic() + timeout
+        lease = Lease([], distributed=self._db is not None)
+        try:
+            # Always the same key order, so concurrent acquirers cannot deadlock
+            for key in self.keys_for(trunk):
+                await self._take(key, deadline, lease.distributed)
+                lease.keys.append(key)
+        except BaseException:
+            await self.release(lease)
+            raise
+        return lease
+
+    async def release(self, lease: Lease):
+        if lease.released:
+            return
+        lease.released = True
+        for key in reversed(lease.keys):
+            try:
+                if lease.distributed:
+                    await self._db.admission_leases.update_one(
+                        {"id": key},
+                        {"$inc": {"in_use": -1, f"workers.{self.worker_id}": -1}},
+                    )
+            except Exception:
+                logger.exception("Returning the %s lease failed", key)
+            finally:
+                self._release_local(key)
+
+    async def _take(self, key: str, deadline: float, distributed: bool):
+        gate = self._gates[key]
+        await self._acquire_local(key, gate, deadline)
+        if not distributed:
+            return
+        try:
+            await self._acquire_lease(key, gate, deadline)
+        except BaseException:
+            self._release_local(key)
+            raise
+
+    async def _acquire_local(self, key: str, gate: _Gate, deadline: float):
+        started = time.monotonic()
+        if gate.in_use < gate.limit and not gate.waiters:
+            gate.in_use += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            gate.waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, max(deadline - started, 0))
+            except BaseException as e:
+                if waiter.done() and not waiter.cancelled():
+                    # Cancelled after the slot was handed over: pass it on
+                    self._release_local(key)
+                elif waiter in gate.waiters:
+                    gate.waiters.remove(waiter)
+                if isinstance(e, asyncio.TimeoutError):
+                    gate.rejected += 1
+                    raise AdmissionTimeout(key) from None
+                raise
+        waited = time.monotonic() - started
+        gate.acquired += 1
+        gate.wait_total += waited
+        gate.wait_max = max(gate.wait_max, waited)
+
+    def _hand_over(self, gate: _Gate) -> bool:
+        """Wake the longest waiter; the slot passes to it without a release."""
+        while gate.waiters:
+            waiter = gate.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return True
+        return False
+
+    def _release_local(self, key: str):
+        gate = self._gates.get(key)
+        if gate is None:
+            return
+        if gate.in_use > gate.limit or not self._hand_over(gate):
+            gate.in_use -= 1
+
+    async def _acquire_lease(self, key: str, gate: _Gate, deadline: float):
+        leases = self._db.admission_leases
+        if key not in self._lease_docs:
+            await leases.update_one(
+                {"id": key}, {"$setOnInsert": {"in_use": 0}}, upsert=True
+            )
+            self._lease_docs.add(key)
+        delay = LEASE_POLL_MIN
+        while True:
+            result = await leases.update_one(
+                {"id": key, "in_use": {"$lt": gate.limit}},
+                {"$inc": {"in_use": 1, f"workers.{self.worker_id}": 1}},
+            )
+            if result.modified_count:
+                return
+            # Another worker holds the slots; poll with backoff
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                gate.rejected += 1
+                raise AdmissionTimeout(key)
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, LEASE_POLL_MAX)
+
+    def metrics(self) -> List[GateMetrics]:
+        return [
+            GateMetrics(
+                key=key,
+                limit=gate.limit,
+                in_use=gate.in_use,
+                waiting=len(gate.waiters),
+                acquired=gate.acquired,
+                rejected=gate.rejected,
+                avg_wait_ms=(
+                    gate.wait_total / gate.acquired * 1000 if gate.acquired else 0.0
+                ),
+                max_wait_ms=gate.wait_max * 1000,
+            )
+            for key, gate in sorted(self._gates.items())
+        ]
+
+    async def load_limits(self, db):
+        async for settings in db.trunk_settings.find(
+            {"trunk": {"$ne": None}}, {"_id": 0, "trunk": 1, "max_calls": 1}
+        ):
+            self.set_limit(trunk_key(settings["trunk"]), settings["max_calls"])
+
+    async def _heartbeat(self):
+        now = datetime.now(timezone.utc)
+        workers = self._db.admission_workers
+        await workers.update_one(
+            {"id": self.worker_id}, {"$set": {"seen_at": now}}, upsert=True
+        )
+        async for worker in workers.find(
+            {"seen_at": {"$lt": now - timedelta(seconds=WORKER_TTL)}}, {"_id": 0}
+        ):
+            logger.warning("Returning leases of stopped worker %s", worker["id"])
+            await self._reap(worker["id"])
+
+    async def live_workers(self, db) -> List[str]:
+        """Ids of the workers whose heartbeat is recent."""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=WORKER_TTL)
+        return await db.admission_workers.distinct("id", {"seen_at": {"$gte": cutoff}})
+
+    async def _reap(self, worker_id: str):
+        """Give back every lease share still recorded for ``worker_id``."""
+        share = f"workers.{worker_id}"
+        async for doc in self._db.admission_leases.find(
+            {share: {"$exists": True}}, {"_id": 0, "id": 1, "workers": 1}
+        ):
+            held = doc["workers"][worker_id]
+            # Conditional on the share read, so a concurrent reaper is a no-op
+            await self._db.admission_leases.update_one(
+                {"id": doc["id"], share: held},
+                {"$inc": {"in_use": -held}, "$unset": {share: ""}},
+            )
+        await self._db.admission_workers.delete_one({"id": worker_id})
+
+    async def start(self, db):
+        global_limit = int(os.environ.get("ADMISSION_MAX_CALLS", 0))
+        if global_limit:
+            self.set_limit(GLOBAL_KEY, global_limit)
+        self._db = db
+        await self.load_limits(db)
+        await self._heartbeat()
+        if self._task is None:
+            self._task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._db is not None:
+            await self._reap(self.worker_id)
+            self._db = None
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                await self._heartbeat()
+                await self.load_limits(self._db)
+            except Exception:
+                logger.exception("Admission heartbeat failed")
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,470 @@
+"""Pooled, multiplexed asyncio client for the Asterisk Manager Interface.
+
+Connections stay logged in and are shared by all callers. Actions are matched
+to responses by ``ActionID`` so any number of them can be outstanding on one
+connection. Action connections log in with ``Events: off``; a single event
+connection reads the event stream and dispatches it to subscribers, which is
+how ``AMIOriginator`` learns about ``OriginateResponse`` and ``Hangup``. A
+connection found down, the event connection included, is reconnected before
+the next action is sent.
+
+A call's channel is known from the ``VarSet`` of its ``CALL_ID`` on, so it can
+be hung up while still ringing. An answered call whose ``Hangup`` event never
+arrives (e.g. lost over a reconnect) is checked with a ``Status`` action every
+``max_call_seconds`` and released once its channel is gone.
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import re
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from dialer import OriginateRequest, OriginateResult
+from platinum_campaigns import CallStatus
+
+logger = logging.getLogger(__name__)
+
+EventHandler = Callable[[Dict[str, str]], None]
+
+# Synthetic event dispatched when the event connection drops
+CONNECTION_LOST = "VeloraConnectionLost"
+
+
+class AMIError(Exception):
+    """Raised when Asterisk rejects an action or the connection is lost."""
+
+
+@dataclass
+class AMISettings:
+    host: str = "127.0.0.1"
+    port: int = 5038
+    username: str = ""
+    secret: str = ""
+    pool_size: int = 2
+    connect_timeout: float = 5.0
+    action_timeout: float = 10.0
+    originate_timeout_ms: int = 30000
+    max_call_seconds: float = 3600.0
+
+    @classmethod
+    def from_env(cls) -> "AMISettings":
+        return cls(
+            host=os.environ.get("AMI_HOST", cls.host),
+            port=int(os.environ.get("AMI_PORT", cls.port)),
+            username=os.environ.get("AMI_USERNAME", cls.username),
+            secret=os.environ.get("AMI_SECRET", cls.secret),
+            pool_size=int(os.environ.get("AMI_POOL_SIZE", cls.pool_size)),
+            originate_timeout_ms=int(
+                os.environ.get("AMI_ORIGINATE_TIMEOUT_MS", cls.originate_timeout_ms)
+            ),
+            max_call_seconds=float(
+                os.environ.get("AMI_MAX_CALL_SECONDS", cls.max_call_seconds)
+            ),
+        )
+
+
+def encode_message(fields: Dict) -> bytes:
+    lines = []
+    for key, value in fields.items():
+        # Repeated headers such as Variable are given as a list
+        values = value if isinstance(value, (list, tuple)) else [value]
+        lines.extend(f"{key}: {v}" for v in values)
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+def decode_message(block: bytes) -> Dict[str, str]:
+    message: Dict[str, str] = {}
+    for line in block.decode(errors="replace").split("\r\n"):
+        key, sep, value = line.partition(":")
+        if sep:
+            message[key.strip()] = value.strip()
+    return message
+
+
+class AMIConnection:
+    """One authenticated AMI session with ActionID multiplexing."""
+
+    def __init__(
+        self,
+        settings: AMISettings,
+        events: bool = False,
+        on_event: Optional[EventHandler] = None,
+    ):
+        self.settings = settings
+        self.events = events
+        self.on_event = on_event
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._prefix = uuid.uuid4().hex[:8]
+
+    @property
+    def connected(self) -> bool:
+        return self._read_task is not None and not self._read_task.done()
+
+    @property
+    def outstanding(self) -> int:
+        return len(self._pending)
+
+    def next_action_id(self) -> str:
+        return f"{self._prefix}-{next(self._ids)}"
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.settings.host, self.settings.port),
+            timeout=self.settings.connect_timeout,
+        )
+        # Banner, e.g. "Asterisk Call Manager/5.0.1"
+        await asyncio.wait_for(
+            self._reader.readline(), timeout=self.settings.connect_timeout
+        )
+        self._read_task = asyncio.create_task(self._read_loop())
+        response = await self.send_action(
+            "Login",
+            Username=self.settings.username,
+            Secret=self.settings.secret,
+            Events="on" if self.events else "off",
+        )
+        if response.get("Response") != "Success":
+            await self.close()
+            raise AMIError(response.get("Message", "Authentication failed"))
+
+    async def send_action(
+        self, action: str, action_id: Optional[str] = None, **fields
+    ) -> Dict[str, str]:
+        """Send an action and wait for its ``Response`` message."""
+        if self._writer is None:
+            raise AMIError("Not connected")
+        action_id = action_id or self.next_action_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[action_id] = future
+        message = {"Action": action, "ActionID": action_id, **fields}
+        try:
+            self._writer.write(encode_message(message))
+            await self._writer.drain()
+            return await asyncio.wait_for(future, timeout=self.settings.action_timeout)
+        finally:
+            self._pending.pop(action_id, None)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                block = await self._reader.readuntil(b"\r\n\r\n")
+                message = decode_message(block)
+                if "Event" in message:
+                    if self.on_event:
+                        try:
+                            self.on_event(message)
+                        except Exception:
+                            logger.exception("AMI event handler failed")
+                    continue
+                future = self._pending.get(message.get("ActionID", ""))
+                if future and not future.done():
+                    future.set_result(message)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.warning("AMI connection closed: %s", e)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(AMIError("AMI connection lost"))
+            if self.events and self.on_event:
+                # Let subscribers fail whatever they were waiting for
+                self.on_event({"Event": CONNECTION_LOST})
+
+    async def close(self):
+        if self._writer is not None:
+            try:
+                self._writer.write(encode_message({"Action": "Logoff"}))
+                self._writer.close()
+            except ConnectionError:
+                pass
+            self._writer = None
+        if self._read_task is not None:
+            self._read_task.cancel()
+            self._read_task = None
+
+
+class AMIPool:
+    """A few action connections plus one event-stream connection."""
+
+    def __init__(self, settings: Optional[AMISettings] = None):
+        self.settings = settings or AMISettings.from_env()
+        self._connections: List[AMIConnection] = []
+        self._event_connection: Optional[AMIConnection] = None
+        self._subscribers: List[EventHandler] = []
+        self._lock = asyncio.Lock()
+        self._round_robin = itertools.count()
+
+    def subscribe(self, handler: EventHandler):
+        self._subscribers.append(handler)
+
+    def unsubscribe(self, handler: EventHandler):
+        if handler in self._subscribers:
+            self._subscribers.remove(handler)
+
+    def _dispatch(self, event: Dict[str, str]):
+        for handler in list(self._subscribers):
+            handler(event)
+
+    async def start(self):
+        async with self._lock:
+            if self._event_connection is None or not self._event_connection.connected:
+                self._event_connection = AMIConnection(
+                    self.settings, events=True, on_event=self._dispatch
+                )
+                await self._event_connection.connect()
+            alive = [conn for conn in self._connections if conn.connected]
+            while len(alive) < self.settings.pool_size:
+                conn = AMIConnection(self.settings)
+                await conn.connect()
+                alive.append(conn)
+            self._connections = alive
+
+    @property
+    def connected(self) -> bool:
+        """Whether the event stream and every action connection are up."""
+        events = self._event_connection
+        return (
+            events is not None
+            and events.connected
+            and bool(self._connections)
+            and all(conn.connected for conn in self._connections)
+        )
+
+    async def _acquire(self) -> AMIConnection:
+        # An Originate sent without the event stream would never see its
+        # OriginateResponse; reconnect first, or fail now if Asterisk is down
+        if not self.connected:
+            await self.start()
+        # Least-outstanding first, round-robin between ties
+        offset = next(self._round_robin)
+        count = len(self._connections)
+        return min(
+            (self._connections[(offset + i) % count] for i in range(count)),
+            key=lambda conn: conn.outstanding,
+        )
+
+    async def send_action(
+        self, action: str, action_id: Optional[str] = None, **fields
+    ) -> Dict[str, str]:
+        conn = await self._acquire()
+        return await conn.send_action(action, action_id=action_id, **fields)
+
+    def next_action_id(self) -> str:
+        return f"pool-{uuid.uuid4().hex}"
+
+    async def close(self):
+        for conn in self._connections:
+            await conn.close()
+        self._connections = []
+        if self._event_connection is not None:
+            await self._event_connection.close()
+            self._event_connection = None
+
+
+# Hangup causes are stored by their Asterisk name (AST_CAUSE_* without the
+# prefix), which is what RetryPolicy.causes is keyed by.
+Q850_CAUSES = {
+    "1": "UNALLOCATED",
+    "2": "NO_ROUTE_TRANSIT_NET",
+    "3": "NO_ROUTE_DESTINATION",
+    "6": "CHANNEL_UNACCEPTABLE",
+    "16": "NORMAL_CLEARING",
+    "17": "USER_BUSY",
+    "18": "NO_USER_RESPONSE",
+    "19": "NO_ANSWER",
+    "20": "SUBSCRIBER_ABSENT",
+    "21": "CALL_REJECTED",
+    "22": "NUMBER_CHANGED",
+    "27": "DESTINATION_OUT_OF_ORDER",
+    "28": "INVALID_NUMBER_FORMAT",
+    "29": "FACILITY_REJECTED",
+    "31": "NORMAL_UNSPECIFIED",
+    "34": "NORMAL_CIRCUIT_CONGESTION",
+    "38": "NETWORK_OUT_OF_ORDER",
+    "41": "NORMAL_TEMPORARY_FAILURE",
+    "42": "SWITCH_CONGESTION",
+    "44": "REQUESTED_CHAN_UNAVAIL",
+    "50": "FACILITY_NOT_SUBSCRIBED",
+    "52": "OUTGOING_CALL_BARRED",
+    "58": "BEARERCAPABILITY_NOTAVAIL",
+    "88": "INCOMPATIBLE_DESTINATION",
+    "102": "RECOVERY_ON_TIMER_EXPIRE",
+    "111": "PROTOCOL_ERROR",
+    "127": "INTERWORKING",
+}
+
+# OriginateResponse "Reason" codes (Asterisk AST_CONTROL_*) -> status, cause
+ORIGINATE_REASONS = {
+    "0": (CallStatus.FAILED, "NETWORK_OUT_OF_ORDER"),  # channel not created
+    "1": (CallStatus.NOANSWER, "NO_ANSWER"),  # hung up before answer
+    "3": (CallStatus.NOANSWER, "NO_ANSWER"),  # ringing, no answer before timeout
+    "5": (CallStatus.BUSY, "USER_BUSY"),
+    "8": (CallStatus.FAILED, "NORMAL_CIRCUIT_CONGESTION"),
+}
+
+
+def hangup_cause(event: Dict[str, str]) -> Optional[str]:
+    """Cause name of a Hangup event, from its Q.850 code or else its text."""
+    cause = Q850_CAUSES.get(event.get("Cause", ""))
+    if cause is None and event.get("Cause-txt"):
+        # "User busy" -> "USER_BUSY"
+        cause = "_".join(re.findall(r"[A-Za-z0-9]+", event["Cause-txt"])).upper()
+    return cause
+
+
+@dataclass
+class _TrackedCall:
+    request: OriginateRequest
+    response: asyncio.Future
+    hangup: asyncio.Future
+    channel: Optional[str] = None
+    uniqueid: Optional[str] = None
+    answered_at: Optional[float] = None
+    cause: Optional[str] = None  # of a Hangup seen before the OriginateResponse
+
+
+class AMIOriginator:
+    """``dialer.Originator`` backed by asynchronous AMI Originate actions."""
+
+    def __init__(self, pool: Optional[AMIPool] = None, dialplan_context: str = ""):
+        self.pool = pool or AMIPool()
+        self.dialplan_context = dialplan_context or os.environ.get(
+            "AMI_DIALER_CONTEXT", "velora-platinum-dialer"
+        )
+        self._by_action: Dict[str, _TrackedCall] = {}
+        self._by_uniqueid: Dict[str, _TrackedCall] = {}
+        self._by_call_id: Dict[str, _TrackedCall] = {}
+        self._by_channel: Dict[str, _TrackedCall] = {}
+        self.pool.subscribe(self._on_event)
+
+    def _on_event(self, event: Dict[str, str]):
+        name = event.get("Event")
+        if name == "OriginateResponse":
+            call = self._by_action.get(event.get("ActionID", ""))
+            if call and not call.response.done():
+                # The VarSet channel, if seen, is the real one
+                call.channel = call.channel or event.get("Channel")
+                # Failed originates report "<null>" for the channel fields
+                uniqueid = event.get("Uniqueid")
+                call.uniqueid = uniqueid if uniqueid != "<null>" else None
+                if call.uniqueid:
+                    self._by_uniqueid[call.uniqueid] = call
+                call.response.set_result(event)
+        elif name == "VarSet" and event.get("Variable") == "CALL_ID":
+            # The dialed channel, known before the OriginateResponse
+            call = self._by_call_id.get(event.get("Value", ""))
+            if call and not call.channel:
+                call.channel = event.get("Channel")
+                self._by_channel[call.channel] = call
+        elif name == "Hangup":
+            call = self._by_uniqueid.get(event.get("Uniqueid", ""))
+            if call is None:
+                # A failed originate has no Uniqueid; match its channel
+                call = self._by_channel.get(event.get("Channel", ""))
+            if call and not call.hangup.done():
+                call.cause = hangup_cause(event)
+                call.hangup.set_result(event)
+        elif name == CONNECTION_LOST:
+            for call in self._by_action.values():
+                for future in (call.response, call.hangup):
+                    if not future.done():
+                        future.set_exception(AMIError("AMI event stream lost"))
+
+    async def originate(self, request: OriginateRequest, on_answer):
+        loop = asyncio.get_running_loop()
+        action_id = self.pool.next_action_id()
+        call = _TrackedCall(request, loop.create_future(), loop.create_future())
+        self._by_action[action_id] = call
+        self._by_call_id[request.call_id] = call
+        variables = [f"CAMPAIGN_ID={request.campaign_id}", f"CALL_ID={request.call_id}"]
+        if request.audio_id:
+            variables.append(f"AUDIO_ID={request.audio_id}")
+        timeout_ms = self.pool.settings.originate_timeout_ms
+        try:
+            queued = await self.pool.send_action(
+                "Originate",
+                action_id=action_id,
+                Channel=f"{request.trunk}/{request.number}",
+                Context=self.dialplan_context,
+                Exten="s",
+                Priority="1",
+                Timeout=str(timeout_ms),
+                Async="true",
+                Variable=variables,
+            )
+            if queued.get("Response") != "Success":
+                return OriginateResult(
+                    CallStatus.FAILED, hangup_cause=queued.get("Message")
+                )
+
+            response = await asyncio.wait_for(
+                call.response, timeout=timeout_ms / 1000 + 10
+            )
+            if response.get("Response") != "Success":
+                status, cause = ORIGINATE_REASONS.get(
+                    response.get("Reason", ""), (CallStatus.FAILED, None)
+                )
+                # The Q.850 cause, e.g. UNALLOCATED, when Asterisk reported it
+                return OriginateResult(
+                    status, hangup_cause=call.cause or cause, uniqueid=call.uniqueid
+                )
+
+            call.answered_at = time.monotonic()
+            await on_answer()
+            hangup = await self._wait_hangup(call)
+            return OriginateResult(
+                CallStatus.COMPLETED,
+                duration=round(time.monotonic() - call.answered_at),
+                hangup_cause=hangup_cause(hangup),
+                uniqueid=call.uniqueid,
+            )
+        except asyncio.TimeoutError:
+            return OriginateResult(CallStatus.FAILED, hangup_cause="ORIGINATE_TIMEOUT")
+        finally:
+            self._by_action.pop(action_id, None)
+            self._by_call_id.pop(request.call_id, None)
+            if call.uniqueid:
+                self._by_uniqueid.pop(call.uniqueid, None)
+            if call.channel:
+                self._by_channel.pop(call.channel, None)
+
+    async def _wait_hangup(self, call: _TrackedCall) -> Dict[str, str]:
+        """The call's Hangup event, or ``{}`` once its channel is found gone."""
+        while True:
+            try:
+                return await asyncio.wait_for(
+                    asyncio.shield(call.hangup),
+                    timeout=self.pool.settings.max_call_seconds,
+                )
+            except asyncio.TimeoutError:
+                if not await self._channel_alive(call.channel):
+                    logger.warning("Missed the hangup of %s", call.channel)
+                    return {}
+
+    async def _channel_alive(self, channel: Optional[str]) -> bool:
+        if not channel:
+            return False
+        try:
+            response = await self.pool.send_action("Status", Channel=channel)
+        except (AMIError, asyncio.TimeoutError):
+            return False
+        return response.get("Response") == "Success"
+
+    async def hangup(self, call_id: str):
+        call = self._by_call_id.get(call_id)
+        if call and call.channel:
+            await self.pool.send_action("Hangup", Channel=call.channel)
+
+    async def close(self):
+        self.pool.unsubscribe(self._on_event)
+        await self.pool.close()
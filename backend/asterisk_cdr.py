@@ -0,0 +1,418 @@
+"""Streaming importer for Asterisk ``Master.csv`` CDR files.
+
+The file is read in batches of lines from a byte offset, so a multi-GB night
+of CDRs never sits in memory. Every batch is written with upserts keyed on
+the Asterisk ``uniqueid`` (unique in both target collections), which makes
+re-importing a file, or any part of it, a no-op. Rows carrying the dialplan's
+``CAMPAIGN_ID|AUDIO_ID|DTMF_INPUT`` userfield land in ``platinum_call_logs``
+(merging into the dialer's own log for that channel), and answered rows with
+an accountcode become ``call_records`` for that customer. The offset reached
+is saved in ``cdr_import_checkpoints`` after each batch so an interrupted
+import resumes where it stopped.
+
+Set ``usegmtime=yes`` in ``cdr.conf``; timestamps are stored as UTC.
+
+    python asterisk_cdr.py /var/log/asterisk/cdr-csv/Master.csv [--from-start]
+"""
+
+import asyncio
+import csv
+import logging
+import os
+import sys
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import (
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from platinum_campaigns import CallStatus
+from rating import rating_engine
+from rollups import apply_rollups
+from voip_crm import CallRecord, CdrImportResult
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 2000
+DEFAULT_MASTER_PATH = "/var/log/asterisk/cdr-csv/Master.csv"
+
+# cdr_csv layout with loguniqueid=yes and loguserfield=yes in cdr.conf
+DEFAULT_COLUMNS = (
+    "accountcode",
+    "src",
+    "dst",
+    "dcontext",
+    "clid",
+    "channel",
+    "dstchannel",
+    "lastapp",
+    "lastdata",
+    "start",
+    "answer",
+    "end",
+    "duration",
+    "billsec",
+    "disposition",
+    "amaflags",
+    "uniqueid",
+    "userfield",
+)
+
+DISPOSITIONS = {
+    "ANSWERED": CallStatus.COMPLETED,
+    "NO ANSWER": CallStatus.NOANSWER,
+    "BUSY": CallStatus.BUSY,
+    "FAILED": CallStatus.FAILED,
+    "CONGESTION": CallStatus.FAILED,
+}
+
+DUPLICATE_KEY = 11000
+
+
+def cdr_columns() -> Tuple[str, ...]:
+    """Column order, overridable with ``ASTERISK_CDR_COLUMNS`` (cdr_custom)."""
+    configured = os.environ.get("ASTERISK_CDR_COLUMNS")
+    if not configured:
+        return DEFAULT_COLUMNS
+    return tuple(column.strip() for column in configured.split(","))
+
+
+@dataclass
+class CdrRow:
+    uniqueid: str
+    accountcode: str
+    src: str
+    dst: str
+    start: datetime
+    answer: Optional[datetime]
+    end: Optional[datetime]
+    billsec: int
+    status: CallStatus
+    hangup_cause: Optional[str]
+    campaign_id: Optional[str]
+    audio_id: Optional[str]
+    dtmf: Optional[str]
+
+
+def _parse_time(value: str) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+
+
+def parse_userfield(value: str) -> Tuple[Optional[str], ...]:
+    """Split ``CAMPAIGN_ID|AUDIO_ID|DTMF_INPUT``; missing parts are None."""
+    parts = (value.split("|") + ["", "", ""])[:3]
+    return tuple(part.strip() or None for part in parts)
+
+
+def parse_row(fields: Sequence[str], columns: Sequence[str]) -> Optional[CdrRow]:
+    """Map one CSV row onto a ``CdrRow``, or None if it cannot be imported."""
+    if len(fields) < len(columns):
+        return None
+    row = dict(zip(columns, fields))
+    uniqueid = row.get("uniqueid")
+    status = DISPOSITIONS.get(row.get("disposition", "").upper())
+    if not uniqueid or status is None:
+        return None
+    try:
+        start = _parse_time(row.get("start", ""))
+        answer = _parse_time(row.get("answer", ""))
+        end = _parse_time(row.get("end", ""))
+        billsec = int(row.get("billsec") or 0)
+    except ValueError:
+        return None
+    if start is None:
+        return None
+    campaign_id, audio_id, dtmf = parse_userfield(row.get("userfield", ""))
+    return CdrRow(
+        uniqueid=uniqueid,
+        accountcode=row.get("accountcode", ""),
+        src=row.get("src", ""),
+        dst=row.get("dst", ""),
+        start=start,
+        answer=answer,
+        end=end,
+        billsec=billsec,
+        status=status,
+        hangup_cause=row.get("hangupcause") or None,
+        campaign_id=campaign_id,
+        audio_id=audio_id,
+        dtmf=dtmf,
+    )
+
+
+def _call_log_upsert(row: CdrRow) -> UpdateOne:
+    # The CDR is authoritative for billing fields; the status stays whatever
+    # the dialer recorded so the live campaign counters remain consistent.
+    billing = {"duration": row.billsec, "ended_at": row.end}
+    if row.hangup_cause:
+        billing["hangup_cause"] = row.hangup_cause
+    if row.dtmf:
+        billing["dtmf"] = row.dtmf
+    return UpdateOne(
+        {"asterisk_uniqueid": row.uniqueid},
+        {
+            "$set": billing,
+            "$setOnInsert": {
+                "id": str(uuid.uuid4()),
+                "campaign_id": row.campaign_id,
+                "number": row.dst,
+                "status": row.status,
+                "started_at": row.start,
+                "answered_at": row.answer,
+                "audio_id": row.audio_id,
+                "retry_count": 0,
+                "created_at": row.start,
+            },
+        },
+        upsert=True,
+    )
+
+
+def _call_record(row: CdrRow) -> CallRecord:
+    return CallRecord(
+        customer_id=row.accountcode,
+        caller_number=row.src,
+        called_number=row.dst,
+        country="",
+        duration=row.billsec,
+        call_date=row.start,
+    )
+
+
+def _is_billable(row: CdrRow) -> bool:
+    return bool(row.accountcode) and row.status == CallStatus.COMPLETED
+
+
+async def _bulk_upsert(collection, ops: List[UpdateOne]) -> Tuple[Set[int], int]:
+    """Run upserts; return the indexes of inserted ops and the matched count."""
+    try:
+        outcome = await collection.bulk_write(ops, ordered=False)
+        details = outcome.bulk_api_result
+    except BulkWriteError as e:
+        # Another import of the same rows won the upsert race; those rows exist
+        details = e.details
+        for error in details.get("writeErrors", []):
+            if error.get("code") != DUPLICATE_KEY:
+                raise
+    upserted = {entry["index"] for entry in details.get("upserted", [])}
+    return upserted, details.get("nMatched", 0)
+
+
+async def write_rows(db, rows: List[CdrRow], result: CdrImportResult):
+    """Upsert one batch of parsed rows into call logs and call records."""
+    campaign_rows = [row for row in rows if row.campaign_id]
+    if campaign_rows:
+        upserted, matched = await _bulk_upsert(
+            db.platinum_call_logs, [_call_log_upsert(row) for row in campaign_rows]
+        )
+        result.call_logs_inserted += len(upserted)
+        result.call_logs_updated += matched
+
+    billable = [row for row in rows if _is_billable(row)]
+    if billable:
+        records = [_call_record(row) for row in billable]
+        await rating_engine.ensure_customers(db, {r.customer_id for r in records})
+        for record in records:
+            rating_engine.rate_record(record)
+        upserted, _ = await _bulk_upsert(
+            db.call_records,
+            [
+                UpdateOne(
+                    {"asterisk_uniqueid": row.uniqueid},
+                    {"$setOnInsert": record.model_dump()},
+                    upsert=True,
+                )
+                for row, record in zip(billable, records)
+            ],
+        )
+        result.call_records_inserted += len(upserted)
+        # Only newly inserted records count towards customer/dealer totals
+        await apply_rollups(db, [records[i] for i in sorted(upserted)])
+
+    result.skipped += sum(
+        1 for row in rows if not row.campaign_id and not _is_billable(row)
+    )
+
+
+def _read_lines(f: BinaryIO, limit: int, final: bool = False) -> List[bytes]:
+    """Up to ``limit`` complete lines; a trailing partial line is left unread.
+
+    With ``final`` the file is complete and a last line without a newline is
+    returned too.
+    """
+    lines = []
+    while len(lines) < limit:
+        line = f.readline()
+        if not line:
+            break
+        if not line.endswith(b"\n") and not final:
+            # Asterisk is still writing this row; pick it up next time
+            f.seek(-len(line), os.SEEK_CUR)
+            break
+        lines.append(line)
+    return lines
+
+
+async def import_cdr_file(
+    db,
+    f: BinaryIO,
+    offset: int = 0,
+    on_batch: Optional[Callable[[int], Awaitable[None]]] = None,
+    batch_size: int = BATCH_SIZE,
+    final: bool = False,
+) -> CdrImportResult:
+    """Import complete lines of ``f`` from byte ``offset`` onwards.
+
+    ``on_batch`` is awaited with the new offset after each batch is written.
+    Pass ``final`` for a finished file such as an upload, whose last line may
+    lack a newline; without it that line is left for the next run.
+    """
+    columns = cdr_columns()
+    result = CdrImportResult(offset=offset)
+    f.seek(offset)
+    while True:
+        lines = await asyncio.to_thread(_read_lines, f, batch_size, final)
+        if not lines:
+            return result
+        rows = []
+        for fields in csv.reader(line.decode("utf-8", "replace") for line in lines):
+            result.rows += 1
+            row = parse_row(fields, columns)
+            if row is None:
+                result.invalid += 1
+            else:
+                rows.append(row)
+        await write_rows(db, rows, result)
+        result.offset += sum(len(line) for line in lines)
+        if on_batch is not None:
+            await on_batch(result.offset)
+
+
+async def load_checkpoint(db, path: str, inode: int, size: int) -> int:
+    """Saved offset for ``path``, or 0 if the file was rotated or truncated."""
+    checkpoint = await db.cdr_import_checkpoints.find_one({"id": path})
+    if not checkpoint or checkpoint.get("inode") != inode:
+        return 0
+    if checkpoint["offset"] > size:
+        return 0
+    return checkpoint["offset"]
+
+
+async def import_path(
+    db, path: str, resume: bool = True, batch_size: int = BATCH_SIZE
+) -> CdrImportResult:
+    """Import a CDR file on disk, resuming from and advancing its checkpoint."""
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        offset = 0
+        if resume:
+            offset = await load_checkpoint(db, path, stat.st_ino, stat.st_size)
+
+        async def save_checkpoint(new_offset: int):
+            await db.cdr_import_checkpoints.update_one(
+                {"id": path},
+                {
+                    "$set": {
+                        "offset": new_offset,
+                        "inode": stat.st_ino,
+                        "updated_at": datetime.now(timezone.utc),
+                    }
+                },
+                upsert=True,
+            )
+
+        return await import_cdr_file(db, f, offset, save_checkpoint, batch_size)
+
+
+def master_path() -> str:
+    return os.environ.get("ASTERISK_CDR_PATH", DEFAULT_MASTER_PATH)
+
+
+_master_import: Optional[asyncio.Task] = None
+_last_result: Optional[CdrImportResult] = None
+_last_error: Optional[str] = None
+
+
+async def _run_master_import(db):
+    global _last_result, _last_error
+    try:
+        _last_result = await import_path(db, master_path())
+        _last_error = None
+    except Exception as e:
+        logger.exception("CDR import of %s failed", master_path())
+        _last_error = str(e)
+
+
+def start_master_import(db) -> bool:
+    """Start a background import of ``ASTERISK_CDR_PATH``; False if running."""
+    global _master_import
+    if _master_import is not None and not _master_import.done():
+        return False
+    _master_import = asyncio.create_task(_run_master_import(db))
+    return True
+
+
+async def master_import_status(db) -> Dict:
+    path = master_path()
+    checkpoint = await db.cdr_import_checkpoints.find_one(
+        {"id": path}, {"_id": 0, "offset": 1, "updated_at": 1}
+    )
+    return {
+        "path": path,
+        "running": _master_import is not None and not _master_import.done(),
+        "size": os.path.getsize(path) if os.path.exists(path) else None,
+        "offset": checkpoint["offset"] if checkpoint else 0,
+        "updated_at": checkpoint.get("updated_at") if checkpoint else None,
+        "last_result": _last_result,
+        "last_error": _last_error,
+    }
+
+
+async def _main(argv: List[str]) -> int:
+    import argparse
+    from pathlib import Path
+
+    import database
+    from dotenv import load_dotenv
+    from indexes import ensure_indexes
+
+    parser = argparse.ArgumentParser(description="Import an Asterisk Master.csv")
+    parser.add_argument("path", nargs="?", default=None)
+    parser.add_argument("--from-start", action="store_true", help="ignore checkpoint")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    load_dotenv(Path(__file__).parent / ".env")
+    logging.basicConfig(level=logging.INFO)
+    db = database.connect()
+    try:
+        # The uniqueid indexes are what make re-imports idempotent
+        await ensure_indexes(db)
+        result = await import_path(
+            db,
+            args.path or master_path(),
+            resume=not args.from_start,
+            batch_size=args.batch_size,
+        )
+        print(result.model_dump_json(indent=2))
+        return 0
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,439 @@
+"""In-process registry of live calls, fed by the Asterisk event stream.
+
+Calls are kept in memory keyed by call id (the ``Linkedid`` shared by all
+channels of one call) and updated from AMI ``Newchannel``, ``BridgeEnter`` and
+``Hangup`` events, each an O(1) dict operation, so thousands of concurrent
+channels cost nothing per event beyond an ``event_hub`` publish. Reads are
+served from memory with durations computed from ``started_at``.
+
+``active_calls`` is written by a periodic snapshot rather than per event:
+every ``SNAPSHOT_INTERVAL`` the calls that changed since the last snapshot
+are upserted and the ones that ended are deleted, in one unordered
+``bulk_write``, and the dashboard's ``active_calls`` counter is recounted
+from the collection, so it is the same whichever worker writes it.
+
+Every uvicorn worker follows the event stream itself and tags the calls it
+writes with its ``worker_id``. Workers heartbeat in ``live_call_workers``;
+the calls written by a worker whose heartbeat stops are deleted (their
+``Hangup`` may have been missed), and the remaining workers write the calls
+they still see again. Calls learnt from AMI are also dropped when the event
+stream is lost.
+
+Calls created through the API have no channels to follow. They are written
+straight to ``active_calls`` and read from there, so every worker sees and
+can terminate them, and they are kept across restarts.
+
+``replay_events`` feeds recorded or synthetic events instead of Asterisk:
+
+    python call_registry.py --replay events.ndjson
+    python call_registry.py --synthetic 5000
+"""
+
+import asyncio
+import json
+import logging
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from pymongo import DeleteOne, ReplaceOne
+
+from ami_client import CONNECTION_LOST
+from crm_stats import STATS_ID
+from event_hub import ACTIVE_CALLS_TOPIC, event_hub
+from rating import rating_engine
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_INTERVAL = 2.0
+WORKER_TTL = 30.0
+
+SOURCE_AMI = "ami"
+SOURCE_API = "api"
+
+
+@dataclass
+class LiveCall:
+    id: str
+    customer_id: str
+    caller: str
+    callee: str
+    trunk: str
+    codec: str = ""
+    country: str = ""
+    city: Optional[str] = None
+    status: str = "ringing"
+    started_at: datetime = field(default_factory=datetime.utcnow)
+    source: str = SOURCE_AMI
+    channels: Dict[str, str] = field(default_factory=dict)  # uniqueid -> channel
+
+    def document(self, now: Optional[datetime] = None) -> Dict:
+        now = now or datetime.utcnow()
+        return {
+            "id": self.id,
+            "customer_id": self.customer_id,
+            "caller": self.caller,
+            "callee": self.callee,
+            "trunk": self.trunk,
+            "duration": max(int((now - self.started_at).total_seconds()), 0),
+            "codec": self.codec,
+            "country": self.country,
+            "city": self.city,
+            "status": self.status,
+            "started_at": self.started_at,
+            "source": self.source,
+        }
+
+    @classmethod
+    def from_document(cls, doc: Dict) -> "LiveCall":
+        return cls(
+            id=doc["id"],
+            customer_id=doc["customer_id"],
+            caller=doc["caller"],
+            callee=doc["callee"],
+            trunk=doc["trunk"],
+            codec=doc.get("codec", ""),
+            country=doc.get("country", ""),
+            city=doc.get("city"),
+            status=doc.get("status", "active"),
+            started_at=doc["started_at"],
+            source=doc.get("source", SOURCE_API),
+        )
+
+
+def trunk_of(channel: str) -> str:
+    """``PJSIP/trunk-00000012`` -> ``PJSIP/trunk``."""
+    name, sep, _ = channel.rpartition("-")
+    return name if sep else channel
+
+
+class CallRegistry:
+    def __init__(self, snapshot_interval: float = SNAPSHOT_INTERVAL):
+        self.snapshot_interval = snapshot_interval
+        self.worker_id = uuid.uuid4().hex
+        self._workers: Set[str] = set()
+        self._recount = False
+        self._calls: Dict[str, LiveCall] = {}
+        self._by_uniqueid: Dict[str, str] = {}
+        self._dirty: Set[str] = set()
+        self._ended: Set[str] = set()
+        self._pool = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def get(self, call_id: str) -> Optional[Dict]:
+        call = self._calls.get(call_id)
+        return call.document() if call else None
+
+    def calls(self, status: Optional[str] = None) -> List[Dict]:
+        now = datetime.utcnow()
+        return [
+            call.document(now)
+            for call in self._calls.values()
+            if status is None or call.status == status
+        ]
+
+    def count(self, status: str = "active") -> int:
+        return sum(1 for call in self._calls.values() if call.status == status)
+
+    async def api_calls(self, db, status: Optional[str] = None) -> List[Dict]:
+        query: Dict = {"source": SOURCE_API}
+        if status is not None:
+            query["status"] = status
+        now = datetime.utcnow()
+        return [
+            LiveCall.from_document(doc).document(now)
+            async for doc in db.active_calls.find(query, {"_id": 0})
+        ]
+
+    async def all_calls(self, db, status: Optional[str] = None) -> List[Dict]:
+        """Calls followed through AMI plus those created through the API."""
+        return self.calls(status) + await self.api_calls(db, status)
+
+    async def add_api_call(self, db, call: LiveCall):
+        call.source = SOURCE_API
+        await db.active_calls.replace_one({"id": call.id}, call.document(), upsert=True)
+        self._recount = True
+        event_hub.publish(ACTIVE_CALLS_TOPIC, "added", call.document())
+
+    def add(self, call: LiveCall):
+        self._calls[call.id] = call
+        for uniqueid in call.channels:
+            self._by_uniqueid[uniqueid] = call.id
+        self._ended.discard(call.id)
+        self._changed(call, "added")
+
+    def remove(self, call_id: str) -> Optional[LiveCall]:
+        call = self._calls.pop(call_id, None)
+        if call is None:
+            return None
+        for uniqueid in call.channels:
+            self._by_uniqueid.pop(uniqueid, None)
+        self._dirty.discard(call_id)
+        self._ended.add(call_id)
+        event_hub.publish(ACTIVE_CALLS_TOPIC, "removed", {"id": call_id})
+        return call
+
+    def _changed(self, call: LiveCall, event_type: str):
+        self._dirty.add(call.id)
+        event_hub.publish(ACTIVE_CALLS_TOPIC, event_type, call.document())
+
+    def on_ami_event(self, event: Dict[str, str]):
+        name = event.get("Event")
+        if name == "Newchannel":
+            self._new_channel(event)
+        elif name == "BridgeEnter":
+            call = self._call_of(event)
+            if call is not None and call.status != "active":
+                call.status = "active"
+                self._changed(call, "updated")
+        elif name == "Hangup":
+            uniqueid = event.get("Uniqueid", "")
+            call = self._call_of(event)
+            if call is None:
+                return
+            call.channels.pop(uniqueid, None)
+            self._by_uniqueid.pop(uniqueid, None)
+            # The call ends with its originating channel or its last one
+            if uniqueid == call.id or not call.channels:
+                self.remove(call.id)
+        elif name == CONNECTION_LOST:
+            lost = [c.id for c in self._calls.values() if c.source == SOURCE_AMI]
+            if lost:
+                logger.warning("AMI event stream lost, dropping %d calls", len(lost))
+            for call_id in lost:
+                self.remove(call_id)
+
+    def _call_of(self, event: Dict[str, str]) -> Optional[LiveCall]:
+        call_id = self._by_uniqueid.get(event.get("Uniqueid", ""))
+        return self._calls.get(call_id) if call_id else None
+
+    def _new_channel(self, event: Dict[str, str]):
+        uniqueid = event.get("Uniqueid", "")
+        channel = event.get("Channel", "")
+        if not uniqueid:
+            return
+        call_id = event.get("Linkedid") or uniqueid
+        call = self._calls.get(call_id)
+        if call is not None:
+            # Another leg of a known call, e.g. the outbound side of a bridge
+            call.channels[uniqueid] = channel
+            self._by_uniqueid[uniqueid] = call_id
+            return
+        customer_id = event.get("AccountCode", "")
+        callee = event.get("Exten", "")
+        rate = rating_engine.lookup(customer_id, callee) if customer_id else None
+        self.add(
+            LiveCall(
+                id=call_id,
+                customer_id=customer_id,
+                caller=event.get("CallerIDNum", ""),
+                callee=callee,
+                trunk=trunk_of(channel),
+                codec=event.get("Codec", ""),
+                country=(rate.destination or "") if rate else "",
+                channels={uniqueid: channel},
+            )
+        )
+
+    async def terminate(self, db, call_id: str) -> bool:
+        """End a call followed through AMI or created through the API."""
+        if await self.hangup(call_id):
+            return True
+        result = await db.active_calls.delete_one({"id": call_id, "source": SOURCE_API})
+        if not result.deleted_count:
+            return False
+        self._recount = True
+        event_hub.publish(ACTIVE_CALLS_TOPIC, "removed", {"id": call_id})
+        return True
+
+    async def hangup(self, call_id: str) -> bool:
+        """End a call: hang up its channels on Asterisk and forget it."""
+        call = self.remove(call_id)
+        if call is None:
+            return False
+        if self._pool is not None:
+            for channel in call.channels.values():
+                try:
+                    await self._pool.send_action("Hangup", Channel=channel)
+                except Exception:
+                    logger.exception("Hanging up %s failed", channel)
+        return True
+
+    async def snapshot(self, db) -> int:
+        """Write the changes since the last snapshot; returns the write count."""
+        dirty, ended = self._dirty, self._ended
+        self._dirty, self._ended = set(), set()
+        now = datetime.utcnow()
+        ops: List = [
+            ReplaceOne(
+                {"id": call_id},
+                {**self._calls[call_id].document(now), "worker_id": self.worker_id},
+                upsert=True,
+            )
+            for call_id in dirty
+            if call_id in self._calls
+        ]
+        ops += [
+            DeleteOne({"id": call_id, "source": {"$ne": SOURCE_API}})
+            for call_id in ended
+        ]
+        if not ops and not self._recount:
+            return 0
+        try:
+            if ops:
+                await db.active_calls.bulk_write(ops, ordered=False)
+            self._recount = False
+            await self._write_count(db)
+        except Exception:
+            # Retry the same calls with the next snapshot
+            self._dirty |= {call_id for call_id in dirty if call_id in self._calls}
+            self._ended |= ended - self._calls.keys()
+            raise
+        return len(ops)
+
+    async def _write_count(self, db):
+        count = await db.active_calls.count_documents({"status": "active"})
+        await db.crm_statistics.update_one(
+            {"id": STATS_ID}, {"$set": {"active_calls": count}}
+        )
+
+    async def heartbeat(self, db):
+        """Record this worker as live and clear calls of stopped workers."""
+        now = datetime.utcnow()
+        workers = db.live_call_workers
+        await workers.update_one(
+            {"id": self.worker_id}, {"$set": {"seen_at": now}}, upsert=True
+        )
+        await workers.delete_many(
+            {"seen_at": {"$lt": now - timedelta(seconds=WORKER_TTL)}}
+        )
+        live = {worker["id"] async for worker in workers.find({}, {"_id": 0, "id": 1})}
+        stale = await db.active_calls.delete_many(
+            {"source": {"$ne": SOURCE_API}, "worker_id": {"$nin": list(live)}}
+        )
+        if stale.deleted_count:
+            logger.warning("Dropped %d calls of stopped workers", stale.deleted_count)
+            self._recount = True
+        if self._workers - live:
+            # Calls a stopped worker wrote may have been dropped; write ours again
+            self._dirty.update(self._calls)
+        self._workers = live
+
+    async def restore(self, db):
+        """Clear calls of workers that stopped, e.g. by a previous run."""
+        await self.heartbeat(db)
+        await self._write_count(db)
+
+    def attach(self, pool):
+        """Follow the event stream of an ``ami_client.AMIPool``."""
+        self._pool = pool
+        pool.subscribe(self.on_ami_event)
+
+    async def start(self, db, pool=None):
+        await self.restore(db)
+        if pool is not None:
+            self.attach(pool)
+        if self._task is None:
+            self._task = asyncio.create_task(self._snapshot_loop(db))
+
+    async def stop(self, db=None):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._pool is not None:
+            self._pool.unsubscribe(self.on_ami_event)
+            self._pool = None
+        if db is not None:
+            await self.snapshot(db)
+            await db.live_call_workers.delete_one({"id": self.worker_id})
+
+    async def _snapshot_loop(self, db):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            if self._pool is not None:
+                try:
+                    # Reconnects the event stream after it was lost
+                    await self._pool.start()
+                except Exception as e:
+                    logger.warning("AMI event stream unavailable: %s", e)
+            try:
+                await self.heartbeat(db)
+                await self.snapshot(db)
+            except Exception:
+                logger.exception("Active call snapshot failed")
+
+
+call_registry = CallRegistry()
+
+
+def load_events(path: str) -> Iterator[Dict[str, str]]:
+    """AMI events recorded one JSON object per line."""
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def synthetic_events(calls: int, answered: float = 0.7) -> Iterator[Dict[str, str]]:
+    """Newchannel/BridgeEnter for ``calls`` calls, then every Hangup."""
+    for i in range(calls):
+        uniqueid = f"1700000000.{i}"
+        yield {
+            "Event": "Newchannel",
+            "Channel": f"PJSIP/trunk{i % 8}-{i:08x}",
+            "Uniqueid": uniqueid,
+            "Linkedid": uniqueid,
+            "CallerIDNum": "908500000000",
+            "Exten": f"90532{i:07d}",
+        }
+        if i < calls * answered:
+            yield {"Event": "BridgeEnter", "Uniqueid": uniqueid}
+    for i in range(calls):
+        yield {"Event": "Hangup", "Uniqueid": f"1700000000.{i}", "Cause": "16"}
+
+
+async def replay_events(
+    registry: CallRegistry, events: Iterable[Dict[str, str]], pause: float = 0.0
+) -> int:
+    """Feed ``events`` to ``registry`` as the AMI event stream would."""
+    count = 0
+    for event in events:
+        registry.on_ami_event(event)
+        count += 1
+        if pause:
+            await asyncio.sleep(pause)
+    return count
+
+
+async def _main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay AMI events into a registry")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--replay", help="NDJSON file of AMI events")
+    source.add_argument("--synthetic", type=int, help="number of generated calls")
+    args = parser.parse_args(argv)
+
+    registry = CallRegistry()
+    events = list(
+        load_events(args.replay) if args.replay else synthetic_events(args.synthetic)
+    )
+    started = time.perf_counter()
+    await replay_events(registry, events)
+    elapsed = time.perf_counter() - started
+    print(
+        f"{len(events):,} events in {elapsed:.3f}s "
+        f"({len(events) / max(elapsed, 1e-9):,.0f}/s), {len(registry):,} still live"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,146 @@
+"""Live campaign counters maintained from CallLog status transitions.
+
+Every transition is recorded in memory as a -1/+1 pair on the campaign's
+``stats`` counters. A background task flushes the accumulated deltas with one
+atomic ``$inc`` per campaign per ``flush_interval``, so a busy campaign costs
+one write per interval instead of one per state change. The flush also
+stores the current calls/sec so any worker can serve it, and publishes the
+flushed deltas to the campaign's event feed.
+"""
+
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, Optional
+
+from event_hub import campaign_topic, event_hub
+from platinum_campaigns import CallStatus
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 1.0
+RATE_WINDOW = 60.0
+
+FINAL_STATUSES = {
+    CallStatus.COMPLETED,
+    CallStatus.BUSY,
+    CallStatus.NOANSWER,
+    CallStatus.FAILED,
+    CallStatus.ABANDONED,
+}
+
+
+def answer_rate(stats: Dict[str, int]) -> float:
+    """Share of finished calls that were answered."""
+    finished = sum(stats.get(status.value, 0) for status in FINAL_STATUSES)
+    if not finished:
+        return 0.0
+    answered = stats.get(CallStatus.COMPLETED.value, 0)
+    return (answered + stats.get(CallStatus.ABANDONED.value, 0)) / finished
+
+
+class CampaignStatsAggregator:
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._deltas: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._finished: Dict[str, Deque[float]] = {}
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    def record_transition(
+        self,
+        campaign_id: str,
+        old: Optional[CallStatus],
+        new: CallStatus,
+        count: int = 1,
+    ):
+        deltas = self._deltas[campaign_id]
+        if old is not None:
+            deltas[CallStatus(old).value] -= count
+        deltas[CallStatus(new).value] += count
+        if new in FINAL_STATUSES:
+            window = self._finished.setdefault(campaign_id, deque())
+            now = time.monotonic()
+            window.extend([now] * count)
+
+    def pending_deltas(self, campaign_id: str) -> Dict[str, int]:
+        """Deltas recorded in this process but not yet flushed."""
+        return dict(self._deltas.get(campaign_id, {}))
+
+    def calls_per_second(self, campaign_id: str) -> float:
+        window = self._finished.get(campaign_id)
+        if not window:
+            return 0.0
+        cutoff = time.monotonic() - RATE_WINDOW
+        while window and window[0] < cutoff:
+            window.popleft()
+        return len(window) / RATE_WINDOW
+
+    def start(self, db):
+        self._db = db
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._db is not None:
+            await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # Cancelling the loop must not drop deltas a flush has swapped out
+            await asyncio.shield(self.flush())
+
+    async def flush(self):
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        deltas, self._deltas = self._deltas, defaultdict(lambda: defaultdict(int))
+        campaign_ids = set(deltas) | set(self._finished)
+        for campaign_id in campaign_ids:
+            update: Dict[str, Dict] = {
+                "$set": {"calls_per_second": self.calls_per_second(campaign_id)}
+            }
+            increments = {
+                f"stats.{status}": delta
+                for status, delta in deltas.get(campaign_id, {}).items()
+                if delta
+            }
+            if increments:
+                update["$inc"] = increments
+            try:
+                await self._db.platinum_campaigns.update_one(
+                    {"id": campaign_id}, update
+                )
+            except Exception:
+                logger.exception("Stats flush failed for campaign %s", campaign_id)
+                # Keep the deltas for the next flush rather than losing them
+                for key, delta in increments.items():
+                    self._deltas[campaign_id][key[len("stats.") :]] += delta
+                continue
+            event_hub.publish(
+                campaign_topic(campaign_id),
+                "stats",
+                {
+                    "deltas": {
+                        key[len("stats.") :]: v for key, v in increments.items()
+                    },
+                    "calls_per_second": update["$set"]["calls_per_second"],
+                },
+            )
+            if not self._finished.get(campaign_id):
+                # Rate has decayed to zero and been written; stop tracking it
+                self._finished.pop(campaign_id, None)
+
+
+campaign_stats = CampaignStatsAggregator()
@@ -0,0 +1,120 @@
+"""Batched CDR ingestion.
+
+``ingest_call_records`` writes a batch of ``CallRecord``s with one unordered
+``insert_many`` and hands the inserted records to ``rollups.apply_rollups``,
+so a batch costs one ``bulk_write`` per counter collection instead of two
+round trips per record. Request bodies can be a JSON array or an NDJSON
+stream; items that fail validation or insertion are reported individually
+and do not stop the rest of the batch.
+"""
+
+import json
+from typing import AsyncIterator, Iterable, List, Tuple
+
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from rating import rating_engine
+from rollups import apply_rollups
+from voip_crm import CallRecord, IngestResult
+
+BATCH_SIZE = 5000
+
+
+def parse_record(index: int, item, result: IngestResult):
+    """Validate one item, recording a per-item error instead of raising."""
+    try:
+        return CallRecord.model_validate(item)
+    except ValidationError as e:
+        errors = "; ".join(
+            f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}"
+            for err in e.errors()
+        )
+        result.add_error(index, errors)
+        return None
+
+
+async def iter_ndjson(
+    stream: AsyncIterator[bytes],
+) -> AsyncIterator[Tuple[int, object]]:
+    """Yield (index, parsed item) from an NDJSON byte stream.
+
+    Lines that are not valid JSON are yielded as ``ValueError`` instances.
+    """
+    index = 0
+    remainder = b""
+    async for chunk in stream:
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield index, _loads(line)
+                index += 1
+    if remainder.strip():
+        yield index, _loads(remainder)
+
+
+def _loads(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e
+
+
+async def ingest_call_records(
+    db, records: List[Tuple[int, CallRecord]], result: IngestResult
+):
+    """Insert (index, record) pairs and roll their totals up in one pass."""
+    if not records:
+        return
+    await rating_engine.ensure_customers(db, {r.customer_id for _, r in records})
+    for _, record in records:
+        rating_engine.rate_record(record)
+    docs = [record.model_dump() for _, record in records]
+    failed = set()
+    try:
+        await db.call_records.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            position = error["index"]
+            failed.add(position)
+            result.add_error(records[position][0], error.get("errmsg", "write failed"))
+    inserted = [record for i, (_, record) in enumerate(records) if i not in failed]
+    result.inserted += len(inserted)
+    await apply_rollups(db, inserted)
+
+
+def json_array_items(body: bytes) -> List[Tuple[int, object]]:
+    items = json.loads(body)
+    if not isinstance(items, list):
+        raise ValueError("Expected a JSON array of call records")
+    return list(enumerate(items))
+
+
+async def _aiter(items: Iterable) -> AsyncIterator:
+    for item in items:
+        yield item
+
+
+async def ingest_stream(db, items, batch_size: int = BATCH_SIZE) -> IngestResult:
+    """Validate and ingest (index, item) pairs in batches of ``batch_size``.
+
+    ``items`` may be a plain iterable or an async iterator.
+    """
+    if not hasattr(items, "__aiter__"):
+        items = _aiter(items)
+    result = IngestResult()
+    batch: List[Tuple[int, CallRecord]] = []
+    async for index, item in items:
+        result.received += 1
+        if isinstance(item, ValueError):
+            result.add_error(index, f"Invalid JSON: {item}")
+            continue
+        record = parse_record(index, item, result)
+        if record is not None:
+            batch.append((index, record))
+        if len(batch) >= batch_size:
+            await ingest_call_records(db, batch, result)
+            batch = []
+    await ingest_call_records(db, batch, result)
+    return result
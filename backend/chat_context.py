@@ -0,0 +1,259 @@
+"""Bounded conversation context of chat sessions.
+
+Each session's context is a summary of its older turns plus its recent
+messages. Contexts are held in an LRU (``TTLCache``) and backed by one
+``chat_contexts`` document per session, so picking a conversation up costs a
+single read however long it has run; ``chat_messages`` stays the full log.
+
+Sizes are estimated with ``approx_tokens`` (characters / ``CHARS_PER_TOKEN``),
+which is fast and close enough for budgeting. After a turn, when the context
+holds more than ``max_turns`` turns or ``token_budget`` tokens, the oldest
+messages are folded into the summary by ``summarizer``, keeping half the
+turns at most and recent messages worth at most half the budget. The summary
+is capped at ``SUMMARY_TOKENS``, so the prompt stays bounded however long
+the conversation gets. ``generation`` changes whenever the context changes
+other than by an appended turn; an LLM client built for an older generation
+has to be rebuilt from ``system_message``.
+
+Workers trust their cached context, so another worker may have stored turns
+of the same session meanwhile. Each save therefore sets the document's
+``version`` only if it still holds the version the context was read at; on a
+conflict the stored context is read back, the turns not stored yet are
+appended to it and the save is tried again.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from response_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 3.5
+MAX_TURNS = 10
+TOKEN_BUDGET = 2000
+SUMMARY_TOKENS = 300
+# Saves that lose to another worker before giving up
+SAVE_ATTEMPTS = 5
+
+ROLE_NAMES = {"user": "Kullanıcı", "assistant": "Asistan"}
+
+Summarizer = Callable[[str, List[Dict[str, str]]], Awaitable[str]]
+
+
+def approx_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def transcript(messages: List[Dict[str, str]]) -> str:
+    return "\n".join(
+        f"{ROLE_NAMES.get(message['role'], message['role'])}: {message['content']}"
+        for message in messages
+    )
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    # Cut from the front: the latest part of a summary matters most
+    limit = int(max_tokens * CHARS_PER_TOKEN)
+    return text if len(text) <= limit else text[-limit:]
+
+
+def extractive_summary(summary: str, messages: List[Dict[str, str]]) -> str:
+    """The earlier summary followed by the user's questions, without an LLM."""
+    lines = [summary] if summary else []
+    lines += [f"- {m['content']}" for m in messages if m["role"] == "user"]
+    return "\n".join(lines)
+
+
+async def _extractive(summary: str, messages: List[Dict[str, str]]) -> str:
+    return extractive_summary(summary, messages)
+
+
+@dataclass
+class SessionContext:
+    session_id: str
+    summary: str = ""
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    generation: int = 0
+    tokens: int = 0
+    compacting: bool = False
+    # Cleared; a save still pending must not store it again
+    forgotten: bool = False
+    # Version of the stored document, and the messages it does not have yet
+    version: int = 0
+    unsaved: List[Dict[str, str]] = field(default_factory=list)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.tokens = self._count()
+
+    def _count(self) -> int:
+        return approx_tokens(self.summary) + sum(
+            approx_tokens(message["content"]) for message in self.messages
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.summary or self.messages)
+
+    def add(self, role: str, content: str):
+        message = {"role": role, "content": content}
+        self.messages.append(message)
+        self.unsaved.append(message)
+        self.tokens += approx_tokens(content)
+
+    def system_message(self, base: str) -> str:
+        parts = [base]
+        if self.summary:
+            parts.append("Önceki konuşmanın özeti:\n" + self.summary)
+        if self.messages:
+            parts.append("Son mesajlar:\n" + transcript(self.messages))
+        return "\n\n".join(parts)
+
+
+class ContextManager:
+    def __init__(
+        self,
+        max_turns: int = MAX_TURNS,
+        token_budget: int = TOKEN_BUDGET,
+        summarizer: Optional[Summarizer] = None,
+        max_sessions: int = 10_000,
+        ttl: float = 1800,
+    ):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summarizer = summarizer or _extractive
+        self._contexts: TTLCache[SessionContext] = TTLCache(max_sessions, ttl)
+        self.compactions = 0
+
+    async def get(self, db, session_id: str) -> SessionContext:
+        context = self._contexts.get(session_id)
+        if context is None:
+            doc = await self._load(db, session_id)
+            context = SessionContext(
+                session_id,
+                summary=doc.get("summary", ""),
+                messages=doc.get("messages", []),
+                version=doc.get("version", 0),
+            )
+        # Refreshes its position and idle timeout
+        self._contexts.put(session_id, context)
+        return context
+
+    def record(
+        self, context: SessionContext, question: str, answer: str, seen: bool = True
+    ):
+        """Append a turn; ``seen=False`` if the session's LLM client missed it."""
+        context.add("user", question)
+        context.add("assistant", answer)
+        if not seen:
+            context.generation += 1
+
+    def over_budget(self, context: SessionContext) -> bool:
+        return (
+            len(context.messages) > 2 * self.max_turns
+            or context.tokens > self.token_budget
+        )
+
+    async def _load(self, db, session_id: str) -> Dict:
+        doc = await db.chat_contexts.find_one(
+            {"session_id": session_id},
+            {"_id": 0, "summary": 1, "messages": 1, "version": 1},
+        )
+        return doc or {}
+
+    async def save(self, db, context: SessionContext):
+        """Compact ``context`` if it is over budget, then store it."""
+        async with context.lock:
+            for _ in range(SAVE_ATTEMPTS):
+                if self.over_budget(context) and not context.compacting:
+                    await self._compact(context)
+                if context.forgotten or await self._store(db, context):
+                    return
+                await self._reload(db, context)
+        logger.warning("Context of session %s kept changing", context.session_id)
+
+    async def _store(self, db, context: SessionContext) -> bool:
+        """Write ``context`` unless the document changed since it was read."""
+        version = context.version
+        stored = len(context.unsaved)
+        query = {"session_id": context.session_id, "version": version}
+        if not version:
+            # Not stored yet, or stored before documents had versions
+            query["version"] = {"$exists": False}
+        try:
+            result = await db.chat_contexts.update_one(
+                query,
+                {
+                    "$set": {
+                        "summary": context.summary,
+                        "messages": list(context.messages),
+                        "version": version + 1,
+                        "updated_at": datetime.now(timezone.utc),
+                    }
+                },
+                upsert=not version,
+            )
+        except DuplicateKeyError:
+            # Created by another worker meanwhile
+            return False
+        if not result.matched_count and result.upserted_id is None:
+            return False
+        context.version = version + 1
+        # Turns added while writing are stored next time
+        del context.unsaved[:stored]
+        return True
+
+    async def _reload(self, db, context: SessionContext):
+        """Take the stored context, followed by the turns not stored yet."""
+        doc = await self._load(db, context.session_id)
+        context.summary = doc.get("summary", "")
+        context.messages = doc.get("messages", []) + context.unsaved
+        context.version = doc.get("version", 0)
+        context.tokens = context._count()
+        context.generation += 1
+
+    async def _compact(self, context: SessionContext):
+        kept = 0
+        tokens = 0
+        for message in reversed(context.messages):
+            cost = approx_tokens(message["content"])
+            if kept >= self.max_turns or tokens + cost > self.token_budget // 2:
+                break
+            kept += 1
+            tokens += cost
+        folded = len(context.messages) - kept
+        # Fold whole turns only
+        if (
+            folded < len(context.messages)
+            and context.messages[folded]["role"] != "user"
+        ):
+            folded += 1
+        older = context.messages[:folded]
+        context.compacting = True
+        try:
+            summary = await self.summarizer(context.summary, older)
+        except Exception:
+            logger.exception("Summarizing session %s failed", context.session_id)
+            summary = extractive_summary(context.summary, older)
+        finally:
+            context.compacting = False
+        # Turns added while summarizing are after ``folded`` and stay
+        context.summary = _truncate(summary.strip(), SUMMARY_TOKENS)
+        del context.messages[:folded]
+        context.tokens = context._count()
+        context.generation += 1
+        self.compactions += 1
+
+    def forget(self, session_id: str):
+        context = self._contexts.pop(session_id)
+        if context is not None:
+            context.forgotten = True
+
+    async def clear(self, db, session_id: str):
+        self.forget(session_id)
+        await db.chat_contexts.delete_one({"session_id": session_id})
@@ -1,21 +1,60 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+import asyncio
+import logging
 import os
 from dotenv import load_dotenv
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 import uuid
 from datetime import datetime
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from database import get_db
+from event_hub import format_sse
+from llm import FakeLlm, stream_reply
+from chat_context import ContextManager, SessionContext, extractive_summary, transcript
+from llm_gate import LlmGate, LlmGateMetrics, LlmOverloaded, LlmTimeout, RateLimiter
+from response_cache import CacheMetrics, TTLCache, normalize_question
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/api/chatbot", tags=["chatbot"])
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+NOT_CONFIGURED_REPLY = "Üzgünüm, şu anda yapay zeka servisi yapılandırılmamış. Lütfen 0850 000 00 00 numaralı telefondan bize ulaşın."
+FALLBACK_REPLY = "Merhaba! Ben Velora AI asistanıyım. Size nasıl yardımcı olabilirim? Velora'nın bulut santral, toplu SMS, sabit numara hizmetleri hakkında bilgi verebilirim. 📞"
+ERROR_REPLY = "Üzgünüm, geçici bir hata oluştu. Lütfen tekrar deneyin veya 0850 000 00 00 numaralı telefondan bize ulaşın."
+RATE_LIMITED_REPLY = "Çok sık mesaj gönderiyorsunuz. Lütfen birkaç saniye sonra tekrar deneyin."
+
+# LLM calls of this process: a few at a time, a short queue, and the
+# fallback reply instead of waiting when the upstream falls behind
+llm_gate = LlmGate(
+    max_concurrent=int(os.environ.get("CHAT_LLM_MAX_CONCURRENCY", 20)),
+    max_queue=int(os.environ.get("CHAT_LLM_MAX_QUEUE", 50)),
+    queue_timeout=int(os.environ.get("CHAT_LLM_QUEUE_TIMEOUT_MS", 2000)) / 1000,
+    timeout=int(os.environ.get("CHAT_LLM_TIMEOUT_MS", 30000)) / 1000,
+)
+rate_limiter = RateLimiter(
+    per_minute=float(os.environ.get("CHAT_RATE_LIMIT_PER_MINUTE", 20)),
+    burst=int(os.environ.get("CHAT_RATE_LIMIT_BURST", 5)),
+)
+
+# Answers to questions asked at the start of a conversation, keyed by the
+# normalized question: most traffic is the same few product questions
+response_cache: TTLCache[str] = TTLCache(
+    max_entries=int(os.environ.get("CHAT_CACHE_MAX_ENTRIES", 1000)),
+    ttl=float(os.environ.get("CHAT_CACHE_TTL", 3600)),
+    max_size=4_000_000,  # characters
+)
+
+# One LLM client per live session, with the context generation it was built
+# for, reused across its requests and dropped after half an hour idle
+llm_clients: TTLCache[Tuple[int, Any]] = TTLCache(max_entries=1000, ttl=1800)
+
+# Message writes still running after their response was sent
+_pending_writes: Set[asyncio.Task] = set()
 
 class ChatMessage(BaseModel):
     message: str
@@ -25,6 +64,10 @@ class ChatResponse(BaseModel):
     response: str
     session_id: str
 
+class ChatLoadMetrics(BaseModel):
+    gate: LlmGateMetrics
+    rate_limited: int
+
 # System prompt to keep the chatbot focused on Velora topics
 SYSTEM_PROMPT = """Sen Velora'nın yapay zeka destekli müşteri hizmetleri asistanısın. 
 Velora, Türkiye'nin ilk tam odaklı yapay zeka tabanlı telekom operatörüdür.
@@ -56,75 +99,256 @@ Görevin:
 - Türkçe konuş
 """
 
+SUMMARY_PROMPT = """Velora müşteri hizmetleri konuşmalarını özetliyorsun. Verilen önceki özeti ve
+konuşmayı, kullanıcının sorularını, verilen bilgileri ve açık kalan konuları
+koruyarak en fazla birkaç cümleyle Türkçe özetle. Sadece özeti yaz."""
+
+def _new_llm_client(session_id: str, system_message: str) -> Optional[Any]:
+    if os.environ.get('CHAT_LLM', '').lower() == 'fake':
+        return FakeLlm()
+    api_key = os.environ.get('EMERGENT_LLM_KEY')
+    if not api_key:
+        return None
+    return LlmChat(
+        api_key=api_key,
+        session_id=session_id,
+        system_message=system_message
+    ).with_model("openai", "gpt-4o-mini")
+
+def _llm_client(context: SessionContext) -> Optional[Any]:
+    """The session's LLM client, or None when no LLM is configured."""
+    entry = llm_clients.pop(context.session_id)
+    if entry is None or entry[0] != context.generation:
+        # The client keeps the turns it sees; it starts from the stored context
+        client = _new_llm_client(
+            context.session_id, context.system_message(SYSTEM_PROMPT)
+        )
+        if client is None:
+            return None
+        entry = (context.generation, client)
+    # Put back as most recently used with a fresh idle timeout
+    llm_clients.put(context.session_id, entry)
+    return entry[1]
+
+async def _summarize(summary: str, messages: List[Dict[str, str]]) -> str:
+    client = _new_llm_client(str(uuid.uuid4()), SUMMARY_PROMPT)
+    if client is None:
+        return extractive_summary(summary, messages)
+    text = "Konuşma:\n" + transcript(messages)
+    if summary:
+        text = f"Önceki özet:\n{summary}\n\n{text}"
+    return await llm_gate.call(lambda: client.send_message(UserMessage(text=text)))
+
+# Recent turns and a summary of older ones per session, within a token budget
+context_manager = ContextManager(
+    max_turns=int(os.environ.get("CHAT_CONTEXT_TURNS", 10)),
+    token_budget=int(os.environ.get("CHAT_CONTEXT_TOKENS", 2000)),
+    summarizer=_summarize,
+)
+
+def _save_turn(
+    db: AsyncIOMotorDatabase,
+    context: SessionContext,
+    question: str,
+    asked_at: datetime,
+    answer: str,
+    seen: bool = True,
+):
+    """Record a turn and store it without holding up the response."""
+    context_manager.record(context, question, answer, seen)
+    messages = _turn(context.session_id, question, asked_at, answer)
+    task = asyncio.create_task(_store_turn(db, context, messages))
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
+
+async def _store_turn(
+    db: AsyncIOMotorDatabase, context: SessionContext, messages: List[Dict]
+):
+    try:
+        await db.chat_messages.insert_many(messages)
+    except Exception as db_error:
+        logger.warning("Database save error: %s", db_error)
+    try:
+        await context_manager.save(db, context)
+    except Exception:
+        logger.exception("Saving the context of session %s failed", context.session_id)
+
+async def drain_writes():
+    """Wait for pending message writes, e.g. before the database is closed."""
+    if _pending_writes:
+        await asyncio.wait(list(_pending_writes), timeout=10)
+
+def _turn(session_id: str, question: str, asked_at: datetime, answer: str) -> List[Dict]:
+    return [
+        {
+            "session_id": session_id,
+            "role": "user",
+            "content": question,
+            "timestamp": asked_at
+        },
+        {
+            "session_id": session_id,
+            "role": "assistant",
+            "content": answer,
+            "timestamp": datetime.utcnow()
+        },
+    ]
+
+def _cache_key(context: SessionContext, message: str) -> Optional[str]:
+    # Only questions without an earlier turn in context can share answers
+    if context:
+        return None
+    return normalize_question(message) or None
+
+def _rate_key(request: Request, session_id: Optional[str]) -> str:
+    # A new session per request would dodge a per-session limit; fall back to the client
+    if session_id:
+        return session_id
+    return f"client:{request.client.host if request.client else 'unknown'}"
+
 @router.post("/chat", response_model=ChatResponse)
-async def chat(chat_message: ChatMessage):
+async def chat(chat_message: ChatMessage, request: Request, db: AsyncIOMotorDatabase = Depends(get_db)):
     try:
+        asked_at = datetime.utcnow()
         # Generate or use existing session ID
         session_id = chat_message.session_id or str(uuid.uuid4())
+
+        if not rate_limiter.allow(_rate_key(request, chat_message.session_id)):
+            return ChatResponse(response=RATE_LIMITED_REPLY, session_id=session_id)
+
+        context = await context_manager.get(db, session_id)
+        cache_key = _cache_key(context, chat_message.message)
+        if cache_key:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                _save_turn(db, context, chat_message.message, asked_at, cached, seen=False)
+                return ChatResponse(response=cached, session_id=session_id)
         
-        # Get API key
-        api_key = os.environ.get('EMERGENT_LLM_KEY')
-        if not api_key:
+        chat_client = _llm_client(context)
+        if chat_client is None:
             return ChatResponse(
-                response="Üzgünüm, şu anda yapay zeka servisi yapılandırılmamış. Lütfen 0850 000 00 00 numaralı telefondan bize ulaşın.",
+                response=NOT_CONFIGURED_REPLY,
                 session_id=session_id
             )
         
         try:
-            # Initialize LLM Chat with simpler approach
-            chat_client = LlmChat(
-                api_key=api_key,
-                session_id=session_id,
-                system_message=SYSTEM_PROMPT
-            ).with_model("openai", "gpt-4o-mini")
-            
             # Create user message
             user_msg = UserMessage(text=chat_message.message)
             
             # Get response from LLM
-            response = await chat_client.send_message(user_msg)
+            response = await llm_gate.call(lambda: chat_client.send_message(user_msg))
+            if cache_key:
+                response_cache.put(cache_key, response)
             
-            # Save messages to database (non-blocking)
-            try:
-                await db.chat_messages.insert_one({
-                    "session_id": session_id,
-                    "role": "user",
-                    "content": chat_message.message,
-                    "timestamp": datetime.utcnow()
-                })
-                
-                await db.chat_messages.insert_one({
-                    "session_id": session_id,
-                    "role": "assistant",
-                    "content": response,
-                    "timestamp": datetime.utcnow()
-                })
-            except Exception as db_error:
-                print(f"Database save error: {db_error}")
-                # Continue even if database save fails
+            _save_turn(db, context, chat_message.message, asked_at, response)
             
             return ChatResponse(
                 response=response,
                 session_id=session_id
             )
             
-        except Exception as llm_error:
-            print(f"LLM error: {llm_error}")
+        except (LlmOverloaded, LlmTimeout) as llm_error:
+            logger.info("LLM call shed: %r", llm_error)
+            # The client may hold the unanswered question; rebuild it next time
+            llm_clients.pop(session_id)
+            return ChatResponse(
+                response=FALLBACK_REPLY,
+                session_id=session_id
+            )
+        except Exception:
+            logger.exception("LLM error")
+            llm_clients.pop(session_id)
             # Fallback response
             return ChatResponse(
-                response="Merhaba! Ben Velora AI asistanıyım. Size nasıl yardımcı olabilirim? Velora'nın bulut santral, toplu SMS, sabit numara hizmetleri hakkında bilgi verebilirim. 📞",
+                response=FALLBACK_REPLY,
                 session_id=session_id
             )
         
-    except Exception as e:
-        print(f"General error: {e}")
+    except Exception:
+        logger.exception("Chat request failed")
         return ChatResponse(
-            response="Üzgünüm, geçici bir hata oluştu. Lütfen tekrar deneyin veya 0850 000 00 00 numaralı telefondan bize ulaşın.",
+            response=ERROR_REPLY,
             session_id=session_id
         )
 
+async def _stream_turn(
+    db: AsyncIOMotorDatabase,
+    context: SessionContext,
+    message: str,
+    asked_at: datetime,
+    cache_key: Optional[str],
+) -> AsyncIterator[str]:
+    session_id = context.session_id
+    yield format_sse("session", {"session_id": session_id})
+    reply = response_cache.get(cache_key) if cache_key else None
+    seen = reply is None
+    if reply is not None:
+        yield format_sse("token", {"text": reply})
+    else:
+        chat_client = _llm_client(context)
+        if chat_client is None:
+            yield format_sse("error", {"response": NOT_CONFIGURED_REPLY, "session_id": session_id})
+            return
+        chunks = []
+        try:
+            async for chunk in llm_gate.stream(
+                lambda: stream_reply(chat_client, UserMessage(text=message))
+            ):
+                chunks.append(chunk)
+                yield format_sse("token", {"text": chunk})
+        except (LlmOverloaded, LlmTimeout) as llm_error:
+            logger.info("LLM call shed: %r", llm_error)
+            llm_clients.pop(session_id)
+            yield format_sse("error", {"response": FALLBACK_REPLY, "session_id": session_id})
+            return
+        except Exception:
+            logger.exception("LLM error")
+            llm_clients.pop(session_id)
+            yield format_sse("error", {"response": FALLBACK_REPLY, "session_id": session_id})
+            return
+        reply = "".join(chunks)
+        if cache_key:
+            response_cache.put(cache_key, reply)
+    # Stored once the whole reply is known
+    _save_turn(db, context, message, asked_at, reply, seen)
+    yield format_sse("done", {"response": reply, "session_id": session_id})
+
+async def _stream_events(*events) -> AsyncIterator[str]:
+    for event_type, data in events:
+        yield format_sse(event_type, data)
+
+@router.post("/chat/stream")
+async def chat_stream(chat_message: ChatMessage, request: Request, db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Server-Sent Events: ``session``, a ``token`` per chunk of the reply as the
+    model produces it, then ``done`` with the whole reply. On failure ``error``
+    carries the reply to show instead."""
+    asked_at = datetime.utcnow()
+    session_id = chat_message.session_id or str(uuid.uuid4())
+    if rate_limiter.allow(_rate_key(request, chat_message.session_id)):
+        context = await context_manager.get(db, session_id)
+        cache_key = _cache_key(context, chat_message.message)
+        events = _stream_turn(db, context, chat_message.message, asked_at, cache_key)
+    else:
+        events = _stream_events(
+            ("session", {"session_id": session_id}),
+            ("error", {"response": RATE_LIMITED_REPLY, "session_id": session_id}),
+        )
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/cache", response_model=CacheMetrics)
+async def get_cache_metrics():
+    return response_cache.metrics()
+
+@router.get("/load", response_model=ChatLoadMetrics)
+async def get_load_metrics():
+    return ChatLoadMetrics(gate=llm_gate.metrics(), rate_limited=rate_limiter.limited)
+
 @router.get("/history/{session_id}")
-async def get_chat_history(session_id: str):
+async def get_chat_history(session_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
     try:
         messages = await db.chat_messages.find(
             {"session_id": session_id}
@@ -145,9 +369,11 @@ async def get_chat_history(session_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/history/{session_id}")
-async def clear_chat_history(session_id: str):
+async def clear_chat_history(session_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
     try:
         result = await db.chat_messages.delete_many({"session_id": session_id})
+        await context_manager.clear(db, session_id)
+        llm_clients.pop(session_id)
         return {
             "success": True,
             "deleted_count": result.deleted_count
@@ -0,0 +1,85 @@
+"""Materialized CRM dashboard statistics.
+
+The totals behind ``GET /api/voip-crm/statistics`` live in one
+``crm_statistics`` document that writers ``$inc`` as they create entities and
+ingest call records, so reading them costs one indexed ``find_one`` however
+large ``call_records`` grows. Reads are served from a short-TTL in-process
+cache; concurrent requests on a miss share a single load.
+
+Increments never upsert: if the document is missing (fresh database, seed
+scripts) the next read rebuilds it with the full scan. ``rebuild_statistics``
+can also be called to correct drift after writes made outside the API.
+"""
+
+import asyncio
+import time
+from typing import Dict, Optional
+
+STATS_ID = "global"
+CACHE_TTL = 2.0
+
+
+async def increment_statistics(db, **deltas):
+    """Apply counter deltas, e.g. ``increment_statistics(db, total_calls=1)``."""
+    await db.crm_statistics.update_one({"id": STATS_ID}, {"$inc": deltas})
+
+
+async def rebuild_statistics(db) -> Dict:
+    """Recompute every counter from the collections and store the result."""
+    call_stats = await db.call_records.aggregate(
+        [
+            {
+                "$group": {
+                    "_id": None,
+                    "total_duration": {"$sum": "$duration"},
+                    "total_calls": {"$sum": 1},
+                }
+            }
+        ]
+    ).to_list(1)
+    stats = {
+        "id": STATS_ID,
+        "total_dealers": await db.dealers.count_documents({}),
+        "total_customers": await db.customers.count_documents({}),
+        "total_users": await db.users.count_documents({}),
+        "active_calls": await db.active_calls.count_documents({"status": "active"}),
+        "total_calls": call_stats[0]["total_calls"] if call_stats else 0,
+        "total_duration": call_stats[0]["total_duration"] if call_stats else 0,
+    }
+    await db.crm_statistics.replace_one({"id": STATS_ID}, stats, upsert=True)
+    return stats
+
+
+class StatisticsCache:
+    """TTL cache over the statistics document with single-flight loads."""
+
+    def __init__(self, ttl: float = CACHE_TTL):
+        self.ttl = ttl
+        self._value: Optional[Dict] = None
+        self._expires = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+
+    async def get(self, db) -> Dict:
+        if self._value is not None and time.monotonic() < self._expires:
+            return self._value
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._load(db))
+        # Shielded so one cancelled request does not abort the shared load
+        return await asyncio.shield(self._inflight)
+
+    async def _load(self, db) -> Dict:
+        try:
+            stats = await db.crm_statistics.find_one({"id": STATS_ID}, {"_id": 0})
+            if stats is None:
+                stats = await rebuild_statistics(db)
+            self._value = stats
+            self._expires = time.monotonic() + self.ttl
+            return stats
+        finally:
+            self._inflight = None
+
+    def invalidate(self):
+        self._expires = 0.0
+
+
+statistics_cache = StatisticsCache()
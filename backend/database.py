@@ -0,0 +1,54 @@
+"""The process-wide MongoDB client.
+
+One ``AsyncIOMotorClient`` (one connection pool) is created by the app
+lifespan and shared by every router, which receives the database through
+the ``get_db`` dependency. Pool limits, timeouts and read preference come
+from the environment.
+"""
+
+import os
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+_client: Optional[AsyncIOMotorClient] = None
+_db: Optional[AsyncIOMotorDatabase] = None
+
+
+def client_options() -> dict:
+    env = os.environ.get
+    return {
+        "maxPoolSize": int(env("MONGO_MAX_POOL_SIZE", 100)),
+        "minPoolSize": int(env("MONGO_MIN_POOL_SIZE", 0)),
+        "maxIdleTimeMS": int(env("MONGO_MAX_IDLE_TIME_MS", 60000)),
+        "connectTimeoutMS": int(env("MONGO_CONNECT_TIMEOUT_MS", 10000)),
+        "serverSelectionTimeoutMS": int(
+            env("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000)
+        ),
+        "socketTimeoutMS": int(env("MONGO_SOCKET_TIMEOUT_MS", 30000)),
+        "waitQueueTimeoutMS": int(env("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000)),
+        "readPreference": env("MONGO_READ_PREFERENCE", "primary"),
+    }
+
+
+def connect() -> AsyncIOMotorDatabase:
+    global _client, _db
+    if _db is None:
+        _client = AsyncIOMotorClient(os.environ["MONGO_URL"], **client_options())
+        _db = _client[os.environ["DB_NAME"]]
+    return _db
+
+
+def close():
+    global _client, _db
+    if _client is not None:
+        _client.close()
+    _client = None
+    _db = None
+
+
+def get_db() -> AsyncIOMotorDatabase:
+    """FastAPI dependency returning the shared database handle."""
+    if _db is None:
+        raise RuntimeError("Database is not connected; is the app lifespan running?")
+    return _db
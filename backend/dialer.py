@@ -0,0 +1,702 @@
+"""In-process asyncio dialing engine for Platinum campaigns.
+
+A ``CampaignDialer`` drains a campaign's numbers into ``platinum_call_logs``
+chunk by chunk as it goes, numbers uploaded while it runs included, and
+keeps ``concurrency`` originations in flight, moving every ``CallLog``
+through the ``CallStatus`` states. With predictive pacing the number in
+flight is set by a ``pacing.Pacer`` instead. Calls the campaign's
+``RetryPolicy`` retries wait in a ``retries.RetryScheduler`` and rejoin the
+queue when due. The script's audio is rendered through ``tts.TtsRenderer``
+before the first call is placed. The telephony side is pluggable through the
+``Originator`` protocol; ``FakeOriginator`` is a local stand-in that needs no
+Asterisk.
+
+A RUNNING campaign records the ``worker_id`` of the worker dialing it (the
+admission controller's, whose heartbeat tells whether it is alive). A worker
+gives its campaigns up when it shuts down, and ``DialerManager`` adopts
+RUNNING campaigns without a live worker at startup and every
+``ADOPT_INTERVAL``, so a restart or a crashed worker leaves none orphaned.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Protocol, Set, Tuple
+
+from admission import AdmissionController, AdmissionTimeout, Lease, admission_controller
+from campaign_stats import CampaignStatsAggregator, campaign_stats
+from event_hub import campaign_topic, event_hub
+from number_lists import iter_undrained, mark_drained, store_numbers
+from pacing import Pacer
+from platinum_campaigns import (
+    CallLog,
+    CallStatus,
+    CampaignStatus,
+    Pacing,
+    PacingMode,
+    RetryPolicy,
+)
+from retries import RetryScheduler, retry_delay
+from tts import TtsRenderer, tts_renderer
+
+logger = logging.getLogger(__name__)
+
+# How long the dispatcher sleeps between control checks. Pause/stop requests
+# are honoured within this interval.
+CONTROL_INTERVAL = 0.5
+DRAIN_CHUNK_SIZE = 1000
+FETCH_BATCH_SIZE = 500
+# How often a campaign out of numbers looks for ones uploaded since
+REFETCH_INTERVAL = 5.0
+ADOPT_INTERVAL = 15.0
+
+
+@dataclass
+class OriginateRequest:
+    call_id: str
+    campaign_id: str
+    number: str
+    trunk: str
+    context: str
+    audio_id: Optional[str] = None
+
+
+@dataclass
+class OriginateResult:
+    status: CallStatus
+    duration: int = 0
+    hangup_cause: Optional[str] = None
+    dtmf: Optional[str] = None
+    # Asterisk channel uniqueid; joins the call log to its CDR
+    uniqueid: Optional[str] = None
+
+
+class Originator(Protocol):
+    async def originate(
+        self,
+        request: OriginateRequest,
+        on_answer: Callable[[], Awaitable[None]],
+    ) -> OriginateResult:
+        """Place the call and wait for it to end.
+
+        ``on_answer`` must be awaited once if the called party answers.
+        """
+
+    async def hangup(self, call_id: str) -> None:
+        """Hang up an in-flight call placed by this originator."""
+
+
+class FakeOriginator:
+    """Scriptable originator that simulates calls with asyncio sleeps."""
+
+    def __init__(
+        self,
+        answer_rate: float = 0.3,
+        busy_rate: float = 0.2,
+        fail_rate: float = 0.05,
+        ring_time: Tuple[float, float] = (0.01, 0.05),
+        talk_time: Tuple[float, float] = (0.01, 0.05),
+        seed: Optional[int] = None,
+    ):
+        self.answer_rate = answer_rate
+        self.busy_rate = busy_rate
+        self.fail_rate = fail_rate
+        self.ring_time = ring_time
+        self.talk_time = talk_time
+        self._random = random.Random(seed)
+        self._hangups: Dict[str, asyncio.Event] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.originated = 0
+
+    async def originate(self, request, on_answer):
+        self.in_flight += 1
+        self.originated += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        hangup = self._hangups[request.call_id] = asyncio.Event()
+        try:
+            roll = self._random.random()
+            if await self._wait(hangup, self._random.uniform(*self.ring_time)):
+                return OriginateResult(
+                    CallStatus.FAILED, hangup_cause="NORMAL_CLEARING"
+                )
+            if roll < self.answer_rate:
+                await on_answer()
+                talk = self._random.uniform(*self.talk_time)
+                await self._wait(hangup, talk)
+                return OriginateResult(
+                    CallStatus.COMPLETED,
+                    duration=max(1, round(talk)),
+                    hangup_cause="NORMAL_CLEARING",
+                )
+            roll -= self.answer_rate
+            if roll < self.busy_rate:
+                return OriginateResult(CallStatus.BUSY, hangup_cause="USER_BUSY")
+            roll -= self.busy_rate
+            if roll < self.fail_rate:
+                return OriginateResult(
+                    CallStatus.FAILED, hangup_cause="NETWORK_OUT_OF_ORDER"
+                )
+            return OriginateResult(CallStatus.NOANSWER, hangup_cause="NO_ANSWER")
+        finally:
+            self._hangups.pop(request.call_id, None)
+            self.in_flight -= 1
+
+    async def hangup(self, call_id):
+        event = self._hangups.get(call_id)
+        if event:
+            event.set()
+
+    @staticmethod
+    async def _wait(hangup: asyncio.Event, seconds: float) -> bool:
+        try:
+            await asyncio.wait_for(hangup.wait(), timeout=seconds)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class CampaignDialer:
+    """Dials one campaign until it is paused, stopped or out of numbers."""
+
+    def __init__(
+        self,
+        db,
+        campaign_id: str,
+        originator: Originator,
+        stats: CampaignStatsAggregator = campaign_stats,
+        admission: AdmissionController = admission_controller,
+        renderer: TtsRenderer = tts_renderer,
+    ):
+        self.db = db
+        self.campaign_id = campaign_id
+        self.originator = originator
+        self.stats = stats
+        self.admission = admission
+        self.renderer = renderer
+        self.concurrency = 1
+        self.pacer: Optional[Pacer] = None
+        self.retry_policy = RetryPolicy()
+        self.retries = RetryScheduler()
+        self._talking = 0
+        self._campaign: Dict = {}
+        self._audio_id: Optional[str] = None
+        self._rendered: Optional[str] = None  # pinned in the audio cache
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._in_flight: Dict[asyncio.Task, str] = {}
+        self._halt: Optional[CampaignStatus] = None
+        self._hard_stop = False
+        self._wakeup = asyncio.Event()
+        self._last_status_check = 0.0
+
+    def request_halt(self, status: CampaignStatus, hard: bool = False):
+        """Ask the dispatcher to stop placing calls (pause or stop)."""
+        self._halt = status
+        self._hard_stop = self._hard_stop or hard
+        self._wakeup.set()
+
+    async def run(self):
+        campaign = await self.db.platinum_campaigns.find_one({"id": self.campaign_id})
+        if not campaign:
+            return
+        self._campaign = campaign
+        self._configure(campaign)
+        script = await self.db.platinum_scripts.find_one(
+            {"id": campaign["script_id"]},
+            {"_id": 0, "id": 1, "text": 1, "voice_id": 1, "language": 1, "audio_id": 1},
+        )
+        if script:
+            # No call waits on synthesis: render (or find) the audio first
+            try:
+                self._rendered = await self.renderer.prepare(self.db, script)
+            except Exception:
+                logger.exception(
+                    "Rendering audio of campaign %s failed", self.campaign_id
+                )
+                await self._halt_on_render_failure()
+                return
+            self._audio_id = self._rendered or script.get("audio_id")
+
+        await self._migrate_inline_numbers()
+        # Calls left DIALING by a previous run were never finished; retry them.
+        reset = await self.db.platinum_call_logs.update_many(
+            {"campaign_id": self.campaign_id, "status": CallStatus.DIALING},
+            {"$set": {"status": CallStatus.PENDING}},
+        )
+        if reset.modified_count:
+            self.stats.record_transition(
+                self.campaign_id,
+                CallStatus.DIALING,
+                CallStatus.PENDING,
+                count=reset.modified_count,
+            )
+        await self.retries.load(self.db, self.campaign_id)
+
+        exhausted_at: Optional[float] = None
+        while self._halt is None:
+            self._queue_due_retries()
+            idle = not self._in_flight and not self.retries
+            now = time.monotonic()
+            drained = False
+            if self._queue.empty() and (
+                exhausted_at is None or idle or now - exhausted_at >= REFETCH_INTERVAL
+            ):
+                # Numbers can be uploaded while the campaign runs
+                drained = not await self._fetch_pending()
+                exhausted_at = now if drained else None
+
+            while len(self._in_flight) < self._limit() and not self._queue.empty():
+                lease = await self._admit()
+                if lease is None:
+                    break
+                await self._dispatch(self._queue.get_nowait(), lease)
+
+            if drained and not self._in_flight and not self.retries:
+                await self._finish(CampaignStatus.COMPLETED)
+                return
+
+            await self._wait_for_progress()
+            await self._check_status()
+
+        if self._hard_stop:
+            for call_id in list(self._in_flight.values()):
+                await self.originator.hangup(call_id)
+        if self._in_flight:
+            await asyncio.wait(list(self._in_flight))
+
+    def _configure(self, campaign: Dict):
+        self.concurrency = campaign.get("concurrency", self.concurrency)
+        pacing = Pacing(**campaign.get("pacing") or {})
+        if pacing.mode != PacingMode.PREDICTIVE:
+            self.pacer = None
+        elif self.pacer is None:
+            self.pacer = Pacer.from_settings(pacing)
+        else:
+            self.pacer.configure(pacing)
+        self.retry_policy = RetryPolicy(**campaign.get("retry") or {})
+
+    def _limit(self) -> int:
+        """How many calls may be in flight right now."""
+        if self.pacer is None:
+            return self.concurrency
+        limit = self.pacer.target(self._talking)
+        headroom = self.admission.headroom(self._campaign["trunk"])
+        if headroom is not None:
+            limit = min(limit, len(self._in_flight) + headroom)
+        return limit
+
+    async def _migrate_inline_numbers(self):
+        """Move numbers of campaigns created before they left the document."""
+        legacy = self._campaign.pop("numbers", None)
+        if legacy:
+            await store_numbers(self.db, self.campaign_id, legacy, update_stats=False)
+            await self.db.platinum_campaigns.update_one(
+                {"id": self.campaign_id}, {"$unset": {"numbers": ""}}
+            )
+
+    async def _drain_chunk(self) -> int:
+        """Copy the next chunk of stored numbers into PENDING call logs."""
+        async for batch in iter_undrained(self.db, self.campaign_id, DRAIN_CHUNK_SIZE):
+            await self.db.platinum_call_logs.insert_many(
+                [
+                    CallLog(
+                        campaign_id=self.campaign_id,
+                        number=entry["number"],
+                        audio_id=self._audio_id,
+                    ).model_dump()
+                    for entry in batch
+                ]
+            )
+            await mark_drained(self.db, [entry["_id"] for entry in batch])
+            return len(batch)
+        return 0
+
+    async def _fetch_pending(self) -> bool:
+        cursor = (
+            self.db.platinum_call_logs.find(
+                {"campaign_id": self.campaign_id, "status": CallStatus.PENDING},
+                {"_id": 0, "id": 1, "number": 1, "retry_count": 1},
+            )
+            .sort("created_at", 1)
+            .limit(FETCH_BATCH_SIZE)
+        )
+        logs = await cursor.to_list(length=FETCH_BATCH_SIZE)
+        if not logs and await self._drain_chunk():
+            return await self._fetch_pending()
+        for log in logs:
+            self._queue.put_nowait(log)
+        return bool(logs)
+
+    def _queue_due_retries(self):
+        """Move retries that have come due into the work queue."""
+        room = FETCH_BATCH_SIZE - self._queue.qsize()
+        if self.retries and room > 0:
+            now = datetime.now(timezone.utc)
+            for log in self.retries.pop_due(now, room):
+                self._queue.put_nowait(log)
+
+    async def _admit(self) -> Optional[Lease]:
+        """Wait for a trunk slot; None if none frees up within a control interval.
+
+        Waiting here rather than in ``_place_call`` leaves the number PENDING,
+        so a full trunk costs no dial attempt.
+        """
+        try:
+            return await self.admission.acquire(
+                self._campaign["trunk"], timeout=CONTROL_INTERVAL
+            )
+        except AdmissionTimeout:
+            return None
+
+    async def _dispatch(self, log: Dict, lease: Lease):
+        fields: Dict = {"started_at": datetime.now(timezone.utc)}
+        retry_count = log.get("retry_count", 0)
+        status = CallStatus(log.get("status", CallStatus.PENDING))
+        if status != CallStatus.PENDING:
+            # A scheduled retry of a finished call
+            retry_count += 1
+            fields.update(
+                retry_count=retry_count,
+                next_retry_at=None,
+                answered_at=None,
+                ended_at=None,
+                duration=None,
+                hangup_cause=None,
+                dtmf=None,
+            )
+        await self._set_call_status(log["id"], status, CallStatus.DIALING, fields)
+        request = OriginateRequest(
+            call_id=log["id"],
+            campaign_id=self.campaign_id,
+            number=log["number"],
+            trunk=self._campaign["trunk"],
+            context=self._campaign.get("context", "from-internal"),
+            audio_id=self._audio_id,
+        )
+        task = asyncio.create_task(self._place_call(request, lease, retry_count))
+        self._in_flight[task] = log["id"]
+        task.add_done_callback(self._on_call_done)
+
+    def _on_call_done(self, task: asyncio.Task):
+        self._in_flight.pop(task, None)
+        self._wakeup.set()
+
+    async def _place_call(
+        self, request: OriginateRequest, lease: Lease, retry_count: int
+    ):
+        try:
+            await self._call(request, retry_count)
+        finally:
+            await self.admission.release(lease)
+
+    async def _call(self, request: OriginateRequest, retry_count: int):
+        current = CallStatus.DIALING
+        dialed = time.monotonic()
+        answered: Optional[float] = None
+        abandoned = False
+
+        async def on_answer():
+            nonlocal current, answered, abandoned
+            answered = time.monotonic()
+            pacer = self.pacer
+            if pacer is not None and self._talking >= pacer.capacity:
+                # Nobody free to take the call: hang up rather than hold it
+                abandoned = True
+                pacer.answered(answered - dialed, abandoned=True)
+                await self.originator.hangup(request.call_id)
+                return
+            if pacer is not None:
+                pacer.answered(answered - dialed)
+            self._talking += 1
+            current = CallStatus.ANSWERED
+            await self._set_call_status(
+                request.call_id,
+                CallStatus.DIALING,
+                CallStatus.ANSWERED,
+                {"answered_at": datetime.now(timezone.utc)},
+            )
+
+        try:
+            result = await self.originator.originate(request, on_answer)
+        except Exception as e:
+            logger.warning("Originate failed for %s: %s", request.number, e)
+            result = OriginateResult(CallStatus.FAILED, hangup_cause=str(e))
+        finally:
+            ended = time.monotonic()
+            if answered is not None and not abandoned:
+                self._talking -= 1
+                if self.pacer is not None:
+                    self.pacer.hung_up(ended - answered)
+            elif answered is None and self.pacer is not None:
+                self.pacer.unanswered(ended - dialed)
+
+        fields = {
+            "ended_at": datetime.now(timezone.utc),
+            "duration": result.duration,
+            "hangup_cause": result.hangup_cause,
+            "dtmf": result.dtmf,
+        }
+        status = result.status
+        if abandoned:
+            status = CallStatus.ABANDONED
+            fields["duration"] = 0
+            fields["hangup_cause"] = "ABANDONED"
+        if result.uniqueid:
+            fields["asterisk_uniqueid"] = result.uniqueid
+        delay = retry_delay(
+            self.retry_policy, status, fields["hangup_cause"], retry_count
+        )
+        if delay is not None:
+            fields["next_retry_at"] = fields["ended_at"] + delay
+        await self._set_call_status(request.call_id, current, status, fields)
+        if delay is not None:
+            self.retries.schedule(
+                request.call_id,
+                request.number,
+                fields["next_retry_at"],
+                retry_count,
+                status.value,
+            )
+
+    async def _set_call_status(
+        self, call_id: str, old: CallStatus, new: CallStatus, fields: Dict
+    ):
+        await self.db.platinum_call_logs.update_one(
+            {"id": call_id}, {"$set": {"status": new, **fields}}
+        )
+        self.stats.record_transition(self.campaign_id, old, new)
+        event_hub.publish(
+            campaign_topic(self.campaign_id),
+            "call",
+            {"id": call_id, "status": new, **fields},
+        )
+
+    async def _wait_for_progress(self):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=CONTROL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _check_status(self):
+        """Pick up pause/stop and pacing changes made through the database."""
+        now = asyncio.get_running_loop().time()
+        if now - self._last_status_check < CONTROL_INTERVAL:
+            return
+        self._last_status_check = now
+        campaign = await self.db.platinum_campaigns.find_one(
+            {"id": self.campaign_id},
+            {
+                "_id": 0,
+                "status": 1,
+                "worker_id": 1,
+                "concurrency": 1,
+                "pacing": 1,
+                "retry": 1,
+            },
+        )
+        if not campaign:
+            self.request_halt(CampaignStatus.STOPPED, hard=True)
+            return
+        self._configure(campaign)
+        if self._halt is not None:
+            # Asked here already, with the mode the caller chose
+            return
+        if campaign["status"] != CampaignStatus.RUNNING:
+            # Stopped through another worker: its calls must end as well
+            status = CampaignStatus(campaign["status"])
+            self.request_halt(status, hard=status == CampaignStatus.STOPPED)
+        elif campaign.get("worker_id") not in (None, self.admission.worker_id):
+            # Adopted by another worker that took this one for dead
+            self.request_halt(CampaignStatus.PAUSED)
+
+    async def _halt_on_render_failure(self):
+        result = await self.db.platinum_campaigns.update_one(
+            {"id": self.campaign_id, "status": CampaignStatus.RUNNING},
+            {
+                "$set": {
+                    "status": CampaignStatus.PAUSED,
+                    "updated_at": datetime.now(timezone.utc),
+                }
+            },
+        )
+        if result.modified_count:
+            event_hub.publish(
+                campaign_topic(self.campaign_id),
+                "status",
+                {"status": CampaignStatus.PAUSED, "reason": "audio render failed"},
+            )
+
+    def close(self):
+        """Let the cache evict the script's audio again."""
+        self.renderer.release(self._rendered)
+        self._rendered = None
+
+    async def _finish(self, status: CampaignStatus):
+        now = datetime.now(timezone.utc)
+        await self.db.platinum_campaigns.update_one(
+            {"id": self.campaign_id, "status": CampaignStatus.RUNNING},
+            {"$set": {"status": status, "completed_at": now, "updated_at": now}},
+        )
+        event_hub.publish(
+            campaign_topic(self.campaign_id), "status", {"status": status}
+        )
+
+
+def default_originator() -> Optional[Originator]:
+    """Build the originator selected by ``DIALER_ORIGINATOR``."""
+    kind = os.environ.get("DIALER_ORIGINATOR", "").lower()
+    if kind == "fake":
+        return FakeOriginator()
+    if kind == "ami" or (not kind and os.environ.get("AMI_HOST")):
+        from ami_client import AMIOriginator
+
+        return AMIOriginator()
+    return None
+
+
+class DialerManager:
+    """Tracks the running dialer task of every campaign in this process."""
+
+    def __init__(
+        self,
+        originator_factory=default_originator,
+        admission: AdmissionController = admission_controller,
+    ):
+        self.originator_factory = originator_factory
+        self.admission = admission
+        self._originator: Optional[Originator] = None
+        self._dialers: Dict[str, CampaignDialer] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._db = None
+        self._adopt_task: Optional[asyncio.Task] = None
+
+    @property
+    def worker_id(self) -> str:
+        """Recorded on the campaigns this worker dials."""
+        return self.admission.worker_id
+
+    @property
+    def originator(self) -> Optional[Originator]:
+        if self._originator is None:
+            self._originator = self.originator_factory()
+        return self._originator
+
+    def set_originator(self, originator: Originator):
+        self._originator = originator
+
+    def is_running(self, campaign_id: str) -> bool:
+        return campaign_id in self._dialers
+
+    def start(self, db, campaign_id: str) -> CampaignDialer:
+        if campaign_id in self._dialers:
+            return self._dialers[campaign_id]
+        originator = self.originator
+        if originator is None:
+            raise RuntimeError("No originator configured")
+        dialer = CampaignDialer(db, campaign_id, originator, admission=self.admission)
+        self._dialers[campaign_id] = dialer
+        task = asyncio.create_task(self._run(dialer))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return dialer
+
+    async def _run(self, dialer: CampaignDialer):
+        try:
+            await dialer.run()
+        except Exception:
+            logger.exception("Dialer for campaign %s crashed", dialer.campaign_id)
+        finally:
+            dialer.close()
+            self._dialers.pop(dialer.campaign_id, None)
+            # Still RUNNING after a crash or shutdown: up for adoption
+            try:
+                await dialer.db.platinum_campaigns.update_one(
+                    {"id": dialer.campaign_id, "worker_id": self.worker_id},
+                    {"$unset": {"worker_id": ""}},
+                )
+            except Exception:
+                logger.exception("Releasing campaign %s failed", dialer.campaign_id)
+
+    async def adopt(self, db, campaign: Dict, live: Optional[List[str]] = None) -> bool:
+        """Dial a RUNNING ``campaign`` whose worker is gone; False if it has one."""
+        if self.is_running(campaign["id"]):
+            return False
+        owner = campaign.get("worker_id")
+        if live is None:
+            live = await self.admission.live_workers(db)
+        if owner in live:
+            return False
+        # Conditional on the owner read, so only one worker takes it over
+        result = await db.platinum_campaigns.update_one(
+            {
+                "id": campaign["id"],
+                "status": CampaignStatus.RUNNING,
+                "worker_id": owner,
+            },
+            {"$set": {"worker_id": self.worker_id}},
+        )
+        if not result.modified_count:
+            return False
+        logger.warning("Resuming campaign %s left by worker %s", campaign["id"], owner)
+        self.start(db, campaign["id"])
+        return True
+
+    async def adopt_orphans(self, db) -> int:
+        """Dial every RUNNING campaign that no live worker is dialing."""
+        if self.originator is None:
+            return 0
+        live = await self.admission.live_workers(db)
+        count = 0
+        async for campaign in db.platinum_campaigns.find(
+            {"status": CampaignStatus.RUNNING, "worker_id": {"$nin": live}},
+            {"_id": 0, "id": 1, "worker_id": 1},
+        ):
+            if await self.adopt(db, campaign, live):
+                count += 1
+        return count
+
+    async def resume(self, db):
+        """Adopt orphaned campaigns now and every ``ADOPT_INTERVAL``."""
+        self._db = db
+        await self.adopt_orphans(db)
+        if self._adopt_task is None:
+            self._adopt_task = asyncio.create_task(self._adopt_loop())
+
+    async def _adopt_loop(self):
+        while True:
+            await asyncio.sleep(ADOPT_INTERVAL)
+            try:
+                await self.adopt_orphans(self._db)
+            except Exception:
+                logger.exception("Adopting orphaned campaigns failed")
+
+    def pause(self, campaign_id: str):
+        dialer = self._dialers.get(campaign_id)
+        if dialer:
+            dialer.request_halt(CampaignStatus.PAUSED)
+
+    def stop(self, campaign_id: str, hard: bool = False):
+        dialer = self._dialers.get(campaign_id)
+        if dialer:
+            dialer.request_halt(CampaignStatus.STOPPED, hard=hard)
+
+    async def shutdown(self):
+        """Pause dialing here; other workers, or the next start, resume it."""
+        if self._adopt_task is not None:
+            self._adopt_task.cancel()
+            self._adopt_task = None
+        for dialer in list(self._dialers.values()):
+            dialer.request_halt(CampaignStatus.PAUSED)
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=10)
+        close = getattr(self._originator, "close", None)
+        if close is not None:
+            await close()
+
+
+dialer_manager = DialerManager()
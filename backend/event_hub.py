@@ -0,0 +1,133 @@
+"""In-process fan-out of live events to Server-Sent Events subscribers.
+
+Publishers call ``event_hub.publish(topic, type, data)``; it never blocks.
+Each subscriber owns a bounded queue and a subscriber that falls
+``SUBSCRIBER_QUEUE_SIZE`` events behind is dropped, so one slow browser
+cannot hold up the dialer or grow memory. Dropped clients reconnect (the
+EventSource default) and start again from a fresh snapshot.
+"""
+
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Set, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = 256
+KEEPALIVE_INTERVAL = 15.0
+
+Event = Tuple[str, Any]
+
+_DROPPED = ("", None)
+
+
+class Subscription:
+    def __init__(self, topic: str, maxsize: int):
+        self.topic = topic
+        self.queue: "asyncio.Queue[Event]" = asyncio.Queue(maxsize=maxsize)
+        self.dropped = False
+
+    def offer(self, event: Event) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            # Discard the backlog and leave only the end-of-stream marker
+            self.dropped = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(_DROPPED)
+            return False
+
+    async def get(self, timeout: float) -> Optional[Event]:
+        """Next event, or None on timeout. Raises ``EOFError`` once dropped."""
+        try:
+            event = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        if event is _DROPPED:
+            raise EOFError
+        return event
+
+
+class EventHub:
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._topics: Dict[str, Set[Subscription]] = defaultdict(set)
+        self.dropped_subscribers = 0
+
+    def subscribe(self, topic: str) -> Subscription:
+        subscription = Subscription(topic, self.queue_size)
+        self._topics[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._topics.get(subscription.topic)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._topics[subscription.topic]
+
+    def has_subscribers(self, topic: str) -> bool:
+        return topic in self._topics
+
+    def publish(self, topic: str, event_type: str, data: Any):
+        subscribers = self._topics.get(topic)
+        if not subscribers:
+            return
+        for subscription in list(subscribers):
+            if not subscription.offer((event_type, data)):
+                logger.info("Dropping slow subscriber on %s", topic)
+                self.dropped_subscribers += 1
+                self.unsubscribe(subscription)
+
+
+def format_sse(event_type: str, data: Any) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+async def _stream(
+    hub: EventHub, subscription: Subscription, snapshot: Iterable[Event]
+) -> AsyncIterator[str]:
+    try:
+        for event_type, data in snapshot:
+            yield format_sse(event_type, data)
+        while True:
+            try:
+                event = await subscription.get(timeout=KEEPALIVE_INTERVAL)
+            except EOFError:
+                return
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield format_sse(*event)
+    finally:
+        hub.unsubscribe(subscription)
+
+
+def sse_response(
+    hub: EventHub, subscription: Subscription, snapshot: Iterable[Event] = ()
+) -> StreamingResponse:
+    """Stream ``snapshot`` and then the subscription's events.
+
+    Subscribe before building the snapshot so no event falls between them.
+    """
+    return StreamingResponse(
+        _stream(hub, subscription, snapshot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def campaign_topic(campaign_id: str) -> str:
+    return f"campaign:{campaign_id}"
+
+
+ACTIVE_CALLS_TOPIC = "active-calls"
+
+event_hub = EventHub()
@@ -0,0 +1,324 @@
+"""Scriptable local stand-in for the Asterisk Manager Interface.
+
+``FakeAMIServer`` speaks enough AMI for ``ami_client``: Login, Ping,
+Originate (async), Status, Hangup and Logoff. Each originated call follows a
+``CallScript`` chosen by the ``script`` callable, and emits Newchannel, a
+VarSet per originate variable, OriginateResponse, BridgeEnter and Hangup
+events to every session that logged in with events on. As with Asterisk, a
+call that is not answered hangs up before its failed OriginateResponse,
+which carries no channel uniqueid.
+
+Run it as a benchmark of the pooled client:
+
+    python fake_ami.py --calls 5000 --concurrency 500
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set
+
+from ami_client import decode_message, encode_message
+
+BANNER = b"Asterisk Call Manager/5.0.1\r\n"
+
+# outcome -> (OriginateResponse Reason, Hangup Cause, Cause-txt)
+OUTCOMES = {
+    "answer": ("4", "16", "Normal Clearing"),
+    "busy": ("5", "17", "User busy"),
+    "noanswer": ("3", "19", "No answer"),
+    "congestion": ("8", "34", "Circuit/channel congestion"),
+}
+# Reason and cause of a call hung up by a Hangup action
+HUNG_UP = ("1", "16", "Normal Clearing")
+
+
+@dataclass
+class CallScript:
+    outcome: str = "answer"
+    ring_time: float = 0.0
+    talk_time: float = 0.0
+
+
+def random_script(
+    answer_rate: float = 0.3,
+    busy_rate: float = 0.2,
+    ring_time: float = 0.01,
+    talk_time: float = 0.02,
+    seed: Optional[int] = None,
+) -> Callable[[str], CallScript]:
+    rng = random.Random(seed)
+
+    def script(number: str) -> CallScript:
+        roll = rng.random()
+        if roll < answer_rate:
+            return CallScript("answer", ring_time, talk_time)
+        if roll < answer_rate + busy_rate:
+            return CallScript("busy", ring_time)
+        return CallScript("noanswer", ring_time)
+
+    return script
+
+
+def originate_variables(block: bytes) -> Dict[str, str]:
+    """``Variable`` headers of an action; ``decode_message`` keeps the last."""
+    variables = {}
+    for line in block.decode(errors="replace").split("\r\n"):
+        key, sep, value = line.partition(":")
+        if sep and key.strip() == "Variable":
+            name, _, value = value.strip().partition("=")
+            variables[name] = value
+    return variables
+
+
+class _Session:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.authenticated = False
+        self.events = True
+
+    def send(self, message: Dict):
+        if not self.writer.is_closing():
+            self.writer.write(encode_message(message))
+
+
+class FakeAMIServer:
+    def __init__(
+        self,
+        username: str = "admin",
+        secret: str = "secret",
+        script: Optional[Callable[[str], CallScript]] = None,
+        response_delay: float = 0.0,
+    ):
+        self.username = username
+        self.secret = secret
+        self.script = script or (lambda number: CallScript())
+        self.response_delay = response_delay
+        self.host = "127.0.0.1"
+        self.port = 0
+        self.logins = 0
+        self.originates = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._sessions: Set[_Session] = set()
+        self._calls: Dict[str, asyncio.Event] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._uniqueids = itertools.count(1)
+
+    async def start(self) -> "FakeAMIServer":
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        for session in list(self._sessions):
+            session.writer.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def disconnect(self, events: Optional[bool] = None):
+        """Drop the sessions with events on (True), off (False) or all."""
+        for session in list(self._sessions):
+            if events is None or session.events == events:
+                session.writer.close()
+
+    def _broadcast(self, event: Dict):
+        for session in list(self._sessions):
+            if session.authenticated and session.events:
+                session.send(event)
+
+    async def _handle(self, reader, writer):
+        session = _Session(writer)
+        self._sessions.add(session)
+        writer.write(BANNER)
+        try:
+            while True:
+                block = await reader.readuntil(b"\r\n\r\n")
+                message = decode_message(block)
+                message["Variables"] = originate_variables(block)
+                if self.response_delay:
+                    await asyncio.sleep(self.response_delay)
+                if not self._handle_action(session, message):
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._sessions.discard(session)
+            writer.close()
+
+    def _handle_action(self, session: _Session, message: Dict) -> bool:
+        action = message.get("Action", "").lower()
+        action_id = message.get("ActionID", "")
+        reply = {"Response": "Success", "ActionID": action_id}
+        if action == "login":
+            if (message.get("Username"), message.get("Secret")) != (
+                self.username,
+                self.secret,
+            ):
+                session.send(
+                    {**reply, "Response": "Error", "Message": "Authentication failed"}
+                )
+                return True
+            session.authenticated = True
+            session.events = message.get("Events", "on").lower() != "off"
+            self.logins += 1
+            session.send({**reply, "Message": "Authentication accepted"})
+        elif not session.authenticated:
+            session.send({**reply, "Response": "Error", "Message": "Permission denied"})
+        elif action == "logoff":
+            session.send({"Response": "Goodbye", "ActionID": action_id})
+            return False
+        elif action == "ping":
+            session.send({**reply, "Ping": "Pong"})
+        elif action == "originate":
+            self.originates += 1
+            session.send({**reply, "Message": "Originate successfully queued"})
+            task = asyncio.create_task(self._run_call(message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        elif action == "status":
+            if message.get("Channel", "") in self._calls:
+                session.send({**reply, "Message": "Channel status will follow"})
+            else:
+                session.send(
+                    {**reply, "Response": "Error", "Message": "No such channel"}
+                )
+        elif action == "hangup":
+            event = self._calls.get(message.get("Channel", ""))
+            if event is None:
+                session.send(
+                    {**reply, "Response": "Error", "Message": "No such channel"}
+                )
+            else:
+                event.set()
+                session.send({**reply, "Message": "Channel Hungup"})
+        else:
+            session.send(
+                {**reply, "Response": "Error", "Message": "Invalid/unknown command"}
+            )
+        return True
+
+    async def _run_call(self, action: Dict):
+        target = action.get("Channel", "")
+        number = target.rsplit("/", 1)[-1]
+        script = self.script(number)
+        uniqueid = f"{int(time.time())}.{next(self._uniqueids)}"
+        channel = f"{target}-{uniqueid}"
+        base = {"Channel": channel, "Uniqueid": uniqueid, "CallerIDNum": number}
+        reason, cause, cause_txt = OUTCOMES[script.outcome]
+        response = {
+            "Event": "OriginateResponse",
+            "ActionID": action.get("ActionID", ""),
+            "Response": "Success",
+            "Reason": reason,
+            **base,
+        }
+        hangup = self._calls[channel] = asyncio.Event()
+        try:
+            self._broadcast({"Event": "Newchannel", **base, "Exten": number})
+            for name, value in action.get("Variables", {}).items():
+                self._broadcast(
+                    {"Event": "VarSet", **base, "Variable": name, "Value": value}
+                )
+            await self._wait(hangup, script.ring_time)
+            if hangup.is_set():
+                reason, cause, cause_txt = HUNG_UP
+            if script.outcome != "answer" or hangup.is_set():
+                self._broadcast(
+                    {"Event": "Hangup", **base, "Cause": cause, "Cause-txt": cause_txt}
+                )
+                # Only the dial string is known of a failed originate
+                response.update(
+                    Response="Failure",
+                    Reason=reason,
+                    Channel=target,
+                    Uniqueid="<null>",
+                )
+                self._broadcast(response)
+                return
+            self._broadcast(response)
+            self._broadcast({"Event": "BridgeEnter", **base})
+            await self._wait(hangup, script.talk_time)
+            if hangup.is_set():
+                cause, cause_txt = HUNG_UP[1:]
+            self._broadcast(
+                {"Event": "Hangup", **base, "Cause": cause, "Cause-txt": cause_txt}
+            )
+        finally:
+            self._calls.pop(channel, None)
+
+    @staticmethod
+    async def _wait(event: asyncio.Event, seconds: float):
+        if seconds <= 0:
+            return
+        try:
+            await asyncio.wait_for(event.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def benchmark(calls: int, concurrency: int, pool_size: int) -> Dict:
+    from ami_client import AMIOriginator, AMIPool, AMISettings
+    from dialer import OriginateRequest
+
+    server = await FakeAMIServer(script=random_script(seed=1)).start()
+    settings = AMISettings(
+        host=server.host,
+        port=server.port,
+        username=server.username,
+        secret=server.secret,
+        pool_size=pool_size,
+    )
+    originator = AMIOriginator(AMIPool(settings))
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def noop():
+        return None
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await originator.originate(
+                OriginateRequest(
+                    call_id=str(i),
+                    campaign_id="bench",
+                    number=f"90555{i:07d}",
+                    trunk="SIP/bench",
+                    context="velora-platinum-dialer",
+                ),
+                noop,
+            )
+            latencies.append(time.perf_counter() - started)
+
+    await originator.pool.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    elapsed = time.perf_counter() - started
+    await originator.close()
+    await server.stop()
+
+    latencies.sort()
+    return {
+        "calls": calls,
+        "seconds": round(elapsed, 3),
+        "calls_per_sec": round(calls / elapsed, 1),
+        "logins": server.logins,
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the AMI client")
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--pool-size", type=int, default=2)
+    args = parser.parse_args()
+    print(asyncio.run(benchmark(args.calls, args.concurrency, args.pool_size)))
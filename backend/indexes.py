@@ -0,0 +1,301 @@
+"""Declarative Mongo index registry and query-plan verification.
+
+``INDEXES`` lists every index the routers rely on; ``ensure_indexes`` applies
+it idempotently at startup. ``QUERY_PLANS`` holds the representative query
+shape of each router, and ``verify_query_plans`` runs them through
+``explain()`` and reports any that would fall back to a COLLSCAN.
+
+Verify against a database (exits non-zero on a collection scan):
+
+    python indexes.py --verify
+"""
+
+import asyncio
+import logging
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+
+def _unique_id() -> IndexModel:
+    return IndexModel([("id", ASCENDING)], unique=True, name="id_unique")
+
+
+def _asterisk_uniqueid() -> IndexModel:
+    # Sparse: only rows that came from (or were matched to) an Asterisk CDR
+    return IndexModel(
+        [("asterisk_uniqueid", ASCENDING)],
+        unique=True,
+        sparse=True,
+        name="asterisk_uniqueid_unique",
+    )
+
+
+def _newest_first(*prefix: str, field_name: str = "created_at") -> IndexModel:
+    keys = [(key, ASCENDING) for key in prefix]
+    keys += [(field_name, DESCENDING), ("id", DESCENDING)]
+    return IndexModel(keys, name="_".join([*prefix, field_name, "id"]) + "_page")
+
+
+def _traffic_indexes() -> List[IndexModel]:
+    return [
+        IndexModel(
+            [
+                ("bucket", ASCENDING),
+                ("customer_id", ASCENDING),
+                ("dealer_id", ASCENDING),
+                ("country", ASCENDING),
+                ("codec", ASCENDING),
+            ],
+            unique=True,
+            name="bucket_key_unique",
+        ),
+        IndexModel([("customer_id", ASCENDING), ("bucket", ASCENDING)]),
+        IndexModel([("dealer_id", ASCENDING), ("bucket", ASCENDING)]),
+    ]
+
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "dealers": [_unique_id()],
+    "customers": [_unique_id(), IndexModel([("dealer_id", ASCENDING)])],
+    "users": [_unique_id(), IndexModel([("customer_id", ASCENDING)])],
+    "tariffs": [_unique_id(), IndexModel([("name", ASCENDING)])],
+    "trunk_settings": [IndexModel([("customer_id", ASCENDING)])],
+    "call_records": [
+        _unique_id(),
+        _newest_first(field_name="call_date"),
+        _newest_first("customer_id", field_name="call_date"),
+        _asterisk_uniqueid(),
+    ],
+    "active_calls": [
+        _unique_id(),
+        IndexModel([("status", ASCENDING)]),
+        IndexModel([("source", ASCENDING), ("status", ASCENDING)]),
+        IndexModel([("worker_id", ASCENDING)]),
+    ],
+    "chat_messages": [
+        IndexModel([("session_id", ASCENDING), ("timestamp", ASCENDING)])
+    ],
+    "chat_contexts": [
+        IndexModel([("session_id", ASCENDING)], unique=True, name="session_id_unique")
+    ],
+    "platinum_scripts": [_unique_id(), _newest_first()],
+    "platinum_campaigns": [_unique_id(), _newest_first(), _newest_first("status")],
+    "platinum_call_logs": [
+        _unique_id(),
+        _newest_first("campaign_id"),
+        _newest_first("campaign_id", "status"),
+        _asterisk_uniqueid(),
+        # Only calls waiting for a retry, so the index stays small
+        IndexModel(
+            [("campaign_id", ASCENDING), ("next_retry_at", ASCENDING)],
+            partialFilterExpression={"next_retry_at": {"$type": "date"}},
+            name="campaign_id_next_retry_at_partial",
+        ),
+    ],
+    "platinum_campaign_numbers": [
+        IndexModel(
+            [("campaign_id", ASCENDING), ("number", ASCENDING)],
+            unique=True,
+            name="campaign_number_unique",
+        ),
+        IndexModel(
+            [("campaign_id", ASCENDING), ("drained", ASCENDING), ("_id", ASCENDING)]
+        ),
+    ],
+    "cdr_import_checkpoints": [_unique_id()],
+    "rating_state": [_unique_id()],
+    "crm_statistics": [_unique_id()],
+    "admission_leases": [_unique_id()],
+    "admission_workers": [_unique_id(), IndexModel([("seen_at", ASCENDING)])],
+    "live_call_workers": [_unique_id(), IndexModel([("seen_at", ASCENDING)])],
+    "traffic_hourly": _traffic_indexes(),
+    "traffic_daily": _traffic_indexes(),
+}
+
+
+async def ensure_indexes(db):
+    """Create every registered index; existing ones are left untouched."""
+    for collection, models in INDEXES.items():
+        try:
+            await db[collection].create_indexes(models)
+        except OperationFailure as e:
+            # e.g. duplicate ids in old data blocking a unique index
+            logger.error("Could not create indexes on %s: %s", collection, e)
+
+
+@dataclass
+class QueryPlan:
+    name: str
+    collection: str
+    filter: Dict[str, Any]
+    sort: List[Tuple[str, int]] = field(default_factory=list)
+    limit: int = 100
+
+
+_PAGE = [("created_at", DESCENDING), ("id", DESCENDING)]
+_CDR_PAGE = [("call_date", DESCENDING), ("id", DESCENDING)]
+
+QUERY_PLANS: List[QueryPlan] = [
+    QueryPlan("dealer by id", "dealers", {"id": "x"}, limit=1),
+    QueryPlan("customer by id", "customers", {"id": "x"}, limit=1),
+    QueryPlan("customers by dealer", "customers", {"dealer_id": "x"}),
+    QueryPlan("users by customer", "users", {"customer_id": "x"}),
+    QueryPlan(
+        "trunk settings by customer", "trunk_settings", {"customer_id": "x"}, limit=1
+    ),
+    QueryPlan("call records page", "call_records", {}, _CDR_PAGE),
+    QueryPlan("customer call history", "call_records", {"customer_id": "x"}, _CDR_PAGE),
+    QueryPlan(
+        "re-rating period",
+        "call_records",
+        {
+            "customer_id": {"$in": ["x", "y"]},
+            "call_date": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2024, 2, 1)},
+        },
+        limit=0,
+    ),
+    QueryPlan(
+        "call record by uniqueid", "call_records", {"asterisk_uniqueid": "x"}, limit=1
+    ),
+    QueryPlan(
+        "traffic range",
+        "traffic_daily",
+        {"bucket": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2024, 2, 1)}},
+        limit=0,
+    ),
+    QueryPlan(
+        "dealer traffic",
+        "traffic_hourly",
+        {
+            "dealer_id": "x",
+            "bucket": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2024, 1, 2)},
+        },
+        limit=0,
+    ),
+    QueryPlan("active calls", "active_calls", {"status": "active"}),
+    QueryPlan(
+        "API active calls", "active_calls", {"source": "api", "status": "active"}
+    ),
+    QueryPlan(
+        "calls of stopped workers",
+        "active_calls",
+        {"source": {"$ne": "api"}, "worker_id": {"$nin": ["x"]}},
+    ),
+    QueryPlan(
+        "chat history",
+        "chat_messages",
+        {"session_id": "x"},
+        [("timestamp", ASCENDING)],
+    ),
+    QueryPlan("chat context", "chat_contexts", {"session_id": "x"}, limit=1),
+    QueryPlan("script by id", "platinum_scripts", {"id": "x"}, limit=1),
+    QueryPlan("scripts page", "platinum_scripts", {}, _PAGE),
+    QueryPlan("campaign by id", "platinum_campaigns", {"id": "x"}, limit=1),
+    QueryPlan("campaigns page", "platinum_campaigns", {"status": "running"}, _PAGE),
+    QueryPlan(
+        "orphaned campaigns",
+        "platinum_campaigns",
+        {"status": "running", "worker_id": {"$nin": ["x"]}},
+        limit=0,
+    ),
+    QueryPlan(
+        "scheduled campaigns",
+        "platinum_campaigns",
+        {"status": {"$in": ["scheduled", "running"]}, "schedule": {"$ne": None}},
+        limit=0,
+    ),
+    QueryPlan("call log by id", "platinum_call_logs", {"id": "x"}, limit=1),
+    QueryPlan("campaign calls page", "platinum_call_logs", {"campaign_id": "x"}, _PAGE),
+    QueryPlan(
+        "call log by uniqueid",
+        "platinum_call_logs",
+        {"asterisk_uniqueid": "x"},
+        limit=1,
+    ),
+    QueryPlan(
+        "dialer pending calls",
+        "platinum_call_logs",
+        {"campaign_id": "x", "status": "pending"},
+        [("created_at", ASCENDING)],
+    ),
+    QueryPlan(
+        "scheduled retries",
+        "platinum_call_logs",
+        {"campaign_id": "x", "next_retry_at": {"$type": "date"}},
+        limit=0,
+    ),
+    QueryPlan(
+        "undrained numbers",
+        "platinum_campaign_numbers",
+        {"campaign_id": "x", "drained": False},
+        [("_id", ASCENDING)],
+    ),
+]
+
+
+def _stages(plan: Dict) -> List[str]:
+    stages = []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        if "stage" in node:
+            stages.append(node["stage"])
+        for key in ("inputStage", "queryPlan", "innerStage", "outerStage"):
+            if key in node:
+                stack.append(node[key])
+        stack.extend(node.get("inputStages", []))
+    return stages
+
+
+async def explain_stages(db, query: QueryPlan) -> List[str]:
+    cursor = db[query.collection].find(query.filter).limit(query.limit)
+    if query.sort:
+        cursor = cursor.sort(query.sort)
+    explained = await cursor.explain()
+    return _stages(explained["queryPlanner"]["winningPlan"])
+
+
+async def verify_query_plans(db, plans: Optional[List[QueryPlan]] = None) -> List[str]:
+    """Return the names of queries whose winning plan contains a COLLSCAN."""
+    failures = []
+    for query in plans or QUERY_PLANS:
+        stages = await explain_stages(db, query)
+        if "COLLSCAN" in stages:
+            failures.append(f"{query.name} ({query.collection}): {' -> '.join(stages)}")
+    return failures
+
+
+async def _main(verify: bool) -> int:
+    from pathlib import Path
+
+    import database
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).parent / ".env")
+    db = database.connect()
+    try:
+        await ensure_indexes(db)
+        if not verify:
+            return 0
+        failures = await verify_query_plans(db)
+        for failure in failures:
+            print(f"COLLSCAN: {failure}")
+        print(
+            f"{len(QUERY_PLANS) - len(failures)}/{len(QUERY_PLANS)} queries use an index"
+        )
+        return 1 if failures else 0
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main("--verify" in sys.argv)))
@@ -0,0 +1,134 @@
+"""LLM clients of the chatbot and a local stand-in.
+
+``stream_reply`` yields a reply in chunks as the model produces them. Clients
+with a ``stream_message`` method (``FakeLlm``) are streamed; others, like the
+current ``LlmChat``, yield their whole reply as a single chunk.
+
+``FakeLlm`` answers without a network or API key, after a configurable delay
+and at a configurable token rate, so time to first byte can be measured
+offline. It is selected with ``CHAT_LLM=fake``. To compare the plain and the
+streaming endpoint of a running server:
+
+    python llm.py --url http://localhost:8000 --requests 50 --concurrency 10
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from typing import AsyncIterator, Dict, List, Optional
+
+FAKE_REPLY = (
+    "Velora'yı tercih ettiğiniz için teşekkür ederiz. 0850 numaralar, bulut "
+    "santral ve toplu SMS hizmetlerimiz hakkında detaylı bilgi için "
+    "0850 000 00 00 numaralı telefondan bize ulaşabilirsiniz."
+)
+
+
+class FakeLlm:
+    """Streams ``reply`` word by word at ``tokens_per_second``."""
+
+    def __init__(
+        self,
+        tokens_per_second: Optional[float] = None,
+        first_token_delay: Optional[float] = None,
+        reply: str = FAKE_REPLY,
+    ):
+        if tokens_per_second is None:
+            tokens_per_second = float(os.environ.get("FAKE_LLM_TOKENS_PER_SECOND", 30))
+        if first_token_delay is None:
+            first_token_delay = (
+                int(os.environ.get("FAKE_LLM_FIRST_TOKEN_MS", 500)) / 1000
+            )
+        self.tokens_per_second = tokens_per_second
+        self.first_token_delay = first_token_delay
+        self.reply = reply
+
+    def _tokens(self) -> List[str]:
+        words = self.reply.split(" ")
+        return [words[0]] + [" " + word for word in words[1:]]
+
+    async def stream_message(self, message) -> AsyncIterator[str]:
+        await asyncio.sleep(self.first_token_delay)
+        for i, token in enumerate(self._tokens()):
+            if i:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield token
+
+    async def send_message(self, message) -> str:
+        return "".join([token async for token in self.stream_message(message)])
+
+
+async def stream_reply(client, message) -> AsyncIterator[str]:
+    stream = getattr(client, "stream_message", None)
+    if stream is None:
+        yield await client.send_message(message)
+        return
+    async for chunk in stream(message):
+        if chunk:
+            yield chunk
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+async def _measure(client, url: str, stream: bool) -> Dict[str, float]:
+    # A different question each time, so the answer cache is not measured
+    session_id = str(uuid.uuid4())
+    body = {
+        "message": f"0850 numara nasıl alınır? {session_id}",
+        "session_id": session_id,
+    }
+    path = "/api/chatbot/chat/stream" if stream else "/api/chatbot/chat"
+    started = time.perf_counter()
+    first = None
+    async with client.stream("POST", url + path, json=body) as response:
+        response.raise_for_status()
+        async for _ in response.aiter_bytes():
+            if first is None:
+                first = time.perf_counter()
+    ended = time.perf_counter()
+    return {"ttfb": (first or ended) - started, "total": ended - started}
+
+
+async def _bench(url: str, requests: int, concurrency: int, stream: bool) -> Dict:
+    import httpx
+
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(client):
+        async with gate:
+            return await _measure(client, url, stream)
+
+    async with httpx.AsyncClient(timeout=120) as client:
+        results = await asyncio.gather(*(one(client) for _ in range(requests)))
+    report = {"endpoint": "stream" if stream else "chat", "requests": requests}
+    for key in ("ttfb", "total"):
+        values = [result[key] * 1000 for result in results]
+        report[f"{key}_p50_ms"] = round(statistics.median(values), 1)
+        report[f"{key}_p95_ms"] = round(_percentile(values, 0.95), 1)
+    return report
+
+
+async def _main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare chatbot time to first byte")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    for stream in (False, True):
+        report = await _bench(args.url, args.requests, args.concurrency, stream)
+        print(json.dumps(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
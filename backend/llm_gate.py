@@ -0,0 +1,272 @@
+"""Concurrency gate and per-session rate limits for LLM calls.
+
+``LlmGate`` lets ``max_concurrent`` LLM calls run at once. Further calls wait
+in a FIFO of at most ``max_queue``; a call that finds the queue full, or is
+still queued after ``queue_timeout``, fails at once with ``LlmOverloaded`` so
+the chatbot can answer with its canned fallback instead of piling up behind
+a slow upstream. An admitted call must finish (or, streamed, produce each
+chunk) within its ``timeout`` or ends with ``LlmTimeout``. Under overload the
+latency of answered requests stays bounded by the queue and call deadlines
+rather than growing with the backlog.
+
+``RateLimiter`` is a token bucket per key (a session, or the client address
+of requests without one), kept in a bounded ``TTLCache``.
+
+``python llm_gate.py --overload 10`` drives a fake LLM that slows down with
+load at ten times its capacity, with and without the gate.
+"""
+
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, TypeVar
+
+from pydantic import BaseModel
+
+from response_cache import TTLCache
+
+T = TypeVar("T")
+
+
+class LlmOverloaded(Exception):
+    """No slot for the call: the queue is full or the wait timed out."""
+
+
+class LlmTimeout(Exception):
+    """The call took longer than its timeout."""
+
+
+class LlmGateMetrics(BaseModel):
+    max_concurrent: int
+    max_queue: int
+    in_flight: int
+    queued: int
+    admitted: int
+    shed: int
+    timeouts: int
+
+
+class LlmGate:
+    def __init__(
+        self,
+        max_concurrent: int,
+        max_queue: int,
+        queue_timeout: float,
+        timeout: float,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.shed = 0
+        self.timeouts = 0
+
+    async def _acquire(self):
+        if self.in_flight < self.max_concurrent and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.shed += 1
+            raise LlmOverloaded("queue full")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Cancelled after the slot was handed over: pass it on
+                self._release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.shed += 1
+                raise LlmOverloaded("queue timeout") from None
+            raise
+        self.admitted += 1
+
+    def _release(self):
+        # Hand the slot straight to the longest waiter
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run ``fn()`` in a slot, within the call timeout."""
+        await self._acquire()
+        try:
+            return await asyncio.wait_for(fn(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise LlmTimeout() from None
+        finally:
+            self._release()
+
+    async def stream(self, fn: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Iterate ``fn()`` in a slot; each chunk must come within the timeout."""
+        await self._acquire()
+        chunks = fn()
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    raise LlmTimeout() from None
+                yield chunk
+        finally:
+            self._release()
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def metrics(self) -> LlmGateMetrics:
+        return LlmGateMetrics(
+            max_concurrent=self.max_concurrent,
+            max_queue=self.max_queue,
+            in_flight=self.in_flight,
+            queued=len(self._waiters),
+            admitted=self.admitted,
+            shed=self.shed,
+            timeouts=self.timeouts,
+        )
+
+
+class RateLimiter:
+    """At most ``per_minute`` requests per key, in bursts of ``burst``."""
+
+    def __init__(
+        self,
+        per_minute: float,
+        burst: int,
+        max_sessions: int = 100_000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.clock = clock
+        self.limited = 0
+        # key -> [tokens, refilled_at]; idle keys are full again
+        # after burst / rate seconds and can be forgotten
+        self._buckets: TTLCache[List[float]] = TTLCache(
+            max_sessions, ttl=burst / self.rate if self.rate else 3600, clock=clock
+        )
+
+    def allow(self, key: str) -> bool:
+        now = self.clock()
+        bucket = self._buckets.pop(key) or [float(self.burst), now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        allowed = tokens >= 1
+        self._buckets.put(key, [tokens - 1 if allowed else tokens, now])
+        if not allowed:
+            self.limited += 1
+        return allowed
+
+
+class _SaturatingLlm:
+    """Fake upstream that slows down in proportion to its load."""
+
+    def __init__(self, latency: float, capacity: int):
+        self.latency = latency
+        self.capacity = capacity
+        self.in_flight = 0
+
+    async def send_message(self) -> str:
+        self.in_flight += 1
+        try:
+            load = max(1.0, self.in_flight / self.capacity)
+            await asyncio.sleep(self.latency * load * random.uniform(0.8, 1.2))
+            return "ok"
+        finally:
+            self.in_flight -= 1
+
+
+async def load_test(
+    overload: float,
+    seconds: float,
+    gated: bool,
+    latency: float = 0.5,
+    capacity: int = 20,
+    seed: int = 1,
+) -> Dict:
+    """Send ``overload`` times the upstream's capacity for ``seconds``."""
+    random.seed(seed)
+    upstream = _SaturatingLlm(latency, capacity)
+    gate = LlmGate(
+        max_concurrent=capacity,
+        max_queue=capacity,
+        queue_timeout=latency,
+        timeout=latency * 4,
+    )
+    served: List[float] = []
+    failed: List[float] = []
+
+    async def request():
+        started = time.perf_counter()
+        try:
+            if gated:
+                await gate.call(upstream.send_message)
+            else:
+                await upstream.send_message()
+            served.append(time.perf_counter() - started)
+        except (LlmOverloaded, LlmTimeout):
+            failed.append(time.perf_counter() - started)
+
+    interval = latency / (capacity * overload)
+    tasks = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        tasks.append(asyncio.create_task(request()))
+        await asyncio.sleep(random.expovariate(1 / interval))
+    await asyncio.gather(*tasks)
+
+    def ms(values: List[float], q: float) -> float:
+        if not values:
+            return 0.0
+        values = sorted(values)
+        return round(values[min(int(q * len(values)), len(values) - 1)] * 1000, 1)
+
+    return {
+        "mode": "gated" if gated else "ungated",
+        "requests": len(tasks),
+        "served": len(served),
+        "fallback": len(failed),
+        "served_p50_ms": ms(served, 0.5),
+        "served_p99_ms": ms(served, 0.99),
+        "fallback_p99_ms": ms(failed, 0.99),
+        "mean_ms": round(statistics.mean(served + failed) * 1000, 1),
+    }
+
+
+async def _main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Overload a fake LLM")
+    parser.add_argument("--overload", type=float, default=10.0)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--capacity", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    for gated in (True, False):
+        report = await load_test(
+            args.overload, args.seconds, gated, args.latency, args.capacity
+        )
+        print(json.dumps(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,173 @@
+"""Chunked storage and streaming upload of campaign number lists.
+
+Numbers live in ``platinum_campaign_numbers`` (one document per number,
+keyed by ``campaign_id``) rather than inline in the campaign document, so
+list size is not bounded by Mongo's document limit and campaign reads stay
+small. Uploads are parsed incrementally and written in ``insert_many``
+batches, so memory use does not grow with the file.
+"""
+
+import codecs
+import csv
+import json
+import re
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+INSERT_BATCH_SIZE = 5000
+READ_CHUNK_SIZE = 64 * 1024
+DUPLICATE_KEY = 11000
+
+_STRIP = re.compile(r"[\s\-().]")
+_VALID = re.compile(r"^\+?\d{6,15}$")
+
+
+def normalize_number(raw: str) -> Optional[str]:
+    """Return the number as digits (E.164 without '+'), or None if invalid."""
+    number = _STRIP.sub("", raw or "")
+    if not _VALID.match(number):
+        return None
+    return number.lstrip("+")
+
+
+def _number_from_line(line: str, ndjson: bool) -> Optional[str]:
+    if ndjson:
+        try:
+            value = json.loads(line)
+        except ValueError:
+            return None
+        if isinstance(value, dict):
+            value = value.get("number")
+        return str(value) if value is not None else None
+    row = next(csv.reader([line]), None)
+    return row[0] if row else None
+
+
+async def iter_upload_lines(
+    upload, chunk_size: int = READ_CHUNK_SIZE
+) -> AsyncIterator[str]:
+    """Yield decoded lines from an UploadFile without reading it whole."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    remainder = ""
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        lines = (remainder + decoder.decode(chunk)).split("\n")
+        remainder = lines.pop()
+        for line in lines:
+            yield line
+    remainder += decoder.decode(b"", final=True)
+    if remainder:
+        yield remainder
+
+
+async def iter_upload_numbers(upload, stats: Dict[str, int]) -> AsyncIterator[str]:
+    """Yield normalized numbers from a CSV or NDJSON upload.
+
+    The format is taken from the file name, falling back to sniffing the
+    first non-empty line. For CSV the first column is used and a non-numeric
+    header row is skipped. Rejected lines are counted in ``stats["invalid"]``.
+    """
+    filename = (getattr(upload, "filename", None) or "").lower()
+    ndjson: Optional[bool] = True if filename.endswith((".ndjson", ".jsonl")) else None
+    if filename.endswith(".csv"):
+        ndjson = False
+    first = True
+    async for line in iter_upload_lines(upload):
+        line = line.strip()
+        if not line:
+            continue
+        if ndjson is None:
+            ndjson = line.startswith(("{", '"'))
+        raw = _number_from_line(line, ndjson)
+        number = normalize_number(raw) if raw else None
+        header = first and not ndjson
+        first = False
+        if number is None:
+            # A non-numeric first CSV row is a header, not a rejected number
+            if not header:
+                stats["invalid"] += 1
+            continue
+        yield number
+
+
+async def _aiter(numbers: Iterable[str]) -> AsyncIterator[str]:
+    for number in numbers:
+        yield number
+
+
+async def store_numbers(
+    db, campaign_id: str, numbers, update_stats: bool = True
+) -> Dict[str, int]:
+    """Write numbers for a campaign in batches and bump its total/pending stats.
+
+    ``numbers`` may be a plain iterable or an async iterator. Duplicates
+    rejected by the unique (campaign_id, number) index are counted, not
+    raised.
+    """
+    if not hasattr(numbers, "__aiter__"):
+        numbers = _aiter(numbers)
+    result = {"accepted": 0, "duplicates": 0}
+    batch: List[Dict] = []
+    async for number in numbers:
+        batch.append({"campaign_id": campaign_id, "number": number, "drained": False})
+        if len(batch) >= INSERT_BATCH_SIZE:
+            await _insert_batch(db, batch, result)
+            batch = []
+    if batch:
+        await _insert_batch(db, batch, result)
+
+    if update_stats and result["accepted"]:
+        await db.platinum_campaigns.update_one(
+            {"id": campaign_id},
+            {
+                "$inc": {
+                    "stats.total": result["accepted"],
+                    "stats.pending": result["accepted"],
+                }
+            },
+        )
+    return result
+
+
+async def _insert_batch(db, batch: List[Dict], result: Dict[str, int]):
+    try:
+        inserted = await db.platinum_campaign_numbers.insert_many(batch, ordered=False)
+        result["accepted"] += len(inserted.inserted_ids)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        duplicates = sum(1 for error in errors if error.get("code") == DUPLICATE_KEY)
+        result["accepted"] += e.details.get("nInserted", 0)
+        result["duplicates"] += duplicates
+        if duplicates != len(errors):
+            raise
+
+
+async def iter_undrained(
+    db, campaign_id: str, batch_size: int
+) -> AsyncIterator[List[Dict]]:
+    """Yield batches of numbers not yet copied into call logs.
+
+    The caller must ``mark_drained`` each batch before taking the next one.
+    """
+    while True:
+        batch = (
+            await db.platinum_campaign_numbers.find(
+                {"campaign_id": campaign_id, "drained": False},
+                {"_id": 1, "number": 1},
+            )
+            .sort("_id", 1)
+            .limit(batch_size)
+            .to_list(length=batch_size)
+        )
+        if not batch:
+            return
+        yield batch
+
+
+async def mark_drained(db, ids: List):
+    await db.platinum_campaign_numbers.update_many(
+        {"_id": {"$in": ids}}, {"$set": {"drained": True}}
+    )
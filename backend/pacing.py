@@ -0,0 +1,338 @@
+"""Predictive pacing of campaign originations.
+
+In fixed mode a campaign keeps ``concurrency`` calls in flight. In
+predictive mode a ``Pacer`` sizes that number from what it measures over the
+last ``WINDOW`` attempts: the answer rate, how long attempts ring and how
+long answered calls last. Answers are needed as fast as talking calls end,
+plus enough to fill the free ``answer_capacity`` (agents or IVR ports)
+within one time-to-answer; dividing by the answer rate gives dials per
+second, and by Little's law the calls to keep ringing.
+
+An answered call that finds the capacity full is abandoned. Every abandon
+scales that estimate down by ``ABANDON_BACKOFF`` and every call served
+scales it up by a step sized so the two balance at the target abandon rate.
+The result is capped at ``max_concurrency`` and, in the dialer, at the
+trunk's admission headroom.
+
+That balance only holds on average, so the calls ringing are also capped
+so the run's abandon rate stays below the target: beyond the free capacity,
+which cannot cause an abandon, they may only bring the answers the abandons
+allowed so far can absorb. The cap uses a pessimistic answer rate (every
+call answers until ``WINDOW // 5`` attempts are measured), keeps
+``ABANDON_Z`` standard deviations of answers spare and aims at
+``ABANDON_MARGIN`` of the target.
+
+``simulate`` runs the same pacer against a seeded random call model on a
+virtual clock, so pacing can be checked offline and deterministically:
+
+    python pacing.py --answer-rate 0.25 --capacity 30 --minutes 60
+"""
+
+import heapq
+import itertools
+import json
+import math
+import random
+import sys
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, List, Tuple
+
+from pydantic import BaseModel
+
+from platinum_campaigns import Pacing, PacingMode
+
+WINDOW = 500
+ABANDON_WINDOW = 200
+MIN_ANSWER_RATE = 0.05
+MIN_GAIN = 0.05
+MAX_GAIN = 2.0
+# Gain factor applied per abandoned call
+ABANDON_BACKOFF = 0.9
+# Fraction of the target abandon rate aimed at, and the spread of answers
+# kept spare, so the achieved rate stays below the target
+ABANDON_MARGIN = 0.8
+ABANDON_Z = 2.5
+
+# Estimates until enough calls are measured
+PRIOR_ANSWER_RATE = 0.25
+PRIOR_ATTEMPT_TIME = 20.0
+PRIOR_RING_TIME = 15.0
+PRIOR_TALK_TIME = 60.0
+
+
+class _Window:
+    """Mean of the last ``size`` samples, or ``prior`` until there are enough."""
+
+    def __init__(self, size: int, prior: float):
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.prior = prior
+        self.total = 0.0
+
+    def add(self, value: float):
+        if len(self.samples) == self.samples.maxlen:
+            self.total -= self.samples[0]
+        self.samples.append(value)
+        self.total += value
+
+    @property
+    def measured(self) -> bool:
+        return len(self.samples) >= self.samples.maxlen // 5
+
+    @property
+    def mean(self) -> float:
+        if not self.measured:
+            return self.prior
+        return self.total / len(self.samples)
+
+
+class Pacer:
+    def __init__(self, max_concurrency: int, capacity: int, target_abandon_rate: float):
+        self.max_concurrency = max_concurrency
+        self.capacity = capacity
+        self.target_abandon_rate = target_abandon_rate
+        self.gain = 1.0
+        # Windows rather than moving averages: outcomes arrive in bursts
+        # (busy after seconds, no answer only at the timeout)
+        self._answers = _Window(WINDOW, PRIOR_ANSWER_RATE)
+        self._attempt_time = _Window(WINDOW, PRIOR_ATTEMPT_TIME)
+        self._ring_time = _Window(WINDOW, PRIOR_RING_TIME)
+        self._talk_time = _Window(WINDOW, PRIOR_TALK_TIME)
+        self._abandons = _Window(ABANDON_WINDOW, 0.0)
+        # Over the whole run, for the hard bound
+        self.served = 0
+        self.abandoned = 0
+
+    @classmethod
+    def from_settings(cls, pacing: Pacing) -> "Pacer":
+        pacer = cls(pacing.max_concurrency, 0, 0.0)
+        pacer.configure(pacing)
+        return pacer
+
+    def configure(self, pacing: Pacing):
+        self.max_concurrency = pacing.max_concurrency
+        self.capacity = pacing.answer_capacity or pacing.max_concurrency
+        self.target_abandon_rate = pacing.target_abandon_rate
+
+    @property
+    def answer_rate(self) -> float:
+        return self._answers.mean
+
+    @property
+    def abandon_rate(self) -> float:
+        return self._abandons.mean
+
+    def answered(self, ring_time: float, abandoned: bool = False):
+        """A dial attempt was answered after ``ring_time`` seconds."""
+        self._answers.add(1.0)
+        self._attempt_time.add(ring_time)
+        self._ring_time.add(ring_time)
+        self._abandons.add(float(abandoned))
+        if abandoned:
+            self.abandoned += 1
+        else:
+            self.served += 1
+        # Down on every abandon, up a little on every call served: the steps
+        # balance exactly when the abandon rate equals the target
+        if abandoned:
+            self.gain *= ABANDON_BACKOFF
+        else:
+            self.gain *= 1 + self._step_up()
+        self.gain = min(max(self.gain, MIN_GAIN), MAX_GAIN)
+
+    def unanswered(self, ring_time: float):
+        """A dial attempt ended unanswered (busy, no answer, failed)."""
+        self._answers.add(0.0)
+        self._attempt_time.add(ring_time)
+
+    def hung_up(self, talk_time: float):
+        """An answered call that was served ended."""
+        self._talk_time.add(talk_time)
+
+    def _step_up(self) -> float:
+        rate = self.target_abandon_rate * ABANDON_MARGIN
+        return -math.log(ABANDON_BACKOFF) * rate / max(1 - rate, 1e-6)
+
+    def max_ringing(self, free: int) -> float:
+        """Calls that may ring with ``free`` seats, within the abandon target."""
+        rate = self.target_abandon_rate * ABANDON_MARGIN
+        answered = self.served + self.abandoned
+        # Abandons still allowed by the calls answered so far
+        budget = max(rate * answered - self.abandoned, 0.0)
+        # n ringing calls bring n * p answers; those beyond the free seats are
+        # abandoned, and each answer raises the allowance by ``rate``.
+        # Answers vary around n * p: keep ABANDON_Z standard deviations spare
+        answer_rate = self._answer_rate_bound()
+        room = free + budget
+        room = max(room - ABANDON_Z * math.sqrt(room), 0.0)
+        # No more calls ringing than free seats can never cause an abandon
+        return max(room / (answer_rate * (1 - rate)), free)
+
+    def _answer_rate_bound(self) -> float:
+        """Answer rate the true one is unlikely to exceed."""
+        if not self._answers.measured:
+            # Nothing measured yet: any call may be answered
+            return 1.0
+        rate = self._answers.mean
+        samples = len(self._answers.samples)
+        spread = ABANDON_Z * math.sqrt(rate * (1 - rate) / samples)
+        return min(max(rate + spread, MIN_ANSWER_RATE), 1.0)
+
+    def target(self, talking: int) -> int:
+        """Calls to keep in flight while ``talking`` of them are answered."""
+        free = max(self.capacity - talking, 0)
+        # Answers needed per second: one per call ending, plus the free
+        # capacity filled within one time-to-answer
+        needed = talking / max(self._talk_time.mean, 1.0)
+        needed += free / max(self._ring_time.mean, 1.0)
+        # Little's law: dials per second times how long an attempt rings
+        dials = needed / max(self.answer_rate, MIN_ANSWER_RATE)
+        ringing = self.gain * dials * self._attempt_time.mean
+        ringing = min(ringing, self.max_ringing(free))
+        return max(1, min(talking + math.ceil(ringing), self.max_concurrency))
+
+
+@dataclass
+class CallModel:
+    """Outcome distribution of simulated dial attempts, in seconds."""
+
+    answer_rate: float = 0.25
+    ring_time: Tuple[float, float] = (4.0, 20.0)
+    no_answer_timeout: float = 30.0
+    busy_rate: float = 0.15
+    talk_time: float = 60.0  # mean of an exponential distribution
+
+
+class SimulationReport(BaseModel):
+    mode: str
+    concurrency: int
+    minutes: float
+    dialed: int = 0
+    answered: int = 0
+    completed: int = 0
+    abandoned: int = 0
+    abandon_rate: float = 0.0
+    completed_per_hour: float = 0.0
+    avg_in_flight: float = 0.0
+    max_in_flight: int = 0
+    utilization: float = 0.0  # talk time / (capacity * elapsed)
+
+
+def simulate(
+    pacing: Pacing,
+    model: CallModel,
+    minutes: float = 60.0,
+    concurrency: int = 1,
+    seed: int = 1,
+) -> SimulationReport:
+    """Dial with ``pacing`` (or fixed ``concurrency``) on a virtual clock."""
+    rng = random.Random(seed)
+    pacer = (
+        Pacer.from_settings(pacing) if pacing.mode == PacingMode.PREDICTIVE else None
+    )
+    capacity = pacing.answer_capacity or pacing.max_concurrency
+    end = minutes * 60
+    report = SimulationReport(
+        mode=pacing.mode.value, concurrency=concurrency, minutes=minutes
+    )
+    events: List[Tuple[float, int, str, float, float]] = []
+    sequence = itertools.count()
+    clock = 0.0
+    in_flight = talking = 0
+    in_flight_area = talk_area = 0.0
+
+    def dial():
+        nonlocal in_flight
+        in_flight += 1
+        report.dialed += 1
+        roll = rng.random()
+        if roll < model.answer_rate:
+            ring = rng.uniform(*model.ring_time)
+            heapq.heappush(events, (clock + ring, next(sequence), "answer", clock, 0))
+        elif roll < model.answer_rate + model.busy_rate:
+            heapq.heappush(events, (clock + 2.0, next(sequence), "end", clock, -1))
+        else:
+            timeout = model.no_answer_timeout
+            heapq.heappush(events, (clock + timeout, next(sequence), "end", clock, -1))
+
+    def fill():
+        limit = pacer.target(talking) if pacer else concurrency
+        while clock < end and in_flight < limit:
+            dial()
+
+    fill()
+    while events:
+        at, _, kind, dialed_at, answered_at = heapq.heappop(events)
+        in_flight_area += in_flight * (min(at, end) - min(clock, end))
+        talk_area += talking * (min(at, end) - min(clock, end))
+        clock = at
+        report.max_in_flight = max(report.max_in_flight, in_flight)
+        if kind == "answer":
+            report.answered += 1
+            if pacer is not None and talking >= capacity:
+                report.abandoned += 1
+                in_flight -= 1
+                pacer.answered(clock - dialed_at, abandoned=True)
+            else:
+                if pacer is not None:
+                    pacer.answered(clock - dialed_at)
+                talking += 1
+                talk = rng.expovariate(1 / model.talk_time)
+                heapq.heappush(
+                    events, (clock + talk, next(sequence), "end", dialed_at, clock)
+                )
+        else:
+            in_flight -= 1
+            answered = answered_at >= 0
+            if answered:
+                talking -= 1
+                if clock <= end:
+                    report.completed += 1
+            if pacer is not None and answered:
+                pacer.hung_up(clock - answered_at)
+            elif pacer is not None:
+                pacer.unanswered(clock - dialed_at)
+        fill()
+
+    report.abandon_rate = report.abandoned / report.answered if report.answered else 0.0
+    report.completed_per_hour = report.completed / (minutes / 60)
+    report.avg_in_flight = in_flight_area / end
+    report.utilization = talk_area / (capacity * end)
+    return report
+
+
+def _main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare fixed and predictive pacing")
+    parser.add_argument("--answer-rate", type=float, default=0.25)
+    parser.add_argument("--talk-time", type=float, default=60.0)
+    parser.add_argument("--capacity", type=int, default=30)
+    parser.add_argument("--max-concurrency", type=int, default=300)
+    parser.add_argument("--abandon-target", type=float, default=0.03)
+    parser.add_argument("--fixed", type=int, default=10, help="fixed concurrency")
+    parser.add_argument("--minutes", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    model = CallModel(answer_rate=args.answer_rate, talk_time=args.talk_time)
+    settings = dict(
+        max_concurrency=args.max_concurrency,
+        answer_capacity=args.capacity,
+        target_abandon_rate=args.abandon_target,
+    )
+    for report in (
+        simulate(Pacing(**settings), model, args.minutes, args.fixed, args.seed),
+        simulate(
+            Pacing(mode=PacingMode.PREDICTIVE, **settings),
+            model,
+            args.minutes,
+            seed=args.seed,
+        ),
+    ):
+        print(json.dumps(report.model_dump()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
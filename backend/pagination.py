@@ -0,0 +1,80 @@
+"""Keyset (cursor) pagination for list endpoints.
+
+Pages are ordered by ``(sort_field, id)`` descending and a cursor encodes the
+last pair returned, so the next page is an index range scan starting right
+after it instead of a ``skip`` over every earlier document. New documents
+sort before the first page and never shift later pages.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = None
+
+
+def encode_cursor(value: Any, doc_id: str) -> str:
+    if isinstance(value, datetime):
+        payload = {"t": "dt", "v": value.isoformat(), "id": doc_id}
+    else:
+        payload = {"v": value, "id": doc_id}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        value = payload["v"]
+        if payload.get("t") == "dt":
+            value = datetime.fromisoformat(value)
+        return value, payload["id"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_filter(query: Dict, sort_field: str, cursor: Optional[str]) -> Dict:
+    """Restrict ``query`` to documents after ``cursor`` in descending order."""
+    if not cursor:
+        return query
+    value, doc_id = decode_cursor(cursor)
+    after = {
+        "$or": [
+            {sort_field: {"$lt": value}},
+            {sort_field: value, "id": {"$lt": doc_id}},
+        ]
+    }
+    return {"$and": [query, after]} if query else after
+
+
+async def fetch_page(
+    collection,
+    query: Dict,
+    sort_field: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    projection: Optional[Dict] = None,
+) -> Tuple[List[Dict], Optional[str]]:
+    """Return one page of documents and the cursor for the next one."""
+    docs = (
+        await collection.find(keyset_filter(query, sort_field, cursor), projection)
+        .sort([(sort_field, -1), ("id", -1)])
+        .limit(limit + 1)
+        .to_list(length=limit + 1)
+    )
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor(last.get(sort_field), last["id"])
+    return docs, next_cursor
@@ -1,16 +1,29 @@
-from fastapi import APIRouter, HTTPException, Query
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import (
+    BaseModel,
+    Field,
+    field_serializer,
+    field_validator,
+    model_validator,
+)
+from typing import List, Optional, Dict
+from datetime import date, datetime, time, timezone
 from enum import Enum
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import uuid
 
+from database import get_db
+from number_lists import iter_upload_numbers, normalize_number, store_numbers
+from pagination import Page, fetch_page
+
 router = APIRouter(prefix="/platinum/campaigns", tags=["Platinum Campaigns"])
 
 
 # Enums
 class CampaignStatus(str, Enum):
     DRAFT = "draft"
+    # Started, waiting for its schedule window to open
     SCHEDULED = "scheduled"
     RUNNING = "running"
     PAUSED = "paused"
@@ -26,9 +39,84 @@ class CallStatus(str, Enum):
     NOANSWER = "noanswer"
     FAILED = "failed"
     COMPLETED = "completed"
+    # Answered while every answer slot was busy, and hung up by the dialer
+    ABANDONED = "abandoned"
+
+
+class PacingMode(str, Enum):
+    FIXED = "fixed"
+    PREDICTIVE = "predictive"
 
 
 # Models
+class Pacing(BaseModel):
+    mode: PacingMode = PacingMode.FIXED
+    # Predictive mode only (see pacing.py)
+    max_concurrency: int = Field(default=100, ge=1, le=500)
+    # Answered calls that can be handled at once (agents, IVR ports)
+    answer_capacity: Optional[int] = Field(default=None, ge=1, le=500)
+    target_abandon_rate: float = Field(default=0.03, ge=0.0, le=0.5)
+
+
+class RetryPolicy(BaseModel):
+    # Attempts per number, the first included; 1 disables retries
+    max_attempts: int = Field(default=1, ge=1, le=10)
+    # Seconds before the first retry, per final call status (see retries.py)
+    backoff: Dict[str, Optional[int]] = {"busy": 300, "noanswer": 1800, "failed": 900}
+    # Per hangup cause overrides, None for never, e.g. {"USER_BUSY": 120}.
+    # Keys are Asterisk cause names (AST_CAUSE_* without the prefix)
+    causes: Dict[str, Optional[int]] = {}
+    # Each further retry waits this many times longer
+    multiplier: float = Field(default=2.0, ge=1.0, le=10.0)
+
+
+class TimeWindow(BaseModel):
+    start: time = time(9)
+    # 00:00 is midnight at the end of the day
+    end: time = time(20)
+
+    @model_validator(mode="after")
+    def check_order(self):
+        if self.end != time(0) and self.end <= self.start:
+            raise ValueError("Window must end after it starts")
+        return self
+
+    # Stored as "HH:MM:SS" strings, BSON has no time type
+    @field_serializer("start", "end")
+    def serialize_time(self, value: time) -> str:
+        return value.isoformat()
+
+
+class Schedule(BaseModel):
+    # Local time of the called numbers (IANA name, e.g. "Europe/Istanbul")
+    timezone: str = "UTC"
+    # Days dialing is allowed, 0 = Monday
+    days: List[int] = Field(default=[0, 1, 2, 3, 4], min_length=1)
+    hours: List[TimeWindow] = Field(default=[TimeWindow()], min_length=1)
+    # Local dates without dialing, e.g. public holidays
+    blackout_dates: List[date] = []
+
+    @field_validator("timezone")
+    @classmethod
+    def check_timezone(cls, value: str) -> str:
+        try:
+            ZoneInfo(value)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown timezone: {value}")
+        return value
+
+    @field_validator("days")
+    @classmethod
+    def check_days(cls, value: List[int]) -> List[int]:
+        if any(day < 0 or day > 6 for day in value):
+            raise ValueError("Days are 0 (Monday) to 6 (Sunday)")
+        return sorted(set(value))
+
+    @field_serializer("blackout_dates")
+    def serialize_dates(self, value: List[date]) -> List[str]:
+        return [day.isoformat() for day in value]
+
+
 class Script(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
@@ -48,8 +136,9 @@ class Campaign(BaseModel):
     trunk: str
     context: str = "from-internal"
     concurrency: int = 1
-    numbers: List[str]
-    schedule: Optional[Dict[str, Any]] = None
+    pacing: Pacing = Pacing()
+    retry: RetryPolicy = RetryPolicy()
+    schedule: Optional[Schedule] = None
     status: CampaignStatus = CampaignStatus.DRAFT
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -64,6 +153,7 @@ class Campaign(BaseModel):
         "noanswer": 0,
         "failed": 0,
         "completed": 0,
+        "abandoned": 0,
     }
 
 
@@ -80,6 +170,7 @@ class CallLog(BaseModel):
     dtmf: Optional[str] = None
     audio_id: Optional[str] = None
     retry_count: int = 0
+    next_retry_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 
@@ -97,23 +188,53 @@ class CampaignCreate(BaseModel):
     script_id: str
     trunk: str
     context: str = "from-internal"
+    # Fixed mode; predictive pacing sizes itself up to pacing.max_concurrency
     concurrency: int = Field(default=1, ge=1, le=10)
-    numbers: List[str]
-    schedule: Optional[Dict[str, Any]] = None
+    pacing: Pacing = Pacing()
+    retry: RetryPolicy = RetryPolicy()
+    # Small lists can be sent inline; large ones go through POST /{id}/numbers
+    numbers: List[str] = []
+    schedule: Optional[Schedule] = None
 
 
 class CampaignUpdate(BaseModel):
     name: Optional[str] = None
-    concurrency: Optional[int] = None
-    schedule: Optional[Dict[str, Any]] = None
+    concurrency: Optional[int] = Field(default=None, ge=1, le=10)
+    pacing: Optional[Pacing] = None
+    retry: Optional[RetryPolicy] = None
+    schedule: Optional[Schedule] = None
+
+
+class NumberUploadResult(BaseModel):
+    accepted: int
+    duplicates: int
+    invalid: int
+    total: int
+
+
+class CampaignCreated(Campaign):
+    # What became of the inline numbers, as POST /{id}/numbers reports it
+    numbers: Optional[NumberUploadResult] = None
+
+
+class CampaignLiveStats(BaseModel):
+    campaign_id: str
+    status: CampaignStatus
+    stats: Dict[str, int]
+    calls_per_second: float = 0.0
+    answer_rate: float = 0.0
+
+
+# Number lists are stored outside the campaign document; never load them
+CAMPAIGN_PROJECTION = {"numbers": 0}
 
 
 # API Endpoints
 @router.post("/scripts", response_model=Script)
-async def create_script(script: ScriptCreate):
+async def create_script(
+    script: ScriptCreate, db: AsyncIOMotorDatabase = Depends(get_db)
+):
     """Create a new TTS script"""
-    from server import db
-
     script_data = script.model_dump()
     script_obj = Script(**script_data)
 
@@ -125,82 +246,136 @@ async def create_script(script: ScriptCreate):
     return script_obj
 
 
-@router.get("/scripts", response_model=List[Script])
+@router.get("/scripts", response_model=Page[Script])
 async def list_scripts(
-    limit: int = Query(default=50, le=100), skip: int = Query(default=0, ge=0)
+    limit: int = Query(default=50, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncIOMotorDatabase = Depends(get_db),
 ):
     """List all scripts"""
-    from server import db
-
-    cursor = db.platinum_scripts.find().sort("created_at", -1).skip(skip).limit(limit)
-    scripts = await cursor.to_list(length=limit)
+    scripts, next_cursor = await fetch_page(
+        db.platinum_scripts, {}, "created_at", limit, cursor
+    )
 
-    return [Script(**script) for script in scripts]
+    return Page(items=[Script(**script) for script in scripts], next_cursor=next_cursor)
 
 
 @router.get("/scripts/{script_id}", response_model=Script)
-async def get_script(script_id: str):
+async def get_script(script_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
     """Get script by ID"""
-    from server import db
+    script = await db.platinum_scripts.find_one({"id": script_id})
+
+    if not script:
+        raise HTTPException(status_code=404, detail="Script not found")
+
+    return Script(**script)
+
+
+@router.post("/scripts/{script_id}/render", response_model=Script)
+async def render_script(script_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Render script audio ahead of a campaign start"""
+    from tts import tts_renderer
+
+    if tts_renderer.synthesizer is None:
+        raise HTTPException(status_code=503, detail="No TTS synthesizer configured")
 
     script = await db.platinum_scripts.find_one({"id": script_id})
 
     if not script:
         raise HTTPException(status_code=404, detail="Script not found")
 
+    try:
+        audio_id = await tts_renderer.render(
+            script["text"], script.get("voice_id"), script.get("language", "en-US")
+        )
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Rendering failed: {e}")
+
+    if script.get("audio_id") != audio_id:
+        script["audio_id"] = audio_id
+        await db.platinum_scripts.update_one(
+            {"id": script_id}, {"$set": {"audio_id": audio_id}}
+        )
+
     return Script(**script)
 
 
-@router.post("/", response_model=Campaign)
-async def create_campaign(campaign: CampaignCreate):
-    """Create a new campaign"""
-    from server import db
+@router.get("/tts/cache")
+async def get_tts_cache_metrics():
+    """Rendered audio cache usage"""
+    from tts import tts_renderer
 
+    return tts_renderer.metrics()
+
+
+@router.post("/", response_model=CampaignCreated)
+async def create_campaign(
+    campaign: CampaignCreate, db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Create a new campaign"""
     # Validate script exists
     script = await db.platinum_scripts.find_one({"id": campaign.script_id})
     if not script:
         raise HTTPException(status_code=404, detail="Script not found")
 
-    campaign_data = campaign.model_dump()
+    campaign_data = campaign.model_dump(exclude={"numbers"})
     campaign_obj = Campaign(**campaign_data)
-    campaign_obj.stats["total"] = len(campaign.numbers)
-    campaign_obj.stats["pending"] = len(campaign.numbers)
 
     result = await db.platinum_campaigns.insert_one(campaign_obj.model_dump())
 
     if not result.inserted_id:
         raise HTTPException(status_code=500, detail="Failed to create campaign")
 
-    return campaign_obj
+    created = CampaignCreated(**campaign_obj.model_dump())
+    if campaign.numbers:
+        numbers = [normalize_number(number) for number in campaign.numbers]
+        valid = [number for number in numbers if number]
+        stored = await store_numbers(db, campaign_obj.id, valid)
+        created.stats["total"] = stored["accepted"]
+        created.stats["pending"] = stored["accepted"]
+        created.numbers = NumberUploadResult(
+            accepted=stored["accepted"],
+            duplicates=stored["duplicates"],
+            invalid=len(numbers) - len(valid),
+            total=stored["accepted"],
+        )
+
+    return created
 
 
-@router.get("/", response_model=List[Campaign])
+@router.get("/", response_model=Page[Campaign])
 async def list_campaigns(
     status: Optional[CampaignStatus] = None,
-    limit: int = Query(default=50, le=100),
-    skip: int = Query(default=0, ge=0),
+    limit: int = Query(default=50, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncIOMotorDatabase = Depends(get_db),
 ):
     """List campaigns"""
-    from server import db
-
     query = {}
     if status:
         query["status"] = status
 
-    cursor = (
-        db.platinum_campaigns.find(query).sort("created_at", -1).skip(skip).limit(limit)
+    campaigns, next_cursor = await fetch_page(
+        db.platinum_campaigns,
+        query,
+        "created_at",
+        limit,
+        cursor,
+        projection=CAMPAIGN_PROJECTION,
     )
-    campaigns = await cursor.to_list(length=limit)
 
-    return [Campaign(**campaign) for campaign in campaigns]
+    return Page(
+        items=[Campaign(**campaign) for campaign in campaigns],
+        next_cursor=next_cursor,
+    )
 
 
 @router.get("/{campaign_id}", response_model=Campaign)
-async def get_campaign(campaign_id: str):
+async def get_campaign(campaign_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
     """Get campaign by ID"""
-    from server import db
-
-    campaign = await db.platinum_campaigns.find_one({"id": campaign_id})
+    campaign = await db.platinum_campaigns.find_one(
+        {"id": campaign_id}, CAMPAIGN_PROJECTION
+    )
 
     if not campaign:
         raise HTTPException(status_code=404, detail="Campaign not found")
@@ -208,11 +383,61 @@ async def get_campaign(campaign_id: str):
     return Campaign(**campaign)
 
 
+@router.get("/{campaign_id}/stats", response_model=CampaignLiveStats)
+async def get_campaign_stats(
+    campaign_id: str, db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Get live campaign counters, calls/sec and answer rate"""
+    from campaign_stats import answer_rate, campaign_stats
+
+    campaign = await db.platinum_campaigns.find_one(
+        {"id": campaign_id},
+        {"_id": 0, "status": 1, "stats": 1, "calls_per_second": 1},
+    )
+
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+
+    stats = dict(campaign.get("stats") or {})
+    for status, delta in campaign_stats.pending_deltas(campaign_id).items():
+        stats[status] = stats.get(status, 0) + delta
+
+    return CampaignLiveStats(
+        campaign_id=campaign_id,
+        status=campaign["status"],
+        stats=stats,
+        calls_per_second=campaign.get("calls_per_second", 0.0),
+        answer_rate=answer_rate(stats),
+    )
+
+
+@router.get("/{campaign_id}/events")
+async def stream_campaign_events(
+    campaign_id: str, db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Server-Sent Events feed of call state changes and stats deltas"""
+    from event_hub import campaign_topic, event_hub, sse_response
+
+    subscription = event_hub.subscribe(campaign_topic(campaign_id))
+    campaign = await db.platinum_campaigns.find_one(
+        {"id": campaign_id},
+        {"_id": 0, "status": 1, "stats": 1, "calls_per_second": 1},
+    )
+
+    if not campaign:
+        event_hub.unsubscribe(subscription)
+        raise HTTPException(status_code=404, detail="Campaign not found")
+
+    return sse_response(event_hub, subscription, [("snapshot", campaign)])
+
+
 @router.patch("/{campaign_id}", response_model=Campaign)
-async def update_campaign(campaign_id: str, updates: CampaignUpdate):
+async def update_campaign(
+    campaign_id: str,
+    updates: CampaignUpdate,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
     """Update campaign"""
-    from server import db
-
     campaign = await db.platinum_campaigns.find_one({"id": campaign_id})
 
     if not campaign:
@@ -228,14 +453,53 @@ async def update_campaign(campaign_id: str, updates: CampaignUpdate):
 
     await db.platinum_campaigns.update_one({"id": campaign_id}, {"$set": update_data})
 
-    updated = await db.platinum_campaigns.find_one({"id": campaign_id})
+    updated = await db.platinum_campaigns.find_one(
+        {"id": campaign_id}, CAMPAIGN_PROJECTION
+    )
     return Campaign(**updated)
 
 
+@router.post("/{campaign_id}/numbers", response_model=NumberUploadResult)
+async def upload_numbers(
+    campaign_id: str,
+    file: UploadFile = File(...),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """Append numbers from a CSV or NDJSON file, streamed in batches"""
+    campaign = await db.platinum_campaigns.find_one(
+        {"id": campaign_id}, {"_id": 0, "status": 1}
+    )
+
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+
+    if campaign["status"] in [CampaignStatus.COMPLETED, CampaignStatus.STOPPED]:
+        raise HTTPException(
+            status_code=400, detail="Cannot add numbers to a finished campaign"
+        )
+
+    counts = {"invalid": 0}
+    stored = await store_numbers(db, campaign_id, iter_upload_numbers(file, counts))
+
+    updated = await db.platinum_campaigns.find_one(
+        {"id": campaign_id}, {"_id": 0, "stats.total": 1}
+    )
+    return NumberUploadResult(
+        accepted=stored["accepted"],
+        duplicates=stored["duplicates"],
+        invalid=counts["invalid"],
+        total=updated["stats"]["total"],
+    )
+
+
 @router.post("/{campaign_id}/start")
-async def start_campaign(campaign_id: str):
-    """Start campaign"""
-    from server import db
+async def start_campaign(campaign_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Start campaign, or schedule it when outside its schedule windows"""
+    from dialer import dialer_manager
+    from scheduling import campaign_scheduler, window_state
+
+    if dialer_manager.originator is None:
+        raise HTTPException(status_code=503, detail="No call originator configured")
 
     campaign = await db.platinum_campaigns.find_one({"id": campaign_id})
 
@@ -243,35 +507,58 @@ async def start_campaign(campaign_id: str):
         raise HTTPException(status_code=404, detail="Campaign not found")
 
     if campaign["status"] == CampaignStatus.RUNNING:
-        raise HTTPException(status_code=400, detail="Campaign already running")
+        # Dialed by no live worker, e.g. after a crash: pick it up here
+        if not await dialer_manager.adopt(db, campaign):
+            raise HTTPException(status_code=400, detail="Campaign already running")
+        return {"ok": True, "message": "Campaign resumed"}
 
-    await db.platinum_campaigns.update_one(
-        {"id": campaign_id},
-        {
-            "$set": {
-                "status": CampaignStatus.RUNNING,
-                "started_at": datetime.now(timezone.utc),
-                "updated_at": datetime.now(timezone.utc),
-            }
-        },
-    )
+    if campaign["status"] == CampaignStatus.SCHEDULED:
+        raise HTTPException(status_code=400, detail="Campaign already scheduled")
 
-    # TODO: Start worker process to dial numbers
+    if dialer_manager.is_running(campaign_id):
+        raise HTTPException(
+            status_code=409, detail="Campaign is still finishing in-flight calls"
+        )
 
+    now = datetime.now(timezone.utc)
+    is_open, transition = True, None
+    if campaign.get("schedule") is not None:
+        is_open, transition = window_state(Schedule(**campaign["schedule"]), now)
+        if transition is None:
+            raise HTTPException(
+                status_code=400, detail="Campaign schedule has no upcoming window"
+            )
+    status = CampaignStatus.RUNNING if is_open else CampaignStatus.SCHEDULED
+    fields = {"status": status, "started_at": now, "updated_at": now}
+    if is_open:
+        fields["worker_id"] = dialer_manager.worker_id
+
+    await db.platinum_campaigns.update_one({"id": campaign_id}, {"$set": fields})
+
+    if is_open:
+        dialer_manager.start(db, campaign_id)
+    if transition is not None:
+        campaign_scheduler.watch(campaign_id, transition)
+
+    if not is_open:
+        return {
+            "ok": True,
+            "message": f"Campaign scheduled to start at {transition.isoformat()}",
+        }
     return {"ok": True, "message": "Campaign started"}
 
 
 @router.post("/{campaign_id}/pause")
-async def pause_campaign(campaign_id: str):
+async def pause_campaign(campaign_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
     """Pause campaign"""
-    from server import db
+    from dialer import dialer_manager
 
     campaign = await db.platinum_campaigns.find_one({"id": campaign_id})
 
     if not campaign:
         raise HTTPException(status_code=404, detail="Campaign not found")
 
-    if campaign["status"] != CampaignStatus.RUNNING:
+    if campaign["status"] not in [CampaignStatus.RUNNING, CampaignStatus.SCHEDULED]:
         raise HTTPException(status_code=400, detail="Campaign not running")
 
     await db.platinum_campaigns.update_one(
@@ -284,23 +571,23 @@ async def pause_campaign(campaign_id: str):
         },
     )
 
+    dialer_manager.pause(campaign_id)
+
     return {"ok": True, "message": "Campaign paused"}
 
 
 @router.post("/{campaign_id}/stop")
-async def stop_campaign(campaign_id: str, mode: str = "graceful"):
+async def stop_campaign(
+    campaign_id: str, mode: str = "graceful", db: AsyncIOMotorDatabase = Depends(get_db)
+):
     """Stop campaign"""
-    from server import db
+    from dialer import dialer_manager
 
     campaign = await db.platinum_campaigns.find_one({"id": campaign_id})
 
     if not campaign:
         raise HTTPException(status_code=404, detail="Campaign not found")
 
-    if mode == "hard":
-        # TODO: Hangup all active calls immediately
-        pass
-
     await db.platinum_campaigns.update_one(
         {"id": campaign_id},
         {
@@ -312,26 +599,26 @@ async def stop_campaign(campaign_id: str, mode: str = "graceful"):
         },
     )
 
+    dialer_manager.stop(campaign_id, hard=mode == "hard")
+
     return {"ok": True, "message": f"Campaign stopped ({mode} mode)"}
 
 
-@router.get("/{campaign_id}/calls", response_model=List[CallLog])
+@router.get("/{campaign_id}/calls", response_model=Page[CallLog])
 async def get_campaign_calls(
     campaign_id: str,
     status: Optional[CallStatus] = None,
-    limit: int = Query(default=100, le=500),
-    skip: int = Query(default=0, ge=0),
+    limit: int = Query(default=100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: AsyncIOMotorDatabase = Depends(get_db),
 ):
     """Get call logs for campaign"""
-    from server import db
-
     query = {"campaign_id": campaign_id}
     if status:
         query["status"] = status
 
-    cursor = (
-        db.platinum_call_logs.find(query).sort("created_at", -1).skip(skip).limit(limit)
+    logs, next_cursor = await fetch_page(
+        db.platinum_call_logs, query, "created_at", limit, cursor
     )
-    logs = await cursor.to_list(length=limit)
 
-    return [CallLog(**log) for log in logs]
+    return Page(items=[CallLog(**log) for log in logs], next_cursor=next_cursor)
@@ -0,0 +1,194 @@
+"""Longest-prefix-match call rating.
+
+Each tariff's rate deck is compiled into a digit trie keyed by E.164 prefix,
+and the tariff's flat ``price_per_minute`` becomes the catch-all entry at the
+root. ``RatingTables`` (the tries plus the customer -> tariff name map) are
+built off to the side and swapped in with one reference assignment, so a
+call is rated with a few dict lookups and never sees a half-built deck.
+
+Tariff writes and changes of a customer's tariff bump a version counter in
+``rating_state``; every worker polls it and rebuilds its tables when it
+changes.
+"""
+
+import asyncio
+import logging
+import math
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+RELOAD_INTERVAL = 5.0
+VERSION_ID = "tariffs"
+
+# Digits never collide with this key, so it marks "a rate ends here"
+_RATE = ""
+
+
+@dataclass(frozen=True)
+class Rate:
+    prefix: str
+    price_per_minute: float
+    destination: Optional[str] = None
+    initial_increment: int = 60
+    increment: int = 60
+    min_duration: int = 0
+
+    def billable_seconds(self, duration: int) -> int:
+        if duration <= 0:
+            return 0
+        billed = self.initial_increment
+        if duration > billed:
+            billed += math.ceil((duration - billed) / self.increment) * self.increment
+        return max(billed, self.min_duration)
+
+    def cost(self, duration: int) -> float:
+        return round(self.billable_seconds(duration) * self.price_per_minute / 60, 6)
+
+
+def destination_digits(number: str) -> str:
+    """E.164 digits of a dialled number ("+90 532..." and "0090532..." alike)."""
+    if not number.isdigit():
+        number = "".join(c for c in number if c.isdigit())
+    return number[2:] if number.startswith("00") else number
+
+
+class PrefixTrie:
+    def __init__(self, rates: Iterable[Rate] = ()):
+        self._root: Dict = {}
+        self.size = 0
+        for rate in rates:
+            self.insert(rate)
+
+    def insert(self, rate: Rate):
+        node = self._root
+        for digit in rate.prefix:
+            node = node.setdefault(digit, {})
+        if _RATE not in node:
+            self.size += 1
+        node[_RATE] = rate
+
+    def lookup(self, digits: str) -> Optional[Rate]:
+        """The rate with the longest prefix of ``digits``."""
+        node = self._root
+        best = node.get(_RATE)
+        for digit in digits:
+            node = node.get(digit)
+            if node is None:
+                break
+            best = node.get(_RATE, best)
+        return best
+
+
+def compile_tariff(tariff: Dict) -> PrefixTrie:
+    """Build the trie for one tariff document."""
+    # Destinations without a deck entry are billed per second at the flat rate
+    trie = PrefixTrie([Rate("", tariff.get("price_per_minute", 0.0), None, 1, 1)])
+    for entry in tariff.get("rates", []):
+        prefix = destination_digits(entry["prefix"])
+        trie.insert(
+            Rate(
+                prefix=prefix,
+                price_per_minute=entry["price_per_minute"],
+                destination=entry.get("destination"),
+                initial_increment=entry.get("initial_increment", 60),
+                increment=entry.get("increment", 60),
+                min_duration=entry.get("min_duration", 0),
+            )
+        )
+    return trie
+
+
+@dataclass
+class RatingTables:
+    tariffs: Dict[str, PrefixTrie] = field(default_factory=dict)
+    customer_tariffs: Dict[str, str] = field(default_factory=dict)
+
+
+class RatingEngine:
+    def __init__(self, reload_interval: float = RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self.tables = RatingTables()
+        self.version: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def lookup(self, customer_id: str, number: str) -> Optional[Rate]:
+        tables = self.tables
+        trie = tables.tariffs.get(tables.customer_tariffs.get(customer_id, ""))
+        if trie is None:
+            return None
+        return trie.lookup(destination_digits(number))
+
+    def rate_record(self, record) -> bool:
+        """Fill ``record.cost`` (and a missing country); False if unrated."""
+        rate = self.lookup(record.customer_id, record.called_number)
+        if rate is None:
+            return False
+        record.cost = rate.cost(record.duration)
+        if not record.country and rate.destination:
+            record.country = rate.destination
+        return True
+
+    def assign_customer(self, customer_id: str, tariff: str):
+        self.tables.customer_tariffs[customer_id] = tariff
+
+    async def ensure_customers(self, db, customer_ids: Iterable[str]):
+        """Load tariff assignments for customers created by other workers."""
+        missing = set(customer_ids) - self.tables.customer_tariffs.keys()
+        if not missing:
+            return
+        async for customer in db.customers.find(
+            {"id": {"$in": list(missing)}}, {"_id": 0, "id": 1, "tariff": 1}
+        ):
+            self.assign_customer(customer["id"], customer.get("tariff", ""))
+
+    async def reload(self, db):
+        state = await db.rating_state.find_one({"id": VERSION_ID})
+        tariffs = {
+            tariff["name"]: compile_tariff(tariff)
+            async for tariff in db.tariffs.find({}, {"_id": 0})
+        }
+        customers = {
+            customer["id"]: customer.get("tariff", "")
+            async for customer in db.customers.find(
+                {}, {"_id": 0, "id": 1, "tariff": 1}
+            )
+        }
+        self.tables = RatingTables(tariffs, customers)
+        self.version = state["version"] if state else 0
+        logger.info(
+            "Loaded %d tariffs (%d rates)",
+            len(tariffs),
+            sum(trie.size for trie in tariffs.values()),
+        )
+
+    async def tariffs_changed(self, db):
+        """Publish a tariff write to every worker and rebuild locally."""
+        await db.rating_state.update_one(
+            {"id": VERSION_ID}, {"$inc": {"version": 1}}, upsert=True
+        )
+        await self.reload(db)
+
+    async def start(self, db):
+        await self.reload(db)
+        if self._task is None:
+            self._task = asyncio.create_task(self._poll_loop(db))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _poll_loop(self, db):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                state = await db.rating_state.find_one({"id": VERSION_ID})
+                if (state["version"] if state else 0) != self.version:
+                    await self.reload(db)
+            except Exception:
+                logger.exception("Reloading tariffs failed")
+
+
+rating_engine = RatingEngine()
@@ -0,0 +1,378 @@
+"""Bulk re-rating of historical call records after a tariff change.
+
+Matching records are streamed from ``call_records`` in large batches. Each
+batch's destinations are resolved to rates through the same prefix tries the
+live rating engine uses, and the billing-increment rounding and cost are then
+computed with NumPy over the whole batch. Only records whose cost actually
+changed are written back, with one unordered ``bulk_write`` per batch that
+overlaps with fetching the next one. A dry run computes the same report
+(totals per customer and sample changes) without writing.
+
+    python rerating.py --tariff "Standard Tarife" --start 2024-05-01 --end 2024-06-01
+    python rerating.py --tariff "Standard Tarife" --start 2024-05-01 --apply
+"""
+
+import asyncio
+import logging
+import sys
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from pydantic import BaseModel, Field
+from pymongo import UpdateOne
+
+from rating import PrefixTrie, Rate, RatingEngine, destination_digits
+from traffic_rollups import apply_traffic_rows
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50000
+SAMPLE_SIZE = 20
+MAX_JOBS = 20
+COST_TOLERANCE = 1e-9
+
+
+class RerateRequest(BaseModel):
+    tariff: Optional[str] = None  # every customer on this tariff
+    customer_ids: List[str] = []
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    dry_run: bool = True
+    batch_size: int = Field(default=BATCH_SIZE, ge=1000, le=200000)
+
+
+class CustomerDiff(BaseModel):
+    changed: int = 0
+    old_total: float = 0.0
+    new_total: float = 0.0
+
+
+class RerateSample(BaseModel):
+    id: str
+    customer_id: str
+    called_number: str
+    duration: int
+    old_cost: float
+    new_cost: float
+
+
+class RerateReport(BaseModel):
+    job_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    request: RerateRequest
+    running: bool = True
+    error: Optional[str] = None
+    scanned: int = 0
+    unrated: int = 0
+    changed: int = 0
+    written: int = 0
+    old_total: float = 0.0
+    new_total: float = 0.0
+    records_per_second: float = 0.0
+    customers: Dict[str, CustomerDiff] = {}
+    samples: List[RerateSample] = []
+
+
+class _RateTable:
+    """Dense parameter arrays for every rate seen so far, indexed by int."""
+
+    def __init__(self):
+        self._index: Dict[int, int] = {}
+        self._rates: List[Rate] = []
+        self._arrays: Optional[Tuple[np.ndarray, ...]] = None
+
+    def index(self, rate: Rate) -> int:
+        key = id(rate)
+        position = self._index.get(key)
+        if position is None:
+            position = self._index[key] = len(self._rates)
+            self._rates.append(rate)
+            self._arrays = None
+        return position
+
+    def arrays(self) -> Tuple[np.ndarray, ...]:
+        if self._arrays is None:
+            rates = self._rates
+            self._arrays = (
+                np.array([r.price_per_minute for r in rates], dtype=np.float64),
+                np.array([r.initial_increment for r in rates], dtype=np.int64),
+                np.array([r.increment for r in rates], dtype=np.int64),
+                np.array([r.min_duration for r in rates], dtype=np.int64),
+            )
+        return self._arrays
+
+
+def vector_cost(
+    durations: np.ndarray,
+    price: np.ndarray,
+    initial: np.ndarray,
+    increment: np.ndarray,
+    minimum: np.ndarray,
+) -> np.ndarray:
+    """``Rate.cost`` over arrays: same increments, minimum and rounding."""
+    extra = np.maximum(durations - initial, 0)
+    billed = initial + -(-extra // increment) * increment
+    billed = np.where(durations > 0, np.maximum(billed, minimum), 0)
+    costs = billed * price / 60
+    rounded = np.round(costs, 6)
+    # np.round scales by 10**6 first, which can tip a value next to a rounding
+    # tie the other way from round(); redo those few with round()
+    scaled = costs * 1e6
+    for i in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6):
+        rounded[i] = round(float(costs[i]), 6)
+    return rounded
+
+
+def rate_batch(
+    docs: List[Dict], tries: Dict[str, Optional[PrefixTrie]], table: _RateTable
+) -> Tuple[np.ndarray, np.ndarray]:
+    """New costs for ``docs`` and a mask of the ones that found a rate."""
+    positions = np.full(len(docs), -1, dtype=np.int64)
+    for i, doc in enumerate(docs):
+        trie = tries.get(doc["customer_id"])
+        if trie is None:
+            continue
+        rate = trie.lookup(destination_digits(doc.get("called_number", "")))
+        if rate is not None:
+            positions[i] = table.index(rate)
+    rated = positions >= 0
+    costs = np.zeros(len(docs), dtype=np.float64)
+    if rated.any():
+        price, initial, increment, minimum = table.arrays()
+        idx = positions[rated]
+        durations = np.array([doc.get("duration", 0) for doc in docs], dtype=np.int64)
+        durations = durations[rated]
+        costs[rated] = vector_cost(
+            durations, price[idx], initial[idx], increment[idx], minimum[idx]
+        )
+    return costs, rated
+
+
+def _accumulate(report: RerateReport, docs: List[Dict], old, new, rated, changed):
+    report.scanned += len(docs)
+    report.unrated += int((~rated).sum())
+    report.changed += int(changed.sum())
+    report.old_total += float(old[rated].sum())
+    report.new_total += float(new[rated].sum())
+    for i in np.flatnonzero(changed):
+        doc = docs[i]
+        diff = report.customers.setdefault(doc["customer_id"], CustomerDiff())
+        diff.changed += 1
+        diff.old_total += float(old[i])
+        diff.new_total += float(new[i])
+        if len(report.samples) < SAMPLE_SIZE:
+            report.samples.append(
+                RerateSample(
+                    id=doc["id"],
+                    customer_id=doc["customer_id"],
+                    called_number=doc.get("called_number", ""),
+                    duration=doc.get("duration", 0),
+                    old_cost=float(old[i]),
+                    new_cost=float(new[i]),
+                )
+            )
+
+
+def _customer_tries(
+    engine: RatingEngine, request: RerateRequest
+) -> Dict[str, Optional[PrefixTrie]]:
+    tables = engine.tables
+    customer_ids = set(request.customer_ids)
+    if request.tariff:
+        customer_ids |= {
+            customer_id
+            for customer_id, tariff in tables.customer_tariffs.items()
+            if tariff == request.tariff
+        }
+    return {
+        customer_id: tables.tariffs.get(tables.customer_tariffs.get(customer_id, ""))
+        for customer_id in customer_ids
+    }
+
+
+async def rerate(
+    db,
+    request: RerateRequest,
+    report: Optional[RerateReport] = None,
+    on_progress: Optional[Callable[[RerateReport], Awaitable[None]]] = None,
+) -> RerateReport:
+    """Re-cost every matching call record with the current tariffs."""
+    report = report or RerateReport(request=request)
+    engine = RatingEngine()
+    # A fresh load, so tariffs edited moments ago in another worker are used
+    await engine.reload(db)
+    tries = _customer_tries(engine, request)
+    if not tries:
+        report.running = False
+        return report
+
+    query: Dict = {"customer_id": {"$in": list(tries)}}
+    if request.start or request.end:
+        query["call_date"] = {}
+        if request.start:
+            query["call_date"]["$gte"] = request.start
+        if request.end:
+            query["call_date"]["$lt"] = request.end
+    cursor = db.call_records.find(
+        query,
+        {
+            "_id": 1,
+            "id": 1,
+            "customer_id": 1,
+            "called_number": 1,
+            "duration": 1,
+            "cost": 1,
+            "call_date": 1,
+            "country": 1,
+            "codec": 1,
+        },
+        batch_size=request.batch_size,
+    )
+
+    table = _RateTable()
+    pending: Optional[asyncio.Task] = None
+    started = time.monotonic()
+    try:
+        while True:
+            docs = await cursor.to_list(length=request.batch_size)
+            if not docs:
+                break
+            old = np.array([doc.get("cost") or 0.0 for doc in docs], dtype=np.float64)
+            new, rated = rate_batch(docs, tries, table)
+            changed = rated & (np.abs(new - old) > COST_TOLERANCE)
+            _accumulate(report, docs, old, new, rated, changed)
+
+            if not request.dry_run and changed.any():
+                positions = np.flatnonzero(changed)
+                ops = [
+                    UpdateOne(
+                        {"_id": docs[i]["_id"]}, {"$set": {"cost": float(new[i])}}
+                    )
+                    for i in positions
+                ]
+                # Cost-only deltas keep the traffic rollups in step
+                deltas = [
+                    (
+                        docs[i]["call_date"],
+                        docs[i]["customer_id"],
+                        docs[i].get("country"),
+                        docs[i].get("codec"),
+                        0,
+                        0,
+                        float(new[i] - old[i]),
+                        0,
+                    )
+                    for i in positions
+                ]
+                if pending is not None:
+                    report.written += await pending
+                pending = asyncio.create_task(_write(db, ops, deltas))
+
+            report.records_per_second = report.scanned / max(
+                time.monotonic() - started, 1e-6
+            )
+            if on_progress is not None:
+                await on_progress(report)
+        if pending is not None:
+            report.written += await pending
+            pending = None
+    finally:
+        if pending is not None:
+            pending.cancel()
+        report.running = False
+    return report
+
+
+async def _write(db, ops: List[UpdateOne], deltas: List) -> int:
+    result = await db.call_records.bulk_write(ops, ordered=False)
+    await apply_traffic_rows(db, deltas)
+    return result.modified_count
+
+
+_jobs: "OrderedDict[str, RerateReport]" = OrderedDict()
+_tasks: Set[asyncio.Task] = set()
+
+
+async def _run_job(db, report: RerateReport):
+    try:
+        await rerate(db, report.request, report)
+    except Exception as e:
+        logger.exception("Re-rating job %s failed", report.job_id)
+        report.error = str(e)
+        report.running = False
+
+
+def start_rerate(db, request: RerateRequest) -> RerateReport:
+    """Run a re-rating job in the background; poll it with ``get_job``."""
+    report = RerateReport(request=request)
+    _jobs[report.job_id] = report
+    while len(_jobs) > MAX_JOBS:
+        _jobs.popitem(last=False)
+    task = asyncio.create_task(_run_job(db, report))
+    # Keep a reference so the job is not garbage-collected mid-run
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return report
+
+
+def get_job(job_id: str) -> Optional[RerateReport]:
+    return _jobs.get(job_id)
+
+
+async def cancel_jobs():
+    """Cancel running jobs, e.g. at shutdown."""
+    for task in list(_tasks):
+        task.cancel()
+    if _tasks:
+        await asyncio.wait(list(_tasks))
+
+
+async def _main(argv: List[str]) -> int:
+    import argparse
+    from pathlib import Path
+
+    import database
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Re-rate call records")
+    parser.add_argument("--tariff")
+    parser.add_argument("--customer", action="append", default=[])
+    parser.add_argument("--start", type=datetime.fromisoformat)
+    parser.add_argument("--end", type=datetime.fromisoformat)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--apply", action="store_true", help="write new costs")
+    args = parser.parse_args(argv)
+    if not args.tariff and not args.customer:
+        parser.error("pass --tariff and/or --customer")
+
+    request = RerateRequest(
+        tariff=args.tariff,
+        customer_ids=args.customer,
+        start=args.start,
+        end=args.end,
+        dry_run=not args.apply,
+        batch_size=args.batch_size,
+    )
+
+    async def progress(report: RerateReport):
+        print(
+            f"scanned {report.scanned:,}  changed {report.changed:,}  "
+            f"{report.records_per_second:,.0f} records/s",
+            file=sys.stderr,
+        )
+
+    load_dotenv(Path(__file__).parent / ".env")
+    db = database.connect()
+    try:
+        report = await rerate(db, request, on_progress=progress)
+    finally:
+        database.close()
+    print(report.model_dump_json(indent=2, exclude={"request"}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,131 @@
+"""Bounded in-memory caches for the chatbot.
+
+``TTLCache`` is an LRU map whose entries also expire ``ttl`` seconds after
+they were stored. It is bounded by entry count and, with ``max_size``, by the
+summed ``sizeof`` of its values; the least recently used entries are evicted
+first. Every operation is O(1) and it counts hits, misses, evictions and
+expirations.
+
+``normalize_question`` maps the ways one question gets typed (case, Turkish
+letters typed without their marks, punctuation, spacing) to one cache key.
+"""
+
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+from pydantic import BaseModel
+
+V = TypeVar("V")
+
+# Letters NFKD does not decompose
+_FOLD = str.maketrans({"ı": "i", "ø": "o", "ß": "ss"})
+
+
+def normalize_question(text: str) -> str:
+    """``"0850 Numara nedir?"`` and ``"0850 numara NEDİR"`` share a key."""
+    text = unicodedata.normalize("NFKD", text.casefold()).translate(_FOLD)
+    kept = []
+    for char in text:
+        if unicodedata.combining(char):
+            continue
+        kept.append(char if char.isalnum() else " ")
+    return " ".join("".join(kept).split())
+
+
+class CacheMetrics(BaseModel):
+    entries: int
+    size: int
+    hits: int
+    misses: int
+    hit_rate: float
+    evictions: int
+    expirations: int
+
+
+class TTLCache(Generic[V]):
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        max_size: Optional[int] = None,
+        sizeof: Callable[[Any], int] = len,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.clock = clock
+        # key -> (expires_at, size, value), least recently used first
+        self._entries: "OrderedDict[Hashable, Tuple[float, int, V]]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > self.clock()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, _, value = entry
+        if expires_at <= self.clock():
+            self._drop(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: V):
+        size = self.sizeof(value) if self.max_size is not None else 0
+        if self.max_size is not None and size > self.max_size:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (self.clock() + self.ttl, size, value)
+        self.size += size
+        while len(self._entries) > self.max_entries or (
+            self.max_size is not None and self.size > self.max_size
+        ):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._drop(key)
+        return entry[2]
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def _drop(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+    def metrics(self) -> CacheMetrics:
+        lookups = self.hits + self.misses
+        return CacheMetrics(
+            entries=len(self._entries),
+            size=self.size,
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / lookups if lookups else 0.0,
+            evictions=self.evictions,
+            expirations=self.expirations,
+        )
@@ -0,0 +1,118 @@
+"""Retry scheduling for unanswered campaign calls.
+
+When a call ends BUSY, NOANSWER or FAILED, ``retry_delay`` applies the
+campaign's ``RetryPolicy``: a per-status backoff, overridable per hangup
+cause, growing by ``multiplier`` with every attempt, up to ``max_attempts``.
+Causes that mean the number cannot be reached (``NO_RETRY_CAUSES``) are not
+retried unless the policy names them. Causes are Asterisk cause names, the
+``AST_CAUSE_*`` constants without the prefix (``USER_BUSY``, ``UNALLOCATED``),
+to which ``ami_client`` maps Q.850 codes and OriginateResponse reasons. The call log keeps its final status
+and gets ``next_retry_at``.
+
+Each dialer holds its campaign's scheduled retries in a ``RetryScheduler``,
+a min-heap on due time, and moves due ones into its work queue with O(log n)
+pops, so nothing polls ``platinum_call_logs`` for them. The heap is rebuilt
+with one indexed query (on ``next_retry_at``) when the dialer starts.
+"""
+
+import heapq
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from platinum_campaigns import CallStatus, RetryPolicy
+
+RETRYABLE_STATUSES = {CallStatus.BUSY, CallStatus.NOANSWER, CallStatus.FAILED}
+
+# Hangup causes of numbers that will not answer later
+NO_RETRY_CAUSES = {
+    "UNALLOCATED",
+    "NO_ROUTE_DESTINATION",
+    "NUMBER_CHANGED",
+    "INVALID_NUMBER_FORMAT",
+    "CALL_REJECTED",
+}
+
+
+def retry_delay(
+    policy: RetryPolicy, status: CallStatus, cause: Optional[str], retry_count: int
+) -> Optional[timedelta]:
+    """How long until the next attempt, or None if the call is not retried."""
+    if status not in RETRYABLE_STATUSES or retry_count + 1 >= policy.max_attempts:
+        return None
+    if cause in policy.causes:
+        seconds = policy.causes[cause]
+    elif cause in NO_RETRY_CAUSES:
+        return None
+    else:
+        seconds = policy.backoff.get(CallStatus(status).value)
+    if seconds is None:
+        return None
+    return timedelta(seconds=seconds * policy.multiplier**retry_count)
+
+
+# (due, call_id, number, retry_count, status)
+_Entry = Tuple[datetime, str, str, int, str]
+
+
+class RetryScheduler:
+    """Scheduled retries of one campaign, earliest first."""
+
+    def __init__(self):
+        self._heap: List[_Entry] = []
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule(
+        self, call_id: str, number: str, due: datetime, retry_count: int, status: str
+    ):
+        heapq.heappush(self._heap, (due, call_id, number, retry_count, status))
+
+    def next_due(self) -> Optional[datetime]:
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime, limit: int) -> List[Dict]:
+        """Up to ``limit`` due retries as dialer work items."""
+        due = []
+        while self._heap and len(due) < limit and self._heap[0][0] <= now:
+            _, call_id, number, retry_count, status = heapq.heappop(self._heap)
+            due.append(
+                {
+                    "id": call_id,
+                    "number": number,
+                    "retry_count": retry_count,
+                    "status": status,
+                }
+            )
+        return due
+
+    async def load(self, db, campaign_id: str) -> int:
+        """Rebuild from the call logs, e.g. when a dialer (re)starts."""
+        entries = [
+            (
+                _utc(log["next_retry_at"]),
+                log["id"],
+                log["number"],
+                log.get("retry_count", 0),
+                log["status"],
+            )
+            async for log in db.platinum_call_logs.find(
+                {"campaign_id": campaign_id, "next_retry_at": {"$type": "date"}},
+                {
+                    "_id": 0,
+                    "id": 1,
+                    "number": 1,
+                    "retry_count": 1,
+                    "status": 1,
+                    "next_retry_at": 1,
+                },
+            )
+        ]
+        heapq.heapify(entries)
+        self._heap = entries
+        return len(entries)
+
+
+def _utc(value: datetime) -> datetime:
+    # Mongo returns naive UTC datetimes
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
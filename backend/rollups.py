@@ -0,0 +1,306 @@
+"""User -> customer -> dealer call totals.
+
+``apply_rollups`` is the single write path for every new call record, single
+or batched: the batch's minutes and calls are folded per user, customer and
+dealer in memory and written with one unordered ``bulk_write`` per level,
+together with the dashboard counters and traffic rollups.
+
+``reconcile`` recomputes the totals from ``call_records`` with one
+aggregation per dealer, run in parallel, and repairs any drift with ``$inc``
+of the difference so increments landing meanwhile are kept. Drift is only
+repaired once a second pass confirms it unchanged, so records inserted
+between reading the counters and aggregating are not mistaken for drift.
+
+    python rollups.py [--apply] [--dealer ID]
+"""
+
+import asyncio
+import logging
+import sys
+import uuid
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from pydantic import BaseModel, Field
+from pymongo import UpdateOne
+
+from crm_stats import increment_statistics
+from traffic_rollups import apply_traffic_rollups
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_CONCURRENCY = 8
+CONFIRM_DELAY = 2.0
+MINUTES_TOLERANCE = 1e-6
+SAMPLE_SIZE = 50
+MAX_JOBS = 20
+
+# (total_minutes, total_calls) per entity
+Totals = Dict[str, List[float]]
+
+
+def _fold(records: List, key: str) -> Totals:
+    totals: Totals = defaultdict(lambda: [0.0, 0])
+    for record in records:
+        entity_id = getattr(record, key, None)
+        if entity_id:
+            sums = totals[entity_id]
+            sums[0] += record.duration / 60
+            sums[1] += 1
+    return totals
+
+
+def _increments(totals: Totals) -> List[UpdateOne]:
+    return [
+        UpdateOne(
+            {"id": entity_id},
+            {"$inc": {"total_minutes": minutes, "total_calls": calls}},
+        )
+        for entity_id, (minutes, calls) in totals.items()
+        if minutes or calls
+    ]
+
+
+async def apply_rollups(db, records: List):
+    """Apply user, customer, dealer, dashboard and traffic rollups."""
+    customers = _fold(records, "customer_id")
+    if not customers:
+        return
+    users = _fold(records, "user_id")
+
+    owners = await db.customers.find(
+        {"id": {"$in": list(customers)}}, {"_id": 0, "id": 1, "dealer_id": 1}
+    ).to_list(length=None)
+    dealer_of = {owner["id"]: owner["dealer_id"] for owner in owners}
+    dealers: Totals = defaultdict(lambda: [0.0, 0])
+    for customer_id, dealer_id in dealer_of.items():
+        minutes, calls = customers[customer_id]
+        dealers[dealer_id][0] += minutes
+        dealers[dealer_id][1] += calls
+
+    writes = []
+    for collection, totals in (
+        ("users", users),
+        ("customers", customers),
+        ("dealers", dealers),
+    ):
+        ops = _increments(totals)
+        if ops:
+            writes.append(db[collection].bulk_write(ops, ordered=False))
+    await asyncio.gather(
+        *writes,
+        increment_statistics(
+            db,
+            total_calls=len(records),
+            total_duration=sum(record.duration for record in records),
+        ),
+        apply_traffic_rollups(db, records, dealer_of),
+    )
+
+
+class Drift(BaseModel):
+    collection: str
+    id: str
+    field: str
+    stored: float
+    actual: float
+
+
+class ReconcileReport(BaseModel):
+    job_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    apply: bool = False
+    running: bool = True
+    error: Optional[str] = None
+    dealers_checked: int = 0
+    drifted: Dict[str, int] = {}
+    repaired: Dict[str, int] = {}
+    samples: List[Drift] = []
+
+
+# (collection, id) -> (minutes delta, calls delta, stored document)
+DriftMap = Dict[Tuple[str, str], Tuple[float, int, Dict]]
+
+
+async def _dealer_drift(db, dealer_id: str) -> DriftMap:
+    """Differences between stored and recomputed totals in one dealer's tree."""
+    customers = await db.customers.find(
+        {"dealer_id": dealer_id},
+        {"_id": 0, "id": 1, "total_minutes": 1, "total_calls": 1},
+    ).to_list(length=None)
+    customer_ids = [customer["id"] for customer in customers]
+    users = await db.users.find(
+        {"customer_id": {"$in": customer_ids}},
+        {"_id": 0, "id": 1, "total_minutes": 1, "total_calls": 1},
+    ).to_list(length=None)
+    dealer = await db.dealers.find_one(
+        {"id": dealer_id},
+        {"_id": 0, "id": 1, "total_minutes": 1, "total_calls": 1},
+    )
+
+    actual: Totals = defaultdict(lambda: [0.0, 0])
+    async for group in db.call_records.aggregate(
+        [
+            {"$match": {"customer_id": {"$in": customer_ids}}},
+            {
+                "$group": {
+                    "_id": {"customer": "$customer_id", "user": "$user_id"},
+                    "seconds": {"$sum": "$duration"},
+                    "calls": {"$sum": 1},
+                }
+            },
+        ]
+    ):
+        minutes, calls = group["seconds"] / 60, group["calls"]
+        for key in (
+            ("customers", group["_id"]["customer"]),
+            ("users", group["_id"].get("user")),
+            ("dealers", dealer_id),
+        ):
+            if key[1]:
+                actual[key][0] += minutes
+                actual[key][1] += calls
+
+    drift: DriftMap = {}
+    stored_docs = [("customers", doc) for doc in customers]
+    stored_docs += [("users", doc) for doc in users]
+    if dealer:
+        stored_docs.append(("dealers", dealer))
+    for collection, doc in stored_docs:
+        minutes, calls = actual.get((collection, doc["id"]), (0.0, 0))
+        minutes_delta = minutes - doc.get("total_minutes", 0)
+        calls_delta = calls - doc.get("total_calls", 0)
+        if abs(minutes_delta) > MINUTES_TOLERANCE or calls_delta:
+            drift[(collection, doc["id"])] = (minutes_delta, calls_delta, doc)
+    return drift
+
+
+def _same_delta(a: Tuple, b: Tuple) -> bool:
+    return abs(a[0] - b[0]) <= MINUTES_TOLERANCE and a[1] == b[1]
+
+
+async def reconcile_dealer(db, dealer_id: str, report: ReconcileReport):
+    drift = await _dealer_drift(db, dealer_id)
+    if drift:
+        await asyncio.sleep(CONFIRM_DELAY)
+        confirmed = await _dealer_drift(db, dealer_id)
+        drift = {
+            key: delta
+            for key, delta in drift.items()
+            if key in confirmed and _same_delta(confirmed[key], delta)
+        }
+    report.dealers_checked += 1
+
+    repairs: Dict[str, List[UpdateOne]] = defaultdict(list)
+    for (collection, entity_id), (minutes, calls, doc) in drift.items():
+        report.drifted[collection] = report.drifted.get(collection, 0) + 1
+        if len(report.samples) < SAMPLE_SIZE:
+            if calls:
+                stored = doc.get("total_calls", 0)
+                field, actual = "total_calls", stored + calls
+            else:
+                stored = doc.get("total_minutes", 0)
+                field, actual = "total_minutes", stored + minutes
+            report.samples.append(
+                Drift(
+                    collection=collection,
+                    id=entity_id,
+                    field=field,
+                    stored=stored,
+                    actual=actual,
+                )
+            )
+        repairs[collection].append(
+            UpdateOne(
+                {"id": entity_id},
+                {"$inc": {"total_minutes": minutes, "total_calls": calls}},
+            )
+        )
+    if report.apply:
+        for collection, ops in repairs.items():
+            await db[collection].bulk_write(ops, ordered=False)
+            report.repaired[collection] = report.repaired.get(collection, 0) + len(ops)
+
+
+async def reconcile(
+    db,
+    report: Optional[ReconcileReport] = None,
+    dealer_ids: Optional[List[str]] = None,
+    concurrency: int = RECONCILE_CONCURRENCY,
+) -> ReconcileReport:
+    """Check (and with ``report.apply``, repair) every dealer's tree."""
+    report = report or ReconcileReport()
+    if dealer_ids is None:
+        dealer_ids = await db.dealers.distinct("id")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(dealer_id: str):
+        async with semaphore:
+            await reconcile_dealer(db, dealer_id, report)
+
+    try:
+        await asyncio.gather(*(run(dealer_id) for dealer_id in dealer_ids))
+    finally:
+        report.running = False
+    return report
+
+
+_jobs: "OrderedDict[str, ReconcileReport]" = OrderedDict()
+_tasks: Set[asyncio.Task] = set()
+
+
+async def _run_job(db, report: ReconcileReport):
+    try:
+        await reconcile(db, report)
+    except Exception as e:
+        logger.exception("Rollup reconciliation %s failed", report.job_id)
+        report.error = str(e)
+
+
+def start_reconcile(db, apply: bool) -> ReconcileReport:
+    report = ReconcileReport(apply=apply)
+    _jobs[report.job_id] = report
+    while len(_jobs) > MAX_JOBS:
+        _jobs.popitem(last=False)
+    task = asyncio.create_task(_run_job(db, report))
+    # Keep a reference so the job is not garbage-collected mid-run
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return report
+
+
+def get_reconcile_job(job_id: str) -> Optional[ReconcileReport]:
+    return _jobs.get(job_id)
+
+
+async def cancel_jobs():
+    """Cancel running jobs, e.g. at shutdown."""
+    for task in list(_tasks):
+        task.cancel()
+    if _tasks:
+        await asyncio.wait(list(_tasks))
+
+
+async def _main(argv: List[str]) -> int:
+    import argparse
+    from pathlib import Path
+
+    import database
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Reconcile dealer call totals")
+    parser.add_argument("--apply", action="store_true", help="repair drift")
+    parser.add_argument("--dealer", action="append", default=None)
+    args = parser.parse_args(argv)
+
+    load_dotenv(Path(__file__).parent / ".env")
+    db = database.connect()
+    try:
+        report = await reconcile(db, ReconcileReport(apply=args.apply), args.dealer)
+    finally:
+        database.close()
+    print(report.model_dump_json(indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
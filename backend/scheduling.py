@@ -0,0 +1,228 @@
+"""Schedule windows of Platinum campaigns.
+
+A campaign with a ``Schedule`` only dials inside its windows: on the allowed
+days, within the allowed hours, in the schedule's timezone and never on a
+blackout date. Started outside a window it waits as ``SCHEDULED``.
+
+One ``CampaignScheduler`` drives every scheduled campaign of the process. It
+keeps the next window boundary of each in a min-heap and sleeps until the
+earliest one, so a boundary costs one campaign read whatever the number of
+campaigns; at the boundary the campaign is moved between ``SCHEDULED`` and
+``RUNNING`` and its dialer started or paused. Status changes are conditional
+on the status read, so the schedulers of several workers can run side by
+side; each rescans the scheduled campaigns every ``RESYNC_INTERVAL`` to pick
+up ones started through another worker.
+"""
+
+import asyncio
+import heapq
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from dialer import DialerManager, dialer_manager
+from event_hub import campaign_topic, event_hub
+from platinum_campaigns import CampaignStatus, Schedule
+
+logger = logging.getLogger(__name__)
+
+RESYNC_INTERVAL = 60.0
+# Wait for a dialer still finishing the calls of the previous window
+RETRY_DELAY = 5.0
+# How far ahead to look for the next window (blackouts can span months)
+HORIZON_DAYS = 400
+
+
+def _day_windows(
+    schedule: Schedule, zone: ZoneInfo, day: date
+) -> List[Tuple[datetime, datetime]]:
+    if day.weekday() not in schedule.days or day in schedule.blackout_dates:
+        return []
+    windows = []
+    for hours in schedule.hours:
+        end_day = day + timedelta(days=1) if hours.end == time(0) else day
+        windows.append(
+            (
+                datetime.combine(day, hours.start, zone).astimezone(timezone.utc),
+                datetime.combine(end_day, hours.end, zone).astimezone(timezone.utc),
+            )
+        )
+    return sorted(windows)
+
+
+def _open_windows(
+    schedule: Schedule, now: datetime
+) -> Iterator[Tuple[datetime, datetime]]:
+    """Windows from the day before ``now`` on, overlapping ones merged."""
+    zone = ZoneInfo(schedule.timezone)
+    first = now.astimezone(zone).date() - timedelta(days=1)
+    current: Optional[List[datetime]] = None
+    for offset in range(HORIZON_DAYS):
+        for start, end in _day_windows(schedule, zone, first + timedelta(offset)):
+            if current is not None and start <= current[1]:
+                current[1] = max(current[1], end)
+                continue
+            if current is not None:
+                yield current[0], current[1]
+            current = [start, end]
+    if current is not None:
+        yield current[0], current[1]
+
+
+def window_state(schedule: Schedule, now: datetime) -> Tuple[bool, Optional[datetime]]:
+    """Whether ``now`` is inside a window, and when that next changes.
+
+    The change is None when no window opens within ``HORIZON_DAYS``.
+    """
+    for start, end in _open_windows(schedule, now):
+        if end <= now:
+            continue
+        if start <= now:
+            return True, end
+        return False, start
+    return False, None
+
+
+class CampaignScheduler:
+    def __init__(self, manager: DialerManager = dialer_manager):
+        self.manager = manager
+        self._heap: List[Tuple[datetime, str]] = []
+        # Latest boundary per campaign; older heap entries are skipped
+        self._due: Dict[str, datetime] = {}
+        self._db = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def next_transition(self, campaign_id: str) -> Optional[datetime]:
+        return self._due.get(campaign_id)
+
+    def watch(self, campaign_id: str, at: datetime):
+        """Check ``campaign_id`` against its schedule again at ``at``."""
+        self._due[campaign_id] = at
+        heapq.heappush(self._heap, (at, campaign_id))
+        self._wakeup.set()
+
+    def forget(self, campaign_id: str):
+        self._due.pop(campaign_id, None)
+
+    async def _set_status(
+        self, campaign_id: str, current: CampaignStatus, status: CampaignStatus
+    ) -> bool:
+        now = datetime.now(timezone.utc)
+        fields = {"status": status, "updated_at": now}
+        if status == CampaignStatus.COMPLETED:
+            fields["completed_at"] = now
+        elif status == CampaignStatus.RUNNING:
+            fields["worker_id"] = self.manager.worker_id
+        result = await self._db.platinum_campaigns.update_one(
+            {"id": campaign_id, "status": current}, {"$set": fields}
+        )
+        if not result.modified_count:
+            return False
+        event_hub.publish(campaign_topic(campaign_id), "status", {"status": status})
+        return True
+
+    async def apply(self, campaign: Dict, now: datetime):
+        """Start or pause ``campaign`` to match its schedule at ``now``."""
+        campaign_id = campaign["id"]
+        status = campaign["status"]
+        if campaign.get("schedule") is None or status not in (
+            CampaignStatus.SCHEDULED,
+            CampaignStatus.RUNNING,
+        ):
+            self.forget(campaign_id)
+            return
+        is_open, at = window_state(Schedule(**campaign["schedule"]), now)
+        if is_open and status == CampaignStatus.SCHEDULED:
+            if self.manager.is_running(campaign_id) or self.manager.originator is None:
+                at = now + timedelta(seconds=RETRY_DELAY)
+            elif await self._set_status(
+                campaign_id, CampaignStatus.SCHEDULED, CampaignStatus.RUNNING
+            ):
+                self.manager.start(self._db, campaign_id)
+        elif not is_open and status == CampaignStatus.RUNNING:
+            if await self._set_status(
+                campaign_id, CampaignStatus.RUNNING, CampaignStatus.SCHEDULED
+            ):
+                self.manager.pause(campaign_id)
+        if at is None:
+            # No window left to dial in
+            await self._set_status(
+                campaign_id, CampaignStatus.SCHEDULED, CampaignStatus.COMPLETED
+            )
+            self.forget(campaign_id)
+        else:
+            self.watch(campaign_id, at)
+
+    async def load(self, db) -> int:
+        """Watch every scheduled campaign not watched yet."""
+        self._db = db
+        now = datetime.now(timezone.utc)
+        count = 0
+        async for campaign in db.platinum_campaigns.find(
+            {
+                "status": {"$in": [CampaignStatus.SCHEDULED, CampaignStatus.RUNNING]},
+                "schedule": {"$ne": None},
+            },
+            {"_id": 0, "id": 1, "status": 1, "schedule": 1},
+        ):
+            if campaign["id"] not in self._due:
+                await self.apply(campaign, now)
+                count += 1
+        return count
+
+    async def run_due(self):
+        """Handle every boundary that has passed."""
+        now = datetime.now(timezone.utc)
+        while self._heap and self._heap[0][0] <= now:
+            at, campaign_id = heapq.heappop(self._heap)
+            if self._due.get(campaign_id) != at:
+                continue
+            del self._due[campaign_id]
+            try:
+                campaign = await self._db.platinum_campaigns.find_one(
+                    {"id": campaign_id}, {"_id": 0, "id": 1, "status": 1, "schedule": 1}
+                )
+                if campaign:
+                    await self.apply(campaign, now)
+            except Exception:
+                logger.exception("Scheduling campaign %s failed", campaign_id)
+                self.watch(campaign_id, now + timedelta(seconds=RETRY_DELAY))
+
+    async def start(self, db):
+        await self.load(db)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        resync_at = loop.time() + RESYNC_INTERVAL
+        while True:
+            timeout = resync_at - loop.time()
+            if self._heap:
+                until = self._heap[0][0] - datetime.now(timezone.utc)
+                timeout = min(timeout, until.total_seconds())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.run_due()
+            if loop.time() >= resync_at:
+                resync_at = loop.time() + RESYNC_INTERVAL
+                try:
+                    await self.load(self._db)
+                except Exception:
+                    logger.exception("Loading scheduled campaigns failed")
+
+
+campaign_scheduler = CampaignScheduler()
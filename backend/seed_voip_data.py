@@ -23,6 +23,8 @@ async def seed_data():
     await db.call_records.delete_many({})
     await db.active_calls.delete_many({})
     await db.tariffs.delete_many({})
+    # Rebuilt from the seeded collections on the next /statistics read
+    await db.crm_statistics.delete_many({})
     
     # Create Tariffs
     tariffs = [
@@ -1,7 +1,8 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Depends
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from contextlib import asynccontextmanager
 import os
 import logging
 from pathlib import Path
@@ -9,21 +10,65 @@ from pydantic import BaseModel, Field, ConfigDict
 from typing import List
 import uuid
 from datetime import datetime, timezone
-from chatbot import router as chatbot_router
+
+ROOT_DIR = Path(__file__).parent
+# Before the imports below, whose module-level singletons read the environment
+load_dotenv(ROOT_DIR / '.env')
+
+import database
+from database import get_db
+from admission import admission_controller
+from call_registry import call_registry
+from campaign_stats import campaign_stats
+from dialer import dialer_manager
+from rating import rating_engine
+from rerating import cancel_jobs as cancel_rerating_jobs
+from rollups import cancel_jobs as cancel_rollup_jobs
+from scheduling import campaign_scheduler
+from tts import tts_renderer
+from indexes import ensure_indexes, verify_query_plans
+from chatbot import router as chatbot_router, drain_writes as drain_chat_writes
 from voip_crm import router as voip_crm_router
 from platinum_campaigns import router as platinum_router
 
 
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One MongoDB client (and connection pool) for the whole process
+    db = database.connect()
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+    await ensure_indexes(db)
+    if os.environ.get('VERIFY_QUERY_PLANS'):
+        failures = await verify_query_plans(db)
+        if failures:
+            raise RuntimeError(f"Queries without an index: {failures}")
+
+    campaign_stats.start(db)
+    await rating_engine.start(db)
+    await admission_controller.start(db)
+    # Follow the AMI event stream when the dialer talks to Asterisk
+    await call_registry.start(db, getattr(dialer_manager.originator, 'pool', None))
+    await tts_renderer.start(db)
+    # Campaigns left RUNNING by a previous run or a worker that died
+    await dialer_manager.resume(db)
+    await campaign_scheduler.start(db)
+    try:
+        yield
+    finally:
+        await campaign_scheduler.stop()
+        await dialer_manager.shutdown()
+        tts_renderer.close()
+        await admission_controller.stop()
+        await campaign_stats.stop()
+        await rating_engine.stop()
+        await cancel_rerating_jobs()
+        await cancel_rollup_jobs()
+        await call_registry.stop(db)
+        await drain_chat_writes()
+        database.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -46,7 +91,7 @@ async def root():
     return {"message": "Hello World"}
 
 @api_router.post("/status", response_model=StatusCheck)
-async def create_status_check(input: StatusCheckCreate):
+async def create_status_check(input: StatusCheckCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
     status_dict = input.model_dump()
     status_obj = StatusCheck(**status_dict)
     
@@ -58,7 +103,7 @@ async def create_status_check(input: StatusCheckCreate):
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
+async def get_status_checks(db: AsyncIOMotorDatabase = Depends(get_db)):
     # Exclude MongoDB's _id field from the query results
     status_checks = await db.status_checks.find({}, {"_id": 0}).to_list(1000)
     
@@ -89,7 +134,3 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""Hourly and daily traffic rollups for analytics.
+
+Every ingested call record is folded into one document per
+(bucket, customer, dealer, country, codec) in ``traffic_hourly`` and
+``traffic_daily`` holding calls, seconds, cost and answered counts. A batch of
+records becomes one unordered ``bulk_write`` of ``$inc`` upserts per
+collection, and reports aggregate those small collections instead of raw
+``call_records``. Buckets are UTC.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+from pymongo import UpdateOne
+
+COLLECTIONS = {"hour": "traffic_hourly", "day": "traffic_daily"}
+GROUP_FIELDS = ("customer_id", "dealer_id", "country", "codec")
+COUNTERS = ("calls", "seconds", "cost", "answered")
+
+# (call_date, customer_id, country, codec, calls, seconds, cost, answered)
+TrafficRow = Tuple[datetime, str, str, Optional[str], int, int, float, int]
+
+
+class TrafficPoint(BaseModel):
+    bucket: Optional[datetime] = None
+    key: Optional[str] = None
+    calls: int = 0
+    seconds: int = 0
+    cost: float = 0.0
+    answered: int = 0
+    asr: float = 0.0  # answer-seizure ratio, answered / calls
+    acd: float = 0.0  # average call duration of answered calls, seconds
+
+
+def _utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def bucket_start(value: datetime, granularity: str) -> datetime:
+    value = _utc(value).replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0) if granularity == "day" else value
+
+
+def record_rows(records: Iterable) -> List[TrafficRow]:
+    return [
+        (
+            record.call_date,
+            record.customer_id,
+            record.country,
+            record.codec,
+            1,
+            record.duration,
+            record.cost,
+            1 if record.duration > 0 else 0,
+        )
+        for record in records
+    ]
+
+
+async def _dealers_for(db, customer_ids: Iterable[str]) -> Dict[str, str]:
+    owners = await db.customers.find(
+        {"id": {"$in": list(set(customer_ids))}}, {"_id": 0, "id": 1, "dealer_id": 1}
+    ).to_list(length=None)
+    return {owner["id"]: owner.get("dealer_id") for owner in owners}
+
+
+async def apply_traffic_rows(
+    db, rows: List[TrafficRow], dealers: Optional[Dict[str, str]] = None
+):
+    """Fold ``rows`` into both rollup collections, one bulk write each."""
+    if not rows:
+        return
+    if dealers is None:
+        dealers = await _dealers_for(db, (row[1] for row in rows))
+    for granularity, collection in COLLECTIONS.items():
+        totals: Dict[Tuple, List] = defaultdict(lambda: [0, 0, 0.0, 0])
+        for call_date, customer_id, country, codec, *counters in rows:
+            key = (
+                bucket_start(call_date, granularity),
+                customer_id,
+                dealers.get(customer_id),
+                country,
+                codec,
+            )
+            sums = totals[key]
+            for i, value in enumerate(counters):
+                sums[i] += value
+        await db[collection].bulk_write(
+            [
+                UpdateOne(
+                    dict(zip(("bucket", *GROUP_FIELDS), key)),
+                    {"$inc": dict(zip(COUNTERS, sums))},
+                    upsert=True,
+                )
+                for key, sums in totals.items()
+            ],
+            ordered=False,
+        )
+
+
+async def apply_traffic_rollups(
+    db, records: List, dealers: Optional[Dict[str, str]] = None
+):
+    await apply_traffic_rows(db, record_rows(records), dealers)
+
+
+def _granularity(start: datetime, end: datetime) -> str:
+    """Daily buckets answer whole-day ranges exactly; anything else is hourly."""
+    if start == bucket_start(start, "day") and end == bucket_start(end, "day"):
+        return "day"
+    return "hour"
+
+
+def _point(doc: Dict) -> TrafficPoint:
+    answered = doc.get("answered", 0)
+    return TrafficPoint(
+        bucket=doc.get("bucket"),
+        key=doc.get("key"),
+        calls=doc.get("calls", 0),
+        seconds=doc.get("seconds", 0),
+        cost=round(doc.get("cost", 0.0), 6),
+        answered=answered,
+        asr=answered / doc["calls"] if doc.get("calls") else 0.0,
+        acd=doc.get("seconds", 0) / answered if answered else 0.0,
+    )
+
+
+async def traffic_report(
+    db,
+    start: datetime,
+    end: datetime,
+    granularity: Optional[str] = None,
+    filters: Optional[Dict[str, str]] = None,
+    group_by: Optional[str] = None,
+    per_bucket: bool = True,
+    sort: Optional[str] = None,
+    limit: int = 0,
+) -> List[TrafficPoint]:
+    """Sum rollups over [start, end), optionally per bucket and/or group."""
+    start, end = _utc(start), _utc(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    if group_by is not None and group_by not in GROUP_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Cannot group by {group_by}")
+    if sort is not None and sort not in COUNTERS:
+        raise HTTPException(status_code=400, detail=f"Cannot sort by {sort}")
+    granularity = granularity or _granularity(start, end)
+    if granularity not in COLLECTIONS:
+        raise HTTPException(status_code=400, detail="granularity is hour or day")
+
+    match: Dict = {"bucket": {"$gte": start, "$lt": end}}
+    match.update({field: value for field, value in (filters or {}).items() if value})
+    group_id: Dict = {}
+    if per_bucket:
+        group_id["bucket"] = "$bucket"
+    if group_by:
+        group_id["key"] = f"${group_by}"
+    pipeline: List[Dict] = [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": group_id or None,
+                **{counter: {"$sum": f"${counter}"} for counter in COUNTERS},
+            }
+        },
+        {"$sort": {sort: -1} if sort else {"_id.bucket": 1, "_id.key": 1}},
+    ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    docs = await db[COLLECTIONS[granularity]].aggregate(pipeline).to_list(length=None)
+    return [_point({**doc, **(doc["_id"] or {})}) for doc in docs]
+
+
+def default_range(
+    start: Optional[datetime], end: Optional[datetime], days: int = 30
+) -> Tuple[datetime, datetime]:
+    """Fill a missing range with the last ``days`` whole days up to today."""
+    if end is None:
+        end = bucket_start(datetime.now(timezone.utc), "day") + timedelta(days=1)
+    if start is None:
+        start = _utc(end) - timedelta(days=days)
+    return start, end
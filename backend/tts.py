@@ -0,0 +1,436 @@
+"""Rendering and caching of campaign script audio.
+
+Audio is content-addressed: ``render_key`` hashes the text, voice, language
+and output format, and the key is the file name in ``TTS_CACHE_DIR`` (the
+dialplan's ``/var/lib/asterisk/sounds/tts``) as well as the script's
+``audio_id``. A script that was rendered before, by any campaign, is never
+synthesized again.
+
+A render asks the synthesizer for a WAV in whatever rate and channels it
+produces and converts it to 8 kHz 16-bit mono, which Asterisk plays without
+transcoding, in a process pool so the event loop is never blocked.
+Concurrent renders of one key share a single synthesis.
+
+The cache is bounded by ``TTS_CACHE_MAX_MB`` and evicts the least recently
+used files first, except the audio of running campaigns: those of this
+worker are pinned in memory, and those of other workers are looked up in
+Mongo before every write to the cache. Its index is rebuilt from the
+directory at startup and falls back to the directory on a miss, so several
+workers can share it.
+
+``CampaignDialer`` pre-renders its script before placing the first call.
+``TTS_SYNTHESIZER`` selects ``elevenlabs`` (the default when
+``ELEVENLABS_API_KEY`` is set) or ``fake``, a local tone generator:
+
+    TTS_SYNTHESIZER=fake python tts.py --text "Merhaba" --voice v1
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import sys
+import time
+import wave
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Protocol, Set
+
+import numpy as np
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+FORMAT = "wav-8k-mono"
+SAMPLE_RATE = 8000
+DEFAULT_CACHE_DIR = "/var/lib/asterisk/sounds/tts"
+# Low-pass filter length for downsampling
+FILTER_TAPS = 101
+
+
+def render_key(text: str, voice_id: Optional[str], language: str) -> str:
+    payload = json.dumps([text, voice_id or "", language, FORMAT], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def _wav(samples: np.ndarray, rate: int, channels: int = 1) -> bytes:
+    out = io.BytesIO()
+    with wave.open(out, "wb") as dst:
+        dst.setnchannels(channels)
+        dst.setsampwidth(2)
+        dst.setframerate(rate)
+        dst.writeframes(samples.astype("<i2").tobytes())
+    return out.getvalue()
+
+
+def convert_to_wav8k(data: bytes) -> bytes:
+    """Any 8/16/32-bit PCM WAV -> 8 kHz 16-bit mono WAV (runs in the pool)."""
+    with wave.open(io.BytesIO(data)) as src:
+        channels = src.getnchannels()
+        width = src.getsampwidth()
+        rate = src.getframerate()
+        frames = src.readframes(src.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(frames, np.uint8).astype(np.float64) - 128) * 256
+    elif width == 2:
+        samples = np.frombuffer(frames, "<i2").astype(np.float64)
+    elif width == 4:
+        samples = np.frombuffer(frames, "<i4").astype(np.float64) / 65536
+    else:
+        raise ValueError(f"Unsupported sample width: {width}")
+    samples = samples[: len(samples) // channels * channels]
+    samples = samples.reshape(-1, channels).mean(axis=1)
+    if rate > SAMPLE_RATE:
+        # Windowed-sinc low-pass below the new Nyquist frequency, then resample
+        cutoff = 0.45 * SAMPLE_RATE / rate
+        n = np.arange(FILTER_TAPS) - (FILTER_TAPS - 1) / 2
+        taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(FILTER_TAPS)
+        samples = np.convolve(samples, taps / taps.sum(), mode="same")
+    if rate != SAMPLE_RATE and len(samples):
+        count = int(len(samples) * SAMPLE_RATE / rate)
+        positions = np.arange(count) * (rate / SAMPLE_RATE)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+    return _wav(np.clip(np.round(samples), -32768, 32767), SAMPLE_RATE)
+
+
+class Synthesizer(Protocol):
+    async def synthesize(
+        self, text: str, voice_id: Optional[str], language: str
+    ) -> bytes:
+        """WAV audio of ``text``."""
+
+
+class FakeSynthesizer:
+    """Stand-in that renders a tone as long as the text would take to say.
+
+    Produces 22.05 kHz stereo, so conversion is exercised as with a real one.
+    """
+
+    def __init__(self, delay: Optional[float] = None, rate: int = 22050):
+        if delay is None:
+            delay = int(os.environ.get("FAKE_TTS_DELAY_MS", 0)) / 1000
+        self.delay = delay
+        self.rate = rate
+        self.calls = 0
+
+    async def synthesize(
+        self, text: str, voice_id: Optional[str], language: str
+    ) -> bytes:
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        seconds = min(0.5 + 0.06 * len(text), 120.0)
+        seed = int(render_key(text, voice_id, language)[:4], 16)
+        frequency = 300 + seed % 500
+        t = np.arange(int(seconds * self.rate)) / self.rate
+        tone = 8000 * np.sin(2 * math.pi * frequency * t)
+        return _wav(np.repeat(tone, 2), self.rate, channels=2)
+
+
+class ElevenLabsSynthesizer:
+    def __init__(self):
+        self.api_key = os.environ["ELEVENLABS_API_KEY"]
+        self.base_url = os.environ.get(
+            "ELEVENLABS_BASE_URL", "https://api.elevenlabs.io"
+        )
+        self.default_voice = os.environ.get(
+            "ELEVENLABS_DEFAULT_VOICE_ID", "21m00Tcm4TlvDq8ikWAM"
+        )
+        self.model_id = os.environ.get("ELEVENLABS_MODEL_ID", "eleven_multilingual_v2")
+
+    async def synthesize(
+        self, text: str, voice_id: Optional[str], language: str
+    ) -> bytes:
+        import httpx
+
+        # Raw 16 kHz PCM needs no decoding, unlike the default MP3
+        async with httpx.AsyncClient(timeout=60) as client:
+            response = await client.post(
+                f"{self.base_url}/v1/text-to-speech/{voice_id or self.default_voice}",
+                params={"output_format": "pcm_16000"},
+                headers={"xi-api-key": self.api_key},
+                json={"text": text, "model_id": self.model_id},
+            )
+            response.raise_for_status()
+        return _wav(np.frombuffer(response.content, "<i2"), 16000)
+
+
+def default_synthesizer() -> Optional[Synthesizer]:
+    """Build the synthesizer selected by ``TTS_SYNTHESIZER``."""
+    kind = os.environ.get("TTS_SYNTHESIZER", "").lower()
+    if kind == "fake":
+        return FakeSynthesizer()
+    if kind == "elevenlabs" or (not kind and os.environ.get("ELEVENLABS_API_KEY")):
+        return ElevenLabsSynthesizer()
+    return None
+
+
+class TtsCacheMetrics(BaseModel):
+    files: int
+    size_bytes: int
+    max_bytes: int
+    pinned: int
+    hits: int
+    renders: int
+    evictions: int
+    render_seconds: float
+
+
+class DiskCache:
+    """``{key}.wav`` files under ``directory``, least recently used first."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._files: "OrderedDict[str, int]" = OrderedDict()  # key -> size
+        self.size = 0
+        self._pins: Dict[str, int] = {}
+        # Audio of campaigns running anywhere, as of the last refresh
+        self._shared_pins: Set[str] = set()
+        self.evictions = 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.wav")
+
+    def scan(self):
+        """Index the files already there, oldest access first."""
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            name, ext = os.path.splitext(entry.name)
+            if ext == ".wav" and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, name, stat.st_size))
+        self._files.clear()
+        self.size = 0
+        for _, key, size in sorted(entries):
+            self._files[key] = size
+            self.size += size
+
+    def get(self, key: str) -> Optional[str]:
+        path = self.path(key)
+        try:
+            # Marks it used for other workers and the next scan
+            os.utime(path)
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            if key in self._files:
+                self.size -= self._files.pop(key)
+            return None
+        if key not in self._files:
+            # Rendered by another worker
+            self._files[key] = size
+            self.size += size
+        self._files.move_to_end(key)
+        return path
+
+    def put(self, key: str, data: bytes) -> str:
+        path = self.path(key)
+        temp = os.path.join(self.directory, f".{key}.{os.getpid()}.tmp")
+        with open(temp, "wb") as f:
+            f.write(data)
+        os.replace(temp, path)
+        if key in self._files:
+            self.size -= self._files.pop(key)
+        self._files[key] = len(data)
+        self.size += len(data)
+        # Never the file just written, which the caller is about to play
+        self._evict(keep=key)
+        return path
+
+    def pin(self, key: str):
+        self._pins[key] = self._pins.get(key, 0) + 1
+
+    def unpin(self, key: str):
+        count = self._pins.get(key, 0) - 1
+        if count > 0:
+            self._pins[key] = count
+        else:
+            self._pins.pop(key, None)
+
+    def set_shared_pins(self, keys: Iterable[str]):
+        self._shared_pins = set(keys)
+
+    def _evict(self, keep: Optional[str] = None):
+        for key in list(self._files):
+            if self.size <= self.max_bytes:
+                return
+            if key == keep or key in self._pins or key in self._shared_pins:
+                continue
+            self.size -= self._files.pop(key)
+            self.evictions += 1
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+
+class TtsRenderer:
+    def __init__(
+        self,
+        cache: DiskCache,
+        synthesizer_factory=default_synthesizer,
+        workers: int = 2,
+    ):
+        self.cache = cache
+        self.synthesizer_factory = synthesizer_factory
+        self._synthesizer: Optional[Synthesizer] = None
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._rendering: Dict[str, asyncio.Task] = {}
+        self._scanned = False
+        self._db = None
+        self.hits = 0
+        self.renders = 0
+        self.render_seconds = 0.0
+
+    @property
+    def synthesizer(self) -> Optional[Synthesizer]:
+        if self._synthesizer is None:
+            self._synthesizer = self.synthesizer_factory()
+        return self._synthesizer
+
+    def set_synthesizer(self, synthesizer: Synthesizer):
+        self._synthesizer = synthesizer
+
+    async def start(self, db=None):
+        """Index the cache directory; a failure is retried on first render."""
+        self._db = db
+        if self._scanned or self.synthesizer is None:
+            return
+        try:
+            await asyncio.to_thread(self.cache.scan)
+            self._scanned = True
+        except OSError:
+            logger.exception("Cannot index TTS cache %s", self.cache.directory)
+
+    async def render(self, text: str, voice_id: Optional[str], language: str) -> str:
+        """Audio id of ``text``, synthesizing it only if it is not cached."""
+        key = render_key(text, voice_id, language)
+        if self.cache.get(key) is not None:
+            self.hits += 1
+            return key
+        task = self._rendering.get(key)
+        if task is None:
+            # Its own task, so a cancelled caller does not cancel the others
+            task = asyncio.create_task(self._render(key, text, voice_id, language))
+            self._rendering[key] = task
+            task.add_done_callback(lambda _: self._finished(key, task))
+        await asyncio.shield(task)
+        return key
+
+    def _finished(self, key: str, task: asyncio.Task):
+        self._rendering.pop(key, None)
+        if not task.cancelled():
+            # Retrieved here too in case every caller was cancelled
+            task.exception()
+
+    async def _render(
+        self, key: str, text: str, voice_id: Optional[str], language: str
+    ):
+        synthesizer = self.synthesizer
+        if synthesizer is None:
+            raise RuntimeError("No TTS synthesizer configured")
+        if not self._scanned:
+            await asyncio.to_thread(self.cache.scan)
+            self._scanned = True
+        started = time.perf_counter()
+        audio = await synthesizer.synthesize(text, voice_id, language)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        wav = await loop.run_in_executor(self._pool, convert_to_wav8k, audio)
+        if self._db is not None:
+            # Eviction must see campaigns started since the last write
+            await self.refresh_pins(self._db)
+        await asyncio.to_thread(self.cache.put, key, wav)
+        self.renders += 1
+        self.render_seconds += time.perf_counter() - started
+        logger.info("Rendered %s (%d bytes)", key, len(wav))
+
+    async def prepare(self, db, script: Dict) -> Optional[str]:
+        """Render ``script`` before dialing and pin it until ``release``.
+
+        Returns None without a synthesizer; the script's own ``audio_id``
+        is then used as is.
+        """
+        if self.synthesizer is None:
+            return None
+        key = await self.render(
+            script["text"], script.get("voice_id"), script.get("language", "en-US")
+        )
+        self.cache.pin(key)
+        if script.get("audio_id") != key:
+            await db.platinum_scripts.update_one(
+                {"id": script["id"]}, {"$set": {"audio_id": key}}
+            )
+        return key
+
+    async def refresh_pins(self, db):
+        """Keep the audio of campaigns running on any worker from eviction."""
+        script_ids = await db.platinum_campaigns.distinct(
+            "script_id", {"status": "running"}
+        )
+        keys = await db.platinum_scripts.distinct(
+            "audio_id", {"id": {"$in": script_ids}}
+        )
+        self.cache.set_shared_pins(key for key in keys if key)
+
+    def release(self, key: Optional[str]):
+        if key is not None:
+            self.cache.unpin(key)
+
+    def metrics(self) -> TtsCacheMetrics:
+        return TtsCacheMetrics(
+            files=len(self.cache._files),
+            size_bytes=self.cache.size,
+            max_bytes=self.cache.max_bytes,
+            pinned=len(self.cache._pins),
+            hits=self.hits,
+            renders=self.renders,
+            evictions=self.cache.evictions,
+            render_seconds=round(self.render_seconds, 3),
+        )
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+tts_renderer = TtsRenderer(
+    DiskCache(
+        os.environ.get("TTS_CACHE_DIR", DEFAULT_CACHE_DIR),
+        int(os.environ.get("TTS_CACHE_MAX_MB", 2048)) * 1024 * 1024,
+    ),
+    workers=int(os.environ.get("TTS_RENDER_WORKERS", 2)),
+)
+
+
+async def _main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Render script audio into the cache")
+    parser.add_argument("--text", required=True)
+    parser.add_argument("--voice")
+    parser.add_argument("--language", default="tr-TR")
+    parser.add_argument("--cache-dir", default=tts_renderer.cache.directory)
+    args = parser.parse_args(argv)
+
+    renderer = TtsRenderer(DiskCache(args.cache_dir, tts_renderer.cache.max_bytes))
+    try:
+        for attempt in ("first", "again"):
+            started = time.perf_counter()
+            key = await renderer.render(args.text, args.voice, args.language)
+            elapsed = (time.perf_counter() - started) * 1000
+            print(f"{attempt}: {renderer.cache.path(key)} in {elapsed:.1f} ms")
+    finally:
+        renderer.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
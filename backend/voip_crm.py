@@ -1,17 +1,22 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile
 from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
+from motor.motor_asyncio import AsyncIOMotorDatabase
 import uuid
 
-router = APIRouter(prefix="/api/voip-crm", tags=["voip-crm"])
+from admission import GateMetrics, admission_controller, trunk_key
+from call_registry import LiveCall, call_registry
+from crm_stats import increment_statistics, rebuild_statistics, statistics_cache
+from database import get_db
+from event_hub import ACTIVE_CALLS_TOPIC, event_hub, sse_response
+from pagination import Page, fetch_page
+from rating import rating_engine
+from rerating import RerateReport, RerateRequest, get_job, start_rerate
+from rollups import ReconcileReport, apply_rollups, get_reconcile_job, start_reconcile
+from traffic_rollups import TrafficPoint, default_range, traffic_report
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+router = APIRouter(prefix="/api/voip-crm", tags=["voip-crm"])
 
 # Models
 class Dealer(BaseModel):
@@ -49,6 +54,7 @@ class User(BaseModel):
 
 class TrunkSettings(BaseModel):
     customer_id: str
+    trunk: Optional[str] = None  # Asterisk dial prefix, e.g. "PJSIP/acme"; enforces max_calls
     ip_address: str
     port: int = 5060
     codec: str = "G.711"
@@ -75,6 +81,7 @@ class ActiveCall(BaseModel):
 class CallRecord(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     customer_id: str
+    user_id: Optional[str] = None
     caller_number: str
     called_number: str
     country: str
@@ -89,27 +96,69 @@ class CallRecord(BaseModel):
     audio_url: Optional[str] = None
     codec: Optional[str] = None
 
+class TariffRate(BaseModel):
+    prefix: str  # E.164 destination prefix, e.g. "90532"
+    price_per_minute: float
+    destination: Optional[str] = None
+    initial_increment: int = Field(default=60, ge=1)  # e.g. 60/60 or 1/1 billing
+    increment: int = Field(default=60, ge=1)
+    min_duration: int = Field(default=0, ge=0)
+
 class Tariff(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
-    price_per_minute: float
+    price_per_minute: float  # per-second fallback for destinations not in rates
     currency: str = "TRY"
     description: Optional[str] = None
+    rates: List[TariffRate] = []
+
+class RateQuote(BaseModel):
+    customer_id: str
+    number: str
+    duration: int
+    prefix: Optional[str] = None
+    destination: Optional[str] = None
+    billable_seconds: int = 0
+    cost: float = 0.0
+
+class IngestError(BaseModel):
+    index: int
+    error: str
+
+class IngestResult(BaseModel):
+    received: int = 0
+    inserted: int = 0
+    failed: int = 0
+    errors: List[IngestError] = []
+
+    def add_error(self, index: int, error: str):
+        self.failed += 1
+        self.errors.append(IngestError(index=index, error=error))
+
+class CdrImportResult(BaseModel):
+    rows: int = 0
+    invalid: int = 0
+    skipped: int = 0
+    call_logs_inserted: int = 0
+    call_logs_updated: int = 0
+    call_records_inserted: int = 0
+    offset: int = 0
 
 # Dealers
 @router.post("/dealers", response_model=Dealer)
-async def create_dealer(dealer: Dealer):
+async def create_dealer(dealer: Dealer, db: AsyncIOMotorDatabase = Depends(get_db)):
     dealer_dict = dealer.dict()
     await db.dealers.insert_one(dealer_dict)
+    await increment_statistics(db, total_dealers=1)
     return dealer
 
 @router.get("/dealers", response_model=List[Dealer])
-async def get_dealers():
+async def get_dealers(db: AsyncIOMotorDatabase = Depends(get_db)):
     dealers = await db.dealers.find().to_list(100)
     return [Dealer(**dealer) for dealer in dealers]
 
 @router.get("/dealers/{dealer_id}", response_model=Dealer)
-async def get_dealer(dealer_id: str):
+async def get_dealer(dealer_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
     dealer = await db.dealers.find_one({"id": dealer_id})
     if not dealer:
         raise HTTPException(status_code=404, detail="Dealer not found")
@@ -117,9 +166,11 @@ async def get_dealer(dealer_id: str):
 
 # Customers
 @router.post("/customers", response_model=Customer)
-async def create_customer(customer: Customer):
+async def create_customer(customer: Customer, db: AsyncIOMotorDatabase = Depends(get_db)):
     customer_dict = customer.dict()
     await db.customers.insert_one(customer_dict)
+    rating_engine.assign_customer(customer.id, customer.tariff)
+    await increment_statistics(db, total_customers=1)
     
     # Update dealer's customer count
     await db.dealers.update_one(
@@ -129,136 +180,278 @@ async def create_customer(customer: Customer):
     return customer
 
 @router.get("/customers", response_model=List[Customer])
-async def get_customers(dealer_id: Optional[str] = None):
+async def get_customers(dealer_id: Optional[str] = None, db: AsyncIOMotorDatabase = Depends(get_db)):
     query = {"dealer_id": dealer_id} if dealer_id else {}
     customers = await db.customers.find(query).to_list(1000)
     return [Customer(**customer) for customer in customers]
 
 @router.get("/customers/{customer_id}", response_model=Customer)
-async def get_customer(customer_id: str):
+async def get_customer(customer_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
     customer = await db.customers.find_one({"id": customer_id})
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     return Customer(**customer)
 
 @router.put("/customers/{customer_id}", response_model=Customer)
-async def update_customer(customer_id: str, customer: Customer):
+async def update_customer(customer_id: str, customer: Customer, db: AsyncIOMotorDatabase = Depends(get_db)):
     customer_dict = customer.dict()
-    await db.customers.update_one(
+    previous = await db.customers.find_one_and_update(
         {"id": customer_id},
-        {"$set": customer_dict}
+        {"$set": customer_dict},
+        projection={"_id": 0, "tariff": 1}
     )
+    rating_engine.assign_customer(customer_id, customer.tariff)
+    if previous and previous.get("tariff", "") != customer.tariff:
+        # Other workers still rate this customer with the old tariff
+        await rating_engine.tariffs_changed(db)
     return customer
 
 # Trunk Settings
 @router.post("/trunk-settings", response_model=TrunkSettings)
-async def create_trunk_settings(settings: TrunkSettings):
+async def create_trunk_settings(settings: TrunkSettings, db: AsyncIOMotorDatabase = Depends(get_db)):
     settings_dict = settings.dict()
     await db.trunk_settings.insert_one(settings_dict)
+    if settings.trunk:
+        admission_controller.set_limit(trunk_key(settings.trunk), settings.max_calls)
     return settings
 
 @router.get("/trunk-settings/{customer_id}", response_model=TrunkSettings)
-async def get_trunk_settings(customer_id: str):
+async def get_trunk_settings(customer_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
     settings = await db.trunk_settings.find_one({"customer_id": customer_id})
     if not settings:
         raise HTTPException(status_code=404, detail="Trunk settings not found")
     return TrunkSettings(**settings)
 
+# Call admission
+@router.get("/admission", response_model=List[GateMetrics])
+async def get_admission_metrics():
+    """Per-trunk slots, queue and wait metrics of this worker"""
+    return admission_controller.metrics()
+
 # Call Records
 @router.post("/call-records", response_model=CallRecord)
-async def create_call_record(record: CallRecord):
+async def create_call_record(record: CallRecord, db: AsyncIOMotorDatabase = Depends(get_db)):
+    await rating_engine.ensure_customers(db, [record.customer_id])
+    rating_engine.rate_record(record)
     record_dict = record.dict()
     await db.call_records.insert_one(record_dict)
     
-    # Update customer stats
-    await db.customers.update_one(
-        {"id": record.customer_id},
-        {
-            "$inc": {
-                "total_minutes": record.duration / 60,
-                "total_calls": 1
-            }
-        }
-    )
+    # Update user, customer and dealer totals, dashboard and traffic stats
+    await apply_rollups(db, [record])
     return record
 
-@router.get("/call-records", response_model=List[CallRecord])
-async def get_call_records(customer_id: Optional[str] = None, limit: int = 100):
+@router.post("/call-records/bulk", response_model=IngestResult)
+async def bulk_create_call_records(request: Request, db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Ingest a JSON array or an NDJSON stream (application/x-ndjson) of call records"""
+    from cdr_ingest import ingest_stream, iter_ndjson, json_array_items
+
+    if "ndjson" in request.headers.get("content-type", ""):
+        items = iter_ndjson(request.stream())
+    else:
+        try:
+            items = json_array_items(await request.body())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return await ingest_stream(db, items)
+
+# Asterisk CDR import
+@router.post("/cdr/import", response_model=CdrImportResult)
+async def import_cdr_upload(file: UploadFile = File(...), db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Import an uploaded Asterisk Master.csv; rows imported before are skipped"""
+    from asterisk_cdr import import_cdr_file
+    return await import_cdr_file(db, file.file, final=True)
+
+@router.post("/cdr/import/master", status_code=202)
+async def import_cdr_master(db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Resume importing the server's Master.csv (ASTERISK_CDR_PATH) in the background"""
+    from asterisk_cdr import master_import_status, start_master_import
+    if not start_master_import(db):
+        raise HTTPException(status_code=409, detail="CDR import already running")
+    return await master_import_status(db)
+
+@router.get("/cdr/import/master")
+async def get_cdr_master_import(db: AsyncIOMotorDatabase = Depends(get_db)):
+    from asterisk_cdr import master_import_status
+    return await master_import_status(db)
+
+@router.get("/call-records", response_model=Page[CallRecord])
+async def get_call_records(
+    customer_id: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
     query = {"customer_id": customer_id} if customer_id else {}
-    records = await db.call_records.find(query).sort("call_date", -1).to_list(limit)
-    return [CallRecord(**record) for record in records]
+    records, next_cursor = await fetch_page(db.call_records, query, "call_date", limit, cursor)
+    return Page(items=[CallRecord(**record) for record in records], next_cursor=next_cursor)
 
 # Tariffs
 @router.post("/tariffs", response_model=Tariff)
-async def create_tariff(tariff: Tariff):
+async def create_tariff(tariff: Tariff, db: AsyncIOMotorDatabase = Depends(get_db)):
     tariff_dict = tariff.dict()
     await db.tariffs.insert_one(tariff_dict)
+    await rating_engine.tariffs_changed(db)
     return tariff
 
+@router.put("/tariffs/{tariff_id}", response_model=Tariff)
+async def update_tariff(tariff_id: str, tariff: Tariff, db: AsyncIOMotorDatabase = Depends(get_db)):
+    tariff.id = tariff_id
+    result = await db.tariffs.update_one({"id": tariff_id}, {"$set": tariff.dict()})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Tariff not found")
+    await rating_engine.tariffs_changed(db)
+    return tariff
+
+@router.post("/tariffs/rerate", response_model=RerateReport, status_code=202)
+async def rerate_call_records(request: RerateRequest, db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Re-cost stored call records with the current tariffs (dry run by default)"""
+    if not request.tariff and not request.customer_ids:
+        raise HTTPException(status_code=400, detail="Pass a tariff or customer_ids")
+    return start_rerate(db, request)
+
+@router.get("/tariffs/rerate/{job_id}", response_model=RerateReport)
+async def get_rerate_job(job_id: str):
+    report = get_job(job_id)
+    if not report:
+        raise HTTPException(status_code=404, detail="Re-rating job not found")
+    return report
+
+@router.get("/rate", response_model=RateQuote)
+async def quote_rate(customer_id: str, number: str, duration: int = 60, db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Price a call with the customer's tariff without storing anything"""
+    await rating_engine.ensure_customers(db, [customer_id])
+    quote = RateQuote(customer_id=customer_id, number=number, duration=duration)
+    rate = rating_engine.lookup(customer_id, number)
+    if rate is None:
+        raise HTTPException(status_code=404, detail="No tariff for customer")
+    quote.prefix = rate.prefix
+    quote.destination = rate.destination
+    quote.billable_seconds = rate.billable_seconds(duration)
+    quote.cost = rate.cost(duration)
+    return quote
+
 @router.get("/tariffs", response_model=List[Tariff])
-async def get_tariffs():
+async def get_tariffs(db: AsyncIOMotorDatabase = Depends(get_db)):
     tariffs = await db.tariffs.find().to_list(100)
     return [Tariff(**tariff) for tariff in tariffs]
 
 # Users
 @router.post("/users", response_model=User)
-async def create_user(user: User):
+async def create_user(user: User, db: AsyncIOMotorDatabase = Depends(get_db)):
     user_dict = user.dict()
     await db.users.insert_one(user_dict)
+    await increment_statistics(db, total_users=1)
     return user
 
 @router.get("/users", response_model=List[User])
-async def get_users(customer_id: Optional[str] = None):
+async def get_users(customer_id: Optional[str] = None, db: AsyncIOMotorDatabase = Depends(get_db)):
     query = {"customer_id": customer_id} if customer_id else {}
     users = await db.users.find(query).to_list(1000)
     return [User(**user) for user in users]
 
-# Active Calls
+# Active Calls (live in call_registry, snapshotted to active_calls)
 @router.post("/active-calls", response_model=ActiveCall)
-async def create_active_call(call: ActiveCall):
-    call_dict = call.dict()
-    await db.active_calls.insert_one(call_dict)
+async def create_active_call(call: ActiveCall, db: AsyncIOMotorDatabase = Depends(get_db)):
+    await call_registry.add_api_call(db, LiveCall(**call.dict(exclude={"duration"})))
     return call
 
 @router.get("/active-calls", response_model=List[ActiveCall])
-async def get_active_calls():
-    calls = await db.active_calls.find({"status": "active"}).to_list(100)
-    return [ActiveCall(**call) for call in calls]
+async def get_active_calls(status: Optional[str] = "active", db: AsyncIOMotorDatabase = Depends(get_db)):
+    return [ActiveCall(**call) for call in await call_registry.all_calls(db, status)]
+
+@router.get("/active-calls/events")
+async def stream_active_calls(db: AsyncIOMotorDatabase = Depends(get_db)):
+    subscription = event_hub.subscribe(ACTIVE_CALLS_TOPIC)
+    calls = await call_registry.all_calls(db)
+    snapshot = [("snapshot", [ActiveCall(**call) for call in calls])]
+    return sse_response(event_hub, subscription, snapshot)
 
 @router.delete("/active-calls/{call_id}")
-async def terminate_call(call_id: str):
-    result = await db.active_calls.update_one(
-        {"id": call_id},
-        {"$set": {"status": "terminated"}}
-    )
+async def terminate_call(call_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
+    if not await call_registry.terminate(db, call_id):
+        raise HTTPException(status_code=404, detail="Call not found")
     return {"success": True, "message": "Call terminated"}
 
+# Rollup reconciliation
+@router.post("/rollups/reconcile", response_model=ReconcileReport, status_code=202)
+async def reconcile_rollups(apply: bool = False, db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Recount user/customer/dealer totals from call records; repairs drift when apply=true"""
+    return start_reconcile(db, apply)
+
+@router.get("/rollups/reconcile/{job_id}", response_model=ReconcileReport)
+async def get_reconcile_rollups(job_id: str):
+    report = get_reconcile_job(job_id)
+    if not report:
+        raise HTTPException(status_code=404, detail="Reconciliation job not found")
+    return report
+
+# Analytics (served from the hourly/daily traffic rollups)
+@router.get("/analytics/traffic", response_model=List[TrafficPoint])
+async def get_traffic(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    granularity: Optional[str] = Query(None, pattern="^(hour|day)$"),
+    group_by: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    dealer_id: Optional[str] = None,
+    country: Optional[str] = None,
+    codec: Optional[str] = None,
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Time series of calls, seconds, cost, ASR and ACD; defaults to the last 30 days"""
+    start, end = default_range(start, end)
+    filters = {"customer_id": customer_id, "dealer_id": dealer_id, "country": country, "codec": codec}
+    return await traffic_report(db, start, end, granularity, filters, group_by)
+
+@router.get("/analytics/top-destinations", response_model=List[TrafficPoint])
+async def get_top_destinations(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    by: str = Query("calls", pattern="^(calls|seconds|cost)$"),
+    limit: int = Query(10, ge=1, le=100),
+    customer_id: Optional[str] = None,
+    dealer_id: Optional[str] = None,
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    start, end = default_range(start, end)
+    filters = {"customer_id": customer_id, "dealer_id": dealer_id}
+    return await traffic_report(
+        db, start, end, filters=filters, group_by="country", per_bucket=False, sort=by, limit=limit
+    )
+
+@router.get("/analytics/quality", response_model=List[TrafficPoint])
+async def get_call_quality(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    group_by: str = "country",
+    customer_id: Optional[str] = None,
+    dealer_id: Optional[str] = None,
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """ASR and ACD per country, customer, dealer or codec over the range"""
+    start, end = default_range(start, end)
+    filters = {"customer_id": customer_id, "dealer_id": dealer_id}
+    return await traffic_report(
+        db, start, end, filters=filters, group_by=group_by, per_bucket=False, sort="calls"
+    )
+
 # Statistics
 @router.get("/statistics")
-async def get_statistics():
-    total_dealers = await db.dealers.count_documents({})
-    total_customers = await db.customers.count_documents({})
-    total_users = await db.users.count_documents({})
-    active_calls = await db.active_calls.count_documents({"status": "active"})
-    
-    # Calculate total call duration
-    pipeline = [
-        {"$group": {
-            "_id": None,
-            "total_duration": {"$sum": "$duration"},
-            "total_calls": {"$sum": 1}
-        }}
-    ]
-    call_stats = await db.call_records.aggregate(pipeline).to_list(1)
-    
-    total_duration = call_stats[0]["total_duration"] if call_stats else 0
-    total_calls = call_stats[0]["total_calls"] if call_stats else 0
-    
+async def get_statistics(db: AsyncIOMotorDatabase = Depends(get_db)):
+    # Materialized totals, maintained by the write paths (see crm_stats.py)
+    stats = await statistics_cache.get(db)
     return {
-        "total_dealers": total_dealers,
-        "total_customers": total_customers,
-        "total_users": total_users,
-        "active_calls": active_calls,
-        "total_call_duration_minutes": total_duration / 60,
-        "total_calls": total_calls
+        "total_dealers": stats["total_dealers"],
+        "total_customers": stats["total_customers"],
+        "total_users": stats["total_users"],
+        "active_calls": stats["active_calls"],
+        "total_call_duration_minutes": stats["total_duration"] / 60,
+        "total_calls": stats["total_calls"]
     }
+
+@router.post("/statistics/rebuild")
+async def rebuild_statistics_document(db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Recompute the materialized totals with a full scan"""
+    await rebuild_statistics(db)
+    statistics_cache.invalidate()
+    return await get_statistics(db)
@@ -47,7 +47,7 @@ const VoIPCRM = () => {
       setStats(statsRes.data);
       setDealers(dealersRes.data);
       setCustomers(customersRes.data);
-      setCallRecords(callsRes.data);
+      setCallRecords(callsRes.data.items);
     } catch (error) {
       console.error('Error loading data:', error);
     }
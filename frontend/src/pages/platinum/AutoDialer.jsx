@@ -29,8 +29,8 @@ export default function AutoDialer() {
       const response = await fetch("/platinum/campaigns/");
       const data = await response.json();
 
-      if (Array.isArray(data)) {
-        setCampaigns(data);
+      if (Array.isArray(data.items)) {
+        setCampaigns(data.items);
       }
     } catch (err) {
       // Silent fail
@@ -42,8 +42,8 @@ export default function AutoDialer() {
       const response = await fetch("/platinum/campaigns/scripts");
       const data = await response.json();
 
-      if (Array.isArray(data)) {
-        setScripts(data);
+      if (Array.isArray(data.items)) {
+        setScripts(data.items);
       }
     } catch (err) {
       // Silent fail
@@ -96,6 +96,12 @@ export default function AutoDialer() {
           numbers: "",
         });
         fetchCampaigns();
+        const skipped = data.numbers ? data.numbers.invalid + data.numbers.duplicates : 0;
+        if (skipped > 0) {
+          setError({
+            message: `Campaign created with ${data.numbers.accepted} numbers; ${data.numbers.invalid} invalid and ${data.numbers.duplicates} duplicate numbers were skipped`,
+          });
+        }
       } else {
         setError({ message: "Failed to create campaign" });
       }
@@ -28,8 +28,8 @@ export default function CDRAnalytics() {
       const response = await fetch("/platinum/campaigns/");
       const data = await response.json();
 
-      if (Array.isArray(data)) {
-        setCampaigns(data);
+      if (Array.isArray(data.items)) {
+        setCampaigns(data.items);
       }
     } catch (err) {
       // Silent fail
@@ -47,8 +47,8 @@ export default function CDRAnalytics() {
       const response = await fetch(url);
       const data = await response.json();
 
-      if (Array.isArray(data)) {
-        setCallLogs(data);
+      if (Array.isArray(data.items)) {
+        setCallLogs(data.items);
       } else {
         setError({ message: "Failed to fetch call logs" });
       }
@@ -87,8 +87,8 @@ export default function ScriptStudio() {
       const response = await fetch("/platinum/campaigns/scripts");
       const data = await response.json();
 
-      if (Array.isArray(data)) {
-        setScripts(data);
+      if (Array.isArray(data.items)) {
+        setScripts(data.items);
       }
     } catch (err) {
       // Silent fail
@@ -120,7 +120,8 @@ class CRMService {
   async getCallRecords(filters = {}) {
     try {
       const response = await api.get('/api/voip-crm/call-records', { params: filters });
-      return response.data;
+      // Paged response: { items, next_cursor }; pass next_cursor as `cursor` for more
+      return response.data.items;
     } catch (error) {
       console.error('Error fetching call records:', error);
       throw error;
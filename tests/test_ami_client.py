@@ -0,0 +1,138 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from ami_client import AMIOriginator, AMIPool, AMISettings  # noqa: E402
+from dialer import OriginateRequest  # noqa: E402
+from fake_ami import CallScript, FakeAMIServer  # noqa: E402
+from platinum_campaigns import CallStatus  # noqa: E402
+
+SCRIPTS = {
+    "905550000001": CallScript("answer", ring_time=0.02, talk_time=0.02),
+    "905550000002": CallScript("busy", ring_time=0.01),
+    "905550000003": CallScript("noanswer", ring_time=0.03),
+    "905550000004": CallScript("congestion"),
+}
+
+
+def _script(number):
+    return SCRIPTS.get(number, CallScript("answer", ring_time=5.0, talk_time=5.0))
+
+
+def _settings(server, pool_size=2):
+    return AMISettings(
+        host=server.host,
+        port=server.port,
+        username=server.username,
+        secret=server.secret,
+        pool_size=pool_size,
+        originate_timeout_ms=2000,
+    )
+
+
+def _request(number, call_id=None):
+    return OriginateRequest(
+        call_id=call_id or number,
+        campaign_id="c1",
+        number=number,
+        trunk="SIP/test",
+        context="velora-platinum-dialer",
+    )
+
+
+async def _noop():
+    return None
+
+
+def _with_originator(scenario, pool_size=2):
+    async def run():
+        server = await FakeAMIServer(script=_script).start()
+        originator = AMIOriginator(AMIPool(_settings(server, pool_size)))
+        try:
+            return await scenario(server, originator)
+        finally:
+            await originator.close()
+            await server.stop()
+
+    return asyncio.run(run())
+
+
+def test_pool_logs_in_once_per_connection():
+    async def scenario(server, originator):
+        for _ in range(3):
+            await asyncio.gather(
+                *(originator.pool.send_action("Ping") for _ in range(50))
+            )
+        return server.logins
+
+    # Two action connections and the event connection
+    assert _with_originator(scenario) == 3
+
+
+def test_responses_are_routed_by_action_id():
+    async def scenario(server, originator):
+        pool = originator.pool
+        action_ids = [f"test-{i}" for i in range(100)]
+        responses = await asyncio.gather(
+            *(pool.send_action("Ping", action_id=a) for a in action_ids)
+        )
+        return action_ids, responses
+
+    action_ids, responses = _with_originator(scenario, pool_size=1)
+    assert [r["ActionID"] for r in responses] == action_ids
+    assert all(r["Ping"] == "Pong" for r in responses)
+
+
+def test_concurrent_originates_get_their_own_outcome():
+    async def scenario(server, originator):
+        numbers = list(SCRIPTS) * 5
+        results = await asyncio.gather(
+            *(
+                originator.originate(_request(number, f"{i}"), _noop)
+                for i, number in enumerate(numbers)
+            )
+        )
+        return [(r.status, r.hangup_cause) for r in results]
+
+    outcomes = _with_originator(scenario)
+    assert (
+        outcomes
+        == [
+            (CallStatus.COMPLETED, "NORMAL_CLEARING"),
+            (CallStatus.BUSY, "USER_BUSY"),
+            (CallStatus.NOANSWER, "NO_ANSWER"),
+            (CallStatus.FAILED, "NORMAL_CIRCUIT_CONGESTION"),
+        ]
+        * 5
+    )
+
+
+def test_ringing_call_is_hung_up_through_its_varset_channel():
+    async def scenario(server, originator):
+        task = asyncio.create_task(
+            originator.originate(_request("905559999999", "ringing"), _noop)
+        )
+        while not getattr(originator._by_call_id.get("ringing"), "channel", None):
+            await asyncio.sleep(0.01)
+        await originator.hangup("ringing")
+        return await asyncio.wait_for(task, 2)
+
+    result = _with_originator(scenario)
+    assert result.status == CallStatus.NOANSWER
+    assert result.hangup_cause == "NORMAL_CLEARING"
+
+
+def test_pool_reconnects_a_dropped_event_connection():
+    async def scenario(server, originator):
+        first = await originator.originate(_request("905550000002"), _noop)
+        server.disconnect(events=True)
+        await asyncio.sleep(0.05)
+        second = await originator.originate(_request("905550000002"), _noop)
+        return first, second, server.logins
+
+    first, second, logins = _with_originator(scenario)
+    assert (first.status, first.hangup_cause) == (CallStatus.BUSY, "USER_BUSY")
+    assert (second.status, second.hangup_cause) == (CallStatus.BUSY, "USER_BUSY")
+    assert logins == 4
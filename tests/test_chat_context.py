@@ -0,0 +1,104 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from chat_context import ContextManager  # noqa: E402
+
+
+async def _db():
+    db = mongomock_motor.AsyncMongoMockClient()["t"]
+    await db.chat_contexts.create_index("session_id", unique=True)
+    return db
+
+
+async def _turn(manager, db, question, answer="Tamam"):
+    context = await manager.get(db, "s1")
+    manager.record(context, question, answer)
+    await manager.save(db, context)
+    return context
+
+
+async def _stored(db):
+    doc = await db.chat_contexts.find_one({"session_id": "s1"})
+    return [m["content"] for m in doc["messages"] if m["role"] == "user"], doc
+
+
+def test_stale_worker_keeps_turns_stored_by_another():
+    async def scenario():
+        db = await _db()
+        first, second = ContextManager(), ContextManager()
+        await _turn(first, db, "bir")
+        # Both workers now cache the session
+        await _turn(second, db, "iki")
+        stale = await _turn(first, db, "üç")
+        return await _stored(db), stale
+
+    (questions, doc), stale = asyncio.run(scenario())
+    assert questions == ["bir", "iki", "üç"]
+    assert doc["version"] == 3
+    # The worker that lost the race now holds the merged context
+    assert [m["content"] for m in stale.messages if m["role"] == "user"] == questions
+    assert stale.generation == 1
+    assert not stale.unsaved
+
+
+def test_new_session_started_on_two_workers():
+    async def scenario():
+        db = await _db()
+        first, second = ContextManager(), ContextManager()
+        a = await first.get(db, "s1")
+        b = await second.get(db, "s1")
+        first.record(a, "bir", "Tamam")
+        second.record(b, "iki", "Tamam")
+        await first.save(db, a)
+        await second.save(db, b)
+        return await _stored(db)
+
+    questions, doc = asyncio.run(scenario())
+    assert questions == ["bir", "iki"]
+    assert doc["version"] == 2
+
+
+def test_context_stored_without_version_is_taken_over():
+    async def scenario():
+        db = await _db()
+        await db.chat_contexts.insert_one(
+            {
+                "session_id": "s1",
+                "summary": "",
+                "messages": [
+                    {"role": "user", "content": "bir"},
+                    {"role": "assistant", "content": "Tamam"},
+                ],
+            }
+        )
+        await _turn(ContextManager(), db, "iki")
+        return await _stored(db)
+
+    questions, doc = asyncio.run(scenario())
+    assert questions == ["bir", "iki"]
+    assert doc["version"] == 1
+
+
+def test_compaction_after_a_conflict_keeps_both_workers_turns():
+    async def scenario():
+        db = await _db()
+        first = ContextManager(max_turns=2)
+        second = ContextManager(max_turns=2)
+        await _turn(first, db, "bir")
+        await _turn(second, db, "iki")
+        await _turn(second, db, "üç")
+        await _turn(first, db, "dört")
+        return await _stored(db)
+
+    questions, doc = asyncio.run(scenario())
+    # Older turns are folded into the summary, none is lost
+    assert questions[-1] == "dört"
+    for question in ("bir", "iki", "üç"):
+        assert question in questions or question in doc["summary"]
@@ -0,0 +1,52 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+pytest.importorskip("emergentintegrations")
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from starlette.requests import Request  # noqa: E402
+
+import chatbot  # noqa: E402
+from llm_gate import RateLimiter  # noqa: E402
+
+
+def _request(host):
+    return Request({"type": "http", "client": (host, 40000), "headers": []})
+
+
+def test_rate_key_falls_back_to_the_client_address():
+    assert chatbot._rate_key(_request("10.0.0.1"), "s1") == "s1"
+    assert chatbot._rate_key(_request("10.0.0.1"), None) == "client:10.0.0.1"
+    assert chatbot._rate_key(_request("10.0.0.1"), "") == "client:10.0.0.1"
+    request = Request({"type": "http", "headers": []})
+    assert chatbot._rate_key(request, None) == "client:unknown"
+
+
+def test_session_less_chat_is_limited_per_client(monkeypatch):
+    monkeypatch.setattr(chatbot, "rate_limiter", RateLimiter(per_minute=1, burst=2))
+    monkeypatch.delenv("CHAT_LLM", raising=False)
+    monkeypatch.delenv("EMERGENT_LLM_KEY", raising=False)
+    db = mongomock_motor.AsyncMongoMockClient()["t"]
+
+    async def send(host, session_id=None):
+        message = chatbot.ChatMessage(message="Merhaba", session_id=session_id)
+        reply = await chatbot.chat(message, _request(host), db)
+        return reply.response == chatbot.RATE_LIMITED_REPLY
+
+    async def scenario():
+        # Each request without a session gets a new one: the address still counts
+        first = [await send("10.0.0.1") for _ in range(3)]
+        other = await send("10.0.0.2")
+        with_session = await send("10.0.0.1", "s1")
+        await chatbot.drain_writes()
+        return first, other, with_session
+
+    first, other, with_session = asyncio.run(scenario())
+    assert first == [False, False, True]
+    assert other is False
+    assert with_session is False
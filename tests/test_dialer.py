@@ -0,0 +1,171 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from admission import AdmissionController  # noqa: E402
+from dialer import DialerManager, FakeOriginator  # noqa: E402
+from number_lists import store_numbers  # noqa: E402
+from platinum_campaigns import CampaignStatus  # noqa: E402
+
+
+async def _campaign(db, worker_id=None, numbers=20):
+    await db.platinum_scripts.insert_one({"id": "s1", "text": "Merhaba"})
+    campaign = {
+        "id": "c1",
+        "script_id": "s1",
+        "trunk": "t1",
+        "status": CampaignStatus.RUNNING,
+        "concurrency": 5,
+        "stats": {},
+    }
+    if worker_id is not None:
+        campaign["worker_id"] = worker_id
+    await db.platinum_campaigns.insert_one(campaign)
+    await store_numbers(
+        db, "c1", [f"90555{i:07d}" for i in range(numbers)], update_stats=False
+    )
+
+
+async def _status(db):
+    return await db.platinum_campaigns.find_one(
+        {"id": "c1"}, {"_id": 0, "status": 1, "worker_id": 1}
+    )
+
+
+async def _finished(manager):
+    while manager._tasks:
+        await asyncio.sleep(0.01)
+
+
+def test_dials_every_number_to_completion():
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["t"]
+        admission = AdmissionController()
+        await admission.start(db)
+        originator = FakeOriginator(seed=1)
+        manager = DialerManager(lambda: originator, admission=admission)
+        await _campaign(db, worker_id=admission.worker_id)
+        manager.start(db, "c1")
+        await asyncio.wait_for(_finished(manager), 30)
+        await admission.stop()
+        return originator, await _status(db)
+
+    originator, campaign = asyncio.run(scenario())
+    assert campaign == {"status": CampaignStatus.COMPLETED}
+    assert originator.originated >= 20
+    assert originator.max_in_flight <= 5
+
+
+def test_adopts_campaign_of_dead_worker_once():
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["t"]
+        admission = AdmissionController()
+        await admission.start(db)
+        manager = DialerManager(lambda: FakeOriginator(seed=1), admission=admission)
+        await _campaign(db, worker_id="gone")
+        adopted = [await manager.adopt_orphans(db), await manager.adopt_orphans(db)]
+        await asyncio.wait_for(_finished(manager), 30)
+        await admission.stop()
+        return adopted, await _status(db)
+
+    adopted, campaign = asyncio.run(scenario())
+    assert adopted == [1, 0]
+    assert campaign["status"] == CampaignStatus.COMPLETED
+
+
+def test_shutdown_leaves_campaign_for_the_next_start():
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["t"]
+        first = AdmissionController()
+        await first.start(db)
+        slow = FakeOriginator(seed=1, talk_time=(0.2, 0.3))
+        manager = DialerManager(lambda: slow, admission=first)
+        await _campaign(db, worker_id=first.worker_id, numbers=50)
+        manager.start(db, "c1")
+        await asyncio.sleep(0.2)
+        await manager.shutdown()
+        await first.stop()
+        left = await _status(db)
+
+        second = AdmissionController()
+        await second.start(db)
+        restarted = DialerManager(lambda: FakeOriginator(seed=2), admission=second)
+        await restarted.resume(db)
+        resumed = restarted.is_running("c1")
+        await restarted.shutdown()
+        await second.stop()
+        return left, resumed
+
+    left, resumed = asyncio.run(scenario())
+    assert left == {"status": CampaignStatus.RUNNING}
+    assert resumed
+
+
+def test_running_campaign_of_live_worker_is_not_adopted():
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["t"]
+        other = AdmissionController()
+        await other.start(db)
+        admission = AdmissionController()
+        await admission.start(db)
+        manager = DialerManager(lambda: FakeOriginator(seed=1), admission=admission)
+        await _campaign(db, worker_id=other.worker_id)
+        adopted = await manager.adopt_orphans(db)
+        await other.stop()
+        await admission.stop()
+        return adopted
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_dials_numbers_uploaded_while_running():
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["t"]
+        admission = AdmissionController()
+        await admission.start(db)
+        originator = FakeOriginator(answer_rate=1.0, talk_time=(0.2, 0.8), seed=1)
+        manager = DialerManager(lambda: originator, admission=admission)
+        await _campaign(db, worker_id=admission.worker_id, numbers=6)
+        manager.start(db, "c1")
+        # Uploaded once the first six are fetched, calls still in flight
+        await asyncio.sleep(0.5)
+        await store_numbers(db, "c1", ["905559999991", "905559999992"])
+        await asyncio.wait_for(_finished(manager), 30)
+        await admission.stop()
+        dialed = await db.platinum_call_logs.count_documents({"campaign_id": "c1"})
+        return originator, dialed, await _status(db)
+
+    originator, dialed, campaign = asyncio.run(scenario())
+    assert originator.originated == 8
+    assert dialed == 8
+    assert campaign["status"] == CampaignStatus.COMPLETED
+
+
+def test_stop_through_another_worker_hangs_up_calls():
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["t"]
+        admission = AdmissionController()
+        await admission.start(db)
+        # Calls that would talk far longer than the test waits
+        originator = FakeOriginator(answer_rate=1.0, talk_time=(60, 60), seed=1)
+        manager = DialerManager(lambda: originator, admission=admission)
+        await _campaign(db, worker_id=admission.worker_id)
+        manager.start(db, "c1")
+        await asyncio.sleep(0.3)
+        # Only the database knows: the stop came in through another worker
+        await db.platinum_campaigns.update_one(
+            {"id": "c1"}, {"$set": {"status": CampaignStatus.STOPPED}}
+        )
+        await asyncio.wait_for(_finished(manager), 5)
+        await admission.stop()
+        return originator, await _status(db)
+
+    originator, campaign = asyncio.run(scenario())
+    assert campaign["status"] == CampaignStatus.STOPPED
+    assert originator.in_flight == 0
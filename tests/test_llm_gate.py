@@ -0,0 +1,176 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from llm_gate import LlmGate, LlmOverloaded, LlmTimeout, RateLimiter  # noqa: E402
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _gate(max_concurrent=1, max_queue=1, queue_timeout=1.0, timeout=1.0):
+    return LlmGate(max_concurrent, max_queue, queue_timeout, timeout)
+
+
+def test_call_runs_in_a_slot():
+    gate = _gate()
+
+    async def fn():
+        assert gate.in_flight == 1
+        return "ok"
+
+    assert asyncio.run(gate.call(fn)) == "ok"
+    assert gate.in_flight == 0
+    assert gate.admitted == 1
+
+
+def test_full_queue_is_rejected_at_once():
+    gate = _gate(max_concurrent=1, max_queue=1)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return "slow"
+
+        running = asyncio.create_task(gate.call(slow))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(gate.call(slow))
+        await asyncio.sleep(0)
+        assert gate.metrics().queued == 1
+        with pytest.raises(LlmOverloaded):
+            await gate.call(slow)
+        release.set()
+        return await asyncio.gather(running, queued)
+
+    assert asyncio.run(scenario()) == ["slow", "slow"]
+    metrics = gate.metrics()
+    assert metrics.shed == 1
+    assert metrics.admitted == 2
+    assert metrics.in_flight == 0
+    assert metrics.queued == 0
+
+
+def test_queued_call_times_out():
+    gate = _gate(max_concurrent=1, max_queue=5, queue_timeout=0.05)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+
+        running = asyncio.create_task(gate.call(slow))
+        await asyncio.sleep(0)
+        with pytest.raises(LlmOverloaded):
+            await gate.call(slow)
+        assert gate.metrics().queued == 0
+        release.set()
+        await running
+
+    asyncio.run(scenario())
+    assert gate.shed == 1
+    assert gate.in_flight == 0
+
+
+def test_waiters_are_admitted_in_order():
+    gate = _gate(max_concurrent=1, max_queue=3)
+    order = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def first():
+            await release.wait()
+
+        def job(name):
+            async def fn():
+                order.append(name)
+
+            return fn
+
+        running = asyncio.create_task(gate.call(first))
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(gate.call(job(n))) for n in "abc"]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(running, *waiting)
+
+    asyncio.run(scenario())
+    assert order == ["a", "b", "c"]
+    assert gate.in_flight == 0
+
+
+def test_slow_call_times_out_and_frees_its_slot():
+    gate = _gate(timeout=0.05)
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def fast():
+        return "ok"
+
+    async def scenario():
+        with pytest.raises(LlmTimeout):
+            await gate.call(hang)
+        return await gate.call(fast)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert gate.timeouts == 1
+    assert gate.in_flight == 0
+
+
+def test_stream_times_out_between_chunks():
+    gate = _gate(timeout=0.05)
+
+    async def chunks():
+        yield "a"
+        await asyncio.sleep(10)
+        yield "b"
+
+    async def scenario():
+        received = []
+        with pytest.raises(LlmTimeout):
+            async for chunk in gate.stream(chunks):
+                received.append(chunk)
+        return received
+
+    assert asyncio.run(scenario()) == ["a"]
+    assert gate.in_flight == 0
+
+
+def test_rate_limiter_allows_a_burst_then_limits():
+    clock = _Clock()
+    limiter = RateLimiter(per_minute=60, burst=3, clock=clock)
+
+    assert [limiter.allow("s1") for _ in range(4)] == [True, True, True, False]
+    assert limiter.limited == 1
+    # Other keys have their own bucket
+    assert limiter.allow("s2")
+
+
+def test_rate_limiter_refills_at_its_rate():
+    clock = _Clock()
+    limiter = RateLimiter(per_minute=60, burst=2, clock=clock)
+    assert limiter.allow("s1") and limiter.allow("s1")
+    assert not limiter.allow("s1")
+
+    clock.now = 0.5
+    assert not limiter.allow("s1")
+    clock.now = 1.0
+    assert limiter.allow("s1")
+    assert not limiter.allow("s1")
+
+    # Never more than the burst, however long the key was idle
+    clock.now = 1000.0
+    assert [limiter.allow("s1") for _ in range(3)] == [True, True, False]
@@ -0,0 +1,65 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from pacing import CallModel, Pacer, simulate  # noqa: E402
+from platinum_campaigns import Pacing, PacingMode  # noqa: E402
+
+
+def _settings(target, capacity=30):
+    return dict(
+        max_concurrency=300, answer_capacity=capacity, target_abandon_rate=target
+    )
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+@pytest.mark.parametrize("target", [0.01, 0.02, 0.03, 0.05])
+@pytest.mark.parametrize("answer_rate", [0.15, 0.25, 0.5])
+def test_predictive_pacing_holds_the_abandon_target(seed, target, answer_rate):
+    model = CallModel(answer_rate=answer_rate)
+    predictive = simulate(
+        Pacing(mode=PacingMode.PREDICTIVE, **_settings(target)),
+        model,
+        minutes=60,
+        seed=seed,
+    )
+    assert predictive.abandon_rate <= target
+    assert predictive.answered > 0
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_predictive_pacing_beats_fixed_pacing(seed):
+    model = CallModel(answer_rate=0.25)
+    fixed = simulate(
+        Pacing(**_settings(0.03)), model, minutes=60, concurrency=30, seed=seed
+    )
+    predictive = simulate(
+        Pacing(mode=PacingMode.PREDICTIVE, **_settings(0.03)),
+        model,
+        minutes=60,
+        seed=seed,
+    )
+    assert fixed.abandoned == 0
+    assert predictive.completed_per_hour > 1.3 * fixed.completed_per_hour
+    assert predictive.utilization > fixed.utilization
+
+
+def test_pacer_does_not_overdial_before_measuring():
+    pacer = Pacer(max_concurrency=300, capacity=30, target_abandon_rate=0.03)
+    assert pacer.target(0) == 30
+    assert pacer.target(25) == 30
+
+
+def test_abandons_shrink_the_estimate():
+    pacer = Pacer(max_concurrency=300, capacity=30, target_abandon_rate=0.03)
+    for _ in range(200):
+        pacer.unanswered(20.0)
+        pacer.answered(10.0)
+        pacer.hung_up(60.0)
+    before = pacer.target(10)
+    for _ in range(5):
+        pacer.answered(10.0, abandoned=True)
+    assert pacer.target(10) < before
@@ -0,0 +1,39 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from platinum_campaigns import CampaignCreate, create_campaign  # noqa: E402
+
+
+def test_create_campaign_counts_skipped_inline_numbers():
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["t"]
+        await db.platinum_campaign_numbers.create_index(
+            [("campaign_id", 1), ("number", 1)], unique=True
+        )
+        await db.platinum_scripts.insert_one({"id": "s1", "text": "Merhaba"})
+        request = CampaignCreate(
+            name="Kampanya",
+            script_id="s1",
+            trunk="t1",
+            numbers=["905551234567", "905551234568", "905551234567", "abc", ""],
+        )
+        created = await create_campaign(request, db)
+        stored = await db.platinum_campaigns.find_one({"id": created.id})
+        return created, stored
+
+    created, stored = asyncio.run(scenario())
+    assert created.numbers.model_dump() == {
+        "accepted": 2,
+        "duplicates": 1,
+        "invalid": 2,
+        "total": 2,
+    }
+    assert created.stats["total"] == created.stats["pending"] == 2
+    assert stored["stats"]["total"] == 2
@@ -0,0 +1,73 @@
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from rating import Rate, compile_tariff  # noqa: E402
+from rerating import _RateTable, rate_batch, vector_cost  # noqa: E402
+
+
+def _random_rates(rng, count):
+    return [
+        Rate(
+            prefix=str(rng.randrange(1, 999)),
+            price_per_minute=round(rng.uniform(0.001, 3.0), rng.choice([2, 4, 6])),
+            initial_increment=rng.choice([1, 6, 30, 60]),
+            increment=rng.choice([1, 6, 30, 60]),
+            min_duration=rng.choice([0, 0, 30, 60]),
+        )
+        for _ in range(count)
+    ]
+
+
+def test_vector_cost_matches_rate_cost():
+    rng = random.Random(1)
+    rates = _random_rates(rng, 200)
+    # Zero, negative and boundary durations included
+    durations = [0, -5, 1, 5, 6, 7, 29, 30, 31, 59, 60, 61, 3600]
+    durations += [rng.randrange(0, 7200) for _ in range(300)]
+    for rate in rates:
+        expected = np.array([rate.cost(d) for d in durations])
+        actual = vector_cost(
+            np.array(durations, dtype=np.int64),
+            np.full(len(durations), rate.price_per_minute),
+            np.full(len(durations), rate.initial_increment, dtype=np.int64),
+            np.full(len(durations), rate.increment, dtype=np.int64),
+            np.full(len(durations), rate.min_duration, dtype=np.int64),
+        )
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_rate_batch_matches_trie_lookup_and_rate_cost():
+    rng = random.Random(2)
+    tariff = {
+        "price_per_minute": 0.5,
+        "rates": [
+            {"prefix": "90", "price_per_minute": 0.2, "increment": 1},
+            {"prefix": "90532", "price_per_minute": 0.35, "initial_increment": 30},
+            {"prefix": "+44", "price_per_minute": 0.1, "min_duration": 60},
+        ],
+    }
+    trie = compile_tariff(tariff)
+    numbers = ["905321234567", "902121234567", "00447700900123", "15551234567"]
+    docs = [
+        {
+            "customer_id": rng.choice(["a", "b"]),
+            "called_number": rng.choice(numbers),
+            "duration": rng.randrange(0, 900),
+        }
+        for _ in range(500)
+    ]
+    costs, rated = rate_batch(docs, {"a": trie, "b": None}, _RateTable())
+    for doc, cost, was_rated in zip(docs, costs, rated):
+        if doc["customer_id"] == "b":
+            assert not was_rated
+            assert cost == 0
+            continue
+        digits = doc["called_number"].lstrip("0")
+        expected = trie.lookup(digits).cost(doc["duration"])
+        assert was_rated
+        assert cost == expected
@@ -0,0 +1,123 @@
+import asyncio
+import io
+import os
+import sys
+import wave
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from tts import DiskCache, FakeSynthesizer, TtsRenderer, render_key  # noqa: E402
+
+
+def _renderer(directory, max_bytes=10**9):
+    fake = FakeSynthesizer(delay=0)
+    renderer = TtsRenderer(DiskCache(str(directory), max_bytes), lambda: fake)
+    return renderer, fake
+
+
+def test_render_key_is_stable():
+    assert render_key("Merhaba", "v1", "tr-TR") == render_key("Merhaba", "v1", "tr-TR")
+    assert render_key("Merhaba", "v1", "tr-TR") != render_key("Merhaba", "v2", "tr-TR")
+    assert render_key("Merhaba", None, "tr-TR") != render_key("Merhaba", "v1", "en-US")
+
+
+def test_render_miss_then_hit(tmp_path):
+    renderer, fake = _renderer(tmp_path)
+    try:
+        first = asyncio.run(renderer.render("Merhaba", "v1", "tr-TR"))
+        second = asyncio.run(renderer.render("Merhaba", "v1", "tr-TR"))
+    finally:
+        renderer.close()
+    assert first == second == render_key("Merhaba", "v1", "tr-TR")
+    assert fake.calls == 1
+    assert renderer.renders == 1
+    assert renderer.hits == 1
+    assert os.path.exists(renderer.cache.path(first))
+
+
+def test_render_converts_to_8k_mono(tmp_path):
+    renderer, _ = _renderer(tmp_path)
+    try:
+        key = asyncio.run(renderer.render("Merhaba", "v1", "tr-TR"))
+    finally:
+        renderer.close()
+    with wave.open(renderer.cache.path(key)) as audio:
+        assert audio.getframerate() == 8000
+        assert audio.getnchannels() == 1
+        assert audio.getsampwidth() == 2
+        assert audio.getnframes() > 0
+
+
+def _wav_of_size(size):
+    out = io.BytesIO()
+    with wave.open(out, "wb") as dst:
+        dst.setnchannels(1)
+        dst.setsampwidth(2)
+        dst.setframerate(8000)
+        dst.writeframes(b"\0" * (size - 44))
+    return out.getvalue()
+
+
+def test_eviction_skips_pinned_files(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=3000)
+    cache.scan()
+    cache.put("pinned", _wav_of_size(1000))
+    cache.pin("pinned")
+    cache.put("old", _wav_of_size(1000))
+    cache.put("recent", _wav_of_size(1000))
+    # A hit makes "old" the most recently used
+    assert cache.get("old") is not None
+
+    cache.put("new", _wav_of_size(1000))
+
+    assert cache.get("pinned") is not None
+    assert cache.get("recent") is None
+    assert cache.get("old") is not None
+    assert cache.get("new") is not None
+    assert cache.evictions == 1
+    assert not os.path.exists(cache.path("recent"))
+
+    cache.unpin("pinned")
+    cache.put("newest", _wav_of_size(1000))
+    assert cache.get("pinned") is None
+
+
+def test_eviction_skips_audio_of_running_campaigns(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=2000)
+    cache.scan()
+    cache.put("running", _wav_of_size(1000))
+    cache.put("idle", _wav_of_size(1000))
+    cache.set_shared_pins(["running"])
+
+    cache.put("new", _wav_of_size(1000))
+
+    assert cache.get("running") is not None
+    assert cache.get("idle") is None
+
+
+def test_render_keeps_audio_of_campaigns_running_elsewhere(tmp_path):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["t"]
+        renderer, _ = _renderer(tmp_path)
+        await renderer.start(db)
+        try:
+            running = await renderer.render("Kampanya", "v1", "tr-TR")
+            # Room for one file only
+            renderer.cache.max_bytes = renderer.cache.size
+            # Started by another worker: nothing pinned in this process
+            await db.platinum_scripts.insert_one({"id": "s1", "audio_id": running})
+            await db.platinum_campaigns.insert_one(
+                {"id": "c1", "script_id": "s1", "status": "running"}
+            )
+            other = await renderer.render("Başka", "v1", "tr-TR")
+        finally:
+            renderer.close()
+        return renderer.cache, running, other
+
+    cache, running, other = asyncio.run(scenario())
+    assert cache.get(running) is not None
+    assert cache.get(other) is not None